@@ -5,6 +5,7 @@ class MainConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'Main'
     def ready(self):
+        from Main import signals
         self.setup_periodic_task()
 
     @staticmethod
@@ -30,6 +31,87 @@ class MainConfig(AppConfig):
                 name='Prolong Main Proxy Plan',
                 defaults={'task': "prolong_main_proxy_plan"},
             )
+            PeriodicTask.objects.get_or_create(
+                crontab=schedule,
+                name='Rollup Seller Ledger',
+                defaults={'task': "rollup_seller_ledger"},
+            )
+
+            hourly_schedule, _ = CrontabSchedule.objects.get_or_create(
+                minute='00',
+                hour='*',
+                day_of_week='*',
+                day_of_month='*',
+                month_of_year='*',
+                timezone='UTC'
+            )
+            PeriodicTask.objects.get_or_create(
+                crontab=hourly_schedule,
+                name='Rollover Referral Holds',
+                defaults={'task': "rollover_referral_holds"},
+            )
+
+            traffic_schedule, _ = CrontabSchedule.objects.get_or_create(
+                minute='*/5',
+                hour='*',
+                day_of_week='*',
+                day_of_month='*',
+                month_of_year='*',
+                timezone='UTC'
+            )
+            PeriodicTask.objects.get_or_create(
+                crontab=traffic_schedule,
+                name='Refresh Traffic Left',
+                defaults={'task': "refresh_all_traffic_left"},
+            )
+
+            catalog_schedule, _ = CrontabSchedule.objects.get_or_create(
+                minute='*/10',
+                hour='*',
+                day_of_week='*',
+                day_of_month='*',
+                month_of_year='*',
+                timezone='UTC'
+            )
+            PeriodicTask.objects.get_or_create(
+                crontab=catalog_schedule,
+                name='Refresh ProxyDrop Catalog',
+                defaults={'task': "refresh_proxy_drop_catalog"},
+            )
+
+            minutely_schedule, _ = CrontabSchedule.objects.get_or_create(
+                minute='*',
+                hour='*',
+                day_of_week='*',
+                day_of_month='*',
+                month_of_year='*',
+                timezone='UTC'
+            )
+            PeriodicTask.objects.get_or_create(
+                crontab=minutely_schedule,
+                name='Flush User IPs',
+                defaults={'task': "flush_user_ips"},
+            )
+            PeriodicTask.objects.get_or_create(
+                crontab=minutely_schedule,
+                name='Refresh Exchange Rates',
+                defaults={'task': "refresh_exchange_rates"},
+            )
+            PeriodicTask.objects.get_or_create(
+                crontab=minutely_schedule,
+                name='Retry Payment Events',
+                defaults={'task': "retry_payment_events"},
+            )
+            PeriodicTask.objects.get_or_create(
+                crontab=minutely_schedule,
+                name='Retry Product Data Uploads',
+                defaults={'task': "retry_product_data_uploads"},
+            )
+            PeriodicTask.objects.get_or_create(
+                crontab=minutely_schedule,
+                name='Retry Balance Purchases',
+                defaults={'task': "retry_balance_purchases"},
+            )
 
             if created:
                 print('Периодическая задача создана.')
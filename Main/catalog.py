@@ -0,0 +1,197 @@
+from django.db import transaction
+from django.db.models import Q, Count
+
+from Main.celery import app
+from Main.models import Product, Category, CatalogSnapshot
+
+
+class CatalogBuilder:
+    """
+    Сборка витрины товаров (get-cards) для одного ключа снапшота
+    """
+    def __init__(self, product_type=None, category_name=None, tags=None, verified_only=True):
+        self.product_type = product_type
+        self.category_name = category_name
+        self.tags = tags
+        self.verified_only = verified_only
+
+    def build(self):
+        products = self._get_filtered_products()
+        processed_products = []
+        if self.category_name:
+            return self._process_products_by_category(products, processed_products)
+        if self.product_type:
+            return self._process_products_by_type(products, processed_products)
+        return self._process_products_by_type_and_category(products, processed_products)
+
+    def _build_filters(self):
+        filters = []
+        if self.verified_only:
+            filters.append(Q(seller__is_verified=True))
+        if self.category_name:
+            filters.append(Q(categories__name=self.category_name) |
+                           Q(categories__parent_category__name=self.category_name))
+        if self.product_type:
+            filters.append(Q(type=self.product_type))
+        return filters
+
+    def _get_filtered_products(self):
+        filters = self._build_filters()
+        if self.tags:
+            products = Product.objects.filter(tags__id__in=self.tags, *filters) \
+                .annotate(num_tags=Count('tags')) \
+                .filter(num_tags=len(self.tags))
+        else:
+            products = Product.objects.filter(*filters)
+        return products.select_related("seller__user__avatar", "photo").order_by("-is_popular")
+
+    def _process_products_by_category(self, products, processed_products):
+        data = []
+        for product in products:
+            if product.pk in processed_products:
+                continue
+            product_data, skip = self._process_product_and_similars(product, processed_products)
+            if not skip:
+                product_data.pop("category")
+                data.append(product_data)
+        return data
+
+    def _process_products_by_type(self, products, processed_products):
+        data = {}
+        for product in products:
+            if product.pk in processed_products:
+                continue
+            product_data, skip = self._process_product_and_similars(product, processed_products)
+            if not skip:
+                category = product.categories.last()
+                if not category:
+                    continue
+                data.setdefault(category.name, []).append(product_data)
+        if self.product_type == Product.ProductTypes.proxy:
+            sorted_data = dict()
+            for category in ["residential", "datacenter", "isp"]:
+                if category in data:
+                    sorted_data[category] = data[category]
+        else:
+            sorted_data = dict(sorted(data.items(), key=lambda item: len(item[1]), reverse=False))
+        return sorted_data
+
+    def _process_products_by_type_and_category(self, products, processed_products):
+        data = {}
+        for product in products:
+            if product.pk in processed_products:
+                continue
+            product_data, skip = self._process_product_and_similars(product, processed_products)
+            if not skip:
+                category = "Undefined Category"
+                product_category = product.categories.last()
+                if product_category:
+                    category = product_category.name
+                data.setdefault(product.type, {}).setdefault(category, []).append(product_data)
+
+        sorted_data = {
+            type_: dict(sorted(categories.items(), key=lambda item: len(item[1]), reverse=False))
+            for type_, categories in data.items()
+        }
+        sorted_data = dict(
+            sorted(sorted_data.items(), key=lambda item: sum(len(cat) for cat in item[1].values()), reverse=False))
+        return sorted_data
+
+    def _process_product_and_similars(self, product, processed_products):
+        product_data = product.to_dict()
+        skip = False
+        similar_products = []
+        if product.tags.exists():
+            similar_products = get_similar_products(product).select_related("seller__user__avatar")
+        for similar_product in similar_products:
+            if product_data.get("rating") >= similar_product.rating and not similar_product.is_popular:
+                processed_products.append(similar_product.pk)
+                product_data.setdefault("other_sellers", 0)
+                product_data.setdefault("other_sellers_avatars", [])
+                product_data["other_sellers"] += 1
+                if similar_product.seller.user.avatar:
+                    if len(product_data["other_sellers_avatars"]) < 3:
+                        product_data["other_sellers_avatars"].append(similar_product.seller.user.avatar.url)
+            else:
+                processed_products.append(product.pk)
+                skip = True
+
+        return product_data, skip
+
+
+def get_similar_products(product):
+    tags = product.tags.all()
+    similar_products = (
+        Product.objects
+        .filter(categories__in=product.categories.all())
+        .filter(tags__in=tags)
+        .exclude(id=product.pk)
+        .annotate(common_tags=Count('tags'))
+        .order_by('-common_tags')
+    )
+    return similar_products
+
+
+def get_snapshot_key(product_type, category_name, verified_only):
+    return "|".join([
+        product_type or "",
+        category_name or "",
+        str(int(verified_only))
+    ])
+
+
+def filter_by_tags(data, tags):
+    """
+    Отбор карточек с указанными тегами из снапшота, пустые группы отбрасываются
+    """
+    if isinstance(data, list):
+        return [product for product in data if tags <= {str(tag["id"]) for tag in product.get("tags", [])}]
+    filtered = {}
+    for name, group in data.items():
+        group = filter_by_tags(group, tags)
+        if group:
+            filtered[name] = group
+    return filtered
+
+
+def get_catalog_snapshot(product_type, category_name, tags, verified_only):
+    """
+    Витрина из снапшота, при отсутствии снапшота - сборка и сохранение.
+    Снапшоты хранятся только для типов и существующих категорий, теги фильтруются в памяти
+    """
+    if category_name and not Category.objects.filter(name=category_name).exists():
+        return []
+    key = get_snapshot_key(product_type, category_name, verified_only)
+    snapshot = CatalogSnapshot.objects.filter(key=key).first()
+    if snapshot:
+        data = snapshot.data
+    else:
+        data = CatalogBuilder(product_type, category_name, None, verified_only).build()
+        CatalogSnapshot.objects.get_or_create(key=key, defaults=dict(
+            product_type=product_type,
+            category=category_name,
+            verified_only=verified_only,
+            data=data
+        ))
+    if tags:
+        return filter_by_tags(data, set(tags))
+    return data
+
+
+def rebuild_catalog_snapshot(snapshot):
+    snapshot.data = CatalogBuilder(snapshot.product_type, snapshot.category, None, snapshot.verified_only).build()
+    snapshot.save(update_fields=["data", "updated_at"])
+
+
+def mark_catalog_stale(product_types):
+    """
+    Помечает устаревшими снапшоты затронутых типов товаров и ставит задачу на пересборку.
+    Задача отправляется только если появились новые устаревшие снапшоты.
+    """
+    stale = CatalogSnapshot.objects.filter(
+        Q(product_type__isnull=True) | Q(product_type__in=product_types),
+        is_stale=False
+    ).update(is_stale=True)
+    if stale:
+        transaction.on_commit(lambda: app.send_task(name="rebuild_catalog_snapshots",
+                                                    route_name="rebuild_catalog_snapshots"))
@@ -0,0 +1,218 @@
+from collections import defaultdict
+from uuid import uuid4
+
+from celery import group
+from django.db import transaction
+from django.utils import timezone
+from django.db.models import Q, F, Case, When, Value, IntegerField, FloatField
+from rest_framework.exceptions import ValidationError, NotFound
+
+from Main.celery import app
+from Main.models import Product, Purchase, PaymentType, Invoice, TransactionStatus, UserCart
+from Main.utils import cryptomus_create_invoice, stripe_create_invoice
+from Proxy.models import ProxyPurchase, ProxyTypes
+from Users.models import User
+
+MAX_ACTIVE_INVOICES = 30
+
+
+class Checkout:
+    """
+    Оформление корзины пачкой: товары загружаются одним запросом, покупки и прокси создаются bulk_create,
+    корзина обновляется одним UPDATE, выдача оплаченных с баланса покупок ставится в Celery группой
+    """
+    def __init__(self, user, payment_type, items, buyer_message=None):
+        self.user = user
+        self.payment_type = payment_type
+        self.items = items
+        self.buyer_message = buyer_message
+        self.products = {}
+        self.invoice_data = None
+
+    def run(self):
+        self.items = self._parse_items(self.items)
+        if self.payment_type == PaymentType.crypto:
+            self._check_active_invoices()
+        self.products = self._load_products()
+        self._validate()
+        prices = [self.products[item["id"]].get_price(item["quantity"])*item["quantity"] for item in self.items]
+        total = sum(prices)
+        purchase_uuid = uuid4()
+        if self.payment_type == PaymentType.cryptomus:
+            self.invoice_data = cryptomus_create_invoice(self.user.pk, total)
+            purchase_uuid = self.invoice_data.get("uuid")
+        if self.payment_type == PaymentType.stripe:
+            self.invoice_data = stripe_create_invoice(self.user.pk, total)
+            purchase_uuid = self.invoice_data.get("uuid")
+        with transaction.atomic():
+            if self.payment_type == PaymentType.balance:
+                self._charge_balance(prices, total)
+            purchases = Purchase.objects.bulk_create([
+                Purchase(
+                    product=self.products[item["id"]], amount=price,
+                    seller=self.products[item["id"]].seller, buyer=self.user,
+                    payment_type=self.payment_type,
+                    # При оплате с баланса у каждой покупки свой uuid, как в Purchase.save
+                    uuid=uuid4() if self.payment_type == PaymentType.balance else purchase_uuid,
+                    buyer_message=self.buyer_message,
+                    product_options=item["options"], quantity=item["quantity"]
+                )
+                for item, price in zip(self.items, prices)
+            ])
+            self._create_proxy_purchases(purchases)
+            self._update_cart()
+            response_data = self._get_response_data(purchases, purchase_uuid, total)
+            if self.payment_type == PaymentType.balance:
+                transaction.on_commit(lambda: self._provide(purchases))
+        return response_data
+
+    @staticmethod
+    def _parse_items(items):
+        try:
+            items = [
+                {"id": int(item.get("id")), "quantity": int(item.get("quantity")), "options": item.get("options")}
+                for item in items
+            ]
+        except (TypeError, ValueError, AttributeError):
+            raise ValidationError({"message": "Invalid products data!"})
+        if not items or any(item["quantity"] <= 0 for item in items):
+            raise ValidationError({"message": "Invalid quantity!"})
+        return items
+
+    def _check_active_invoices(self):
+        if Invoice.objects.filter(
+            ~Q(purchases__status=TransactionStatus.paid),
+            purchases__buyer_id=self.user.pk,
+            is_active=True,
+            expiration_dt__gte=timezone.now()
+        ).count() >= MAX_ACTIVE_INVOICES:
+            raise ValidationError({"message": "You cannot have more than 30 active unpaid invoices!"})
+
+    def _load_products(self):
+        products = Product.objects.select_related("seller__user").prefetch_related("categories").in_bulk(
+            {item["id"] for item in self.items}
+        )
+        if len(products) < len({item["id"] for item in self.items}):
+            raise NotFound(detail={"message": "Product not found!"})
+        return products
+
+    def _validate(self):
+        quantities = defaultdict(int)
+        for item in self.items:
+            quantities[item["id"]] += item["quantity"]
+        for product_id, quantity in quantities.items():
+            product = self.products[product_id]
+            if product.seller.user_id == self.user.pk:
+                raise ValidationError({"message": "You can't buy from yourself!"})
+            if not product.seller.is_verified and self.user.role not in ["admin", "root_admin"]:
+                raise ValidationError({"message": "Purchase is prohibited!"})
+            if product.in_stock is None:
+                continue
+            if product.in_stock <= 0:
+                raise ValidationError({"message": "Out of stock!"})
+            # Аккаунты и софт выдаются построчно, в остатке должно хватить на всю корзину
+            if product.type in [Product.ProductTypes.account, Product.ProductTypes.soft] and quantity > product.in_stock:
+                raise ValidationError({"message": "Out of stock!"})
+
+    def _charge_balance(self, prices, total):
+        if not User.objects.filter(pk=self.user.pk, balance__gte=total).update(balance=F("balance") - total):
+            raise ValidationError({"message": "Insufficient balance!"})
+        seller_amounts = defaultdict(float)
+        for item, price in zip(self.items, prices):
+            seller_amounts[self.products[item["id"]].seller.user_id] += price
+        User.objects.filter(pk__in=seller_amounts).update(balance=F("balance") + Case(
+            *[When(pk=user_id, then=Value(amount)) for user_id, amount in seller_amounts.items()],
+            output_field=FloatField()
+        ))
+        self.user.balance -= total
+
+    @staticmethod
+    def _get_proxy_type(product):
+        categories = list(product.categories.all())
+        return max(categories, key=lambda category: category.pk) if categories else None
+
+    def _create_proxy_purchases(self, purchases):
+        proxy_purchases = [
+            (purchase, self._get_proxy_type(purchase.product))
+            for purchase in purchases if purchase.product.type == Product.ProductTypes.proxy
+        ]
+        if not proxy_purchases:
+            return
+        # Последняя действующая покупка прокси того же типа у продавца продлевается, а не создаётся заново
+        extendable = {
+            (purchase.seller_id, proxy_type.name)
+            for purchase, proxy_type in proxy_purchases if proxy_type.name != ProxyTypes.ISP
+        }
+        latest = {}
+        if extendable:
+            for old_proxy_purchase in ProxyPurchase.objects.filter(
+                purchase__buyer=self.user,
+                purchase__seller_id__in={seller_id for seller_id, _ in extendable},
+                type__name__in={name for _, name in extendable}
+            ).exclude(status=ProxyPurchase.ProxyPurchaseStatus.EXPIRED).exclude(service_data={}).select_related(
+                "purchase", "type"
+            ).order_by("pk"):
+                latest[(old_proxy_purchase.purchase.seller_id, old_proxy_purchase.type.name)] = old_proxy_purchase
+        now = timezone.now().timestamp()
+        expired = [
+            old_proxy_purchase.pk for old_proxy_purchase in latest.values()
+            if old_proxy_purchase.expiration_date.timestamp() < now
+        ]
+        if expired:
+            ProxyPurchase.objects.filter(pk__in=expired).update(status=ProxyPurchase.ProxyPurchaseStatus.EXPIRED)
+        new_proxy_purchases = []
+        for purchase, proxy_type in proxy_purchases:
+            extend_of = None
+            if proxy_type.name != ProxyTypes.ISP:
+                old_proxy_purchase = latest.get((purchase.seller_id, proxy_type.name))
+                if old_proxy_purchase and old_proxy_purchase.pk not in expired:
+                    extend_of = old_proxy_purchase
+            country = None
+            if proxy_type.name == ProxyTypes.ISP:
+                country = (purchase.product_options or {}).get("country")
+            new_proxy_purchases.append(ProxyPurchase(
+                purchase=purchase, type=proxy_type,
+                count=purchase.quantity,
+                extend_of=extend_of,
+                country=country
+            ))
+        ProxyPurchase.objects.bulk_create(new_proxy_purchases)
+
+    def _update_cart(self):
+        quantities = defaultdict(int)
+        for item in self.items:
+            quantities[item["id"]] += item["quantity"]
+        cart = UserCart.objects.filter(user=self.user, product_id__in=quantities)
+        if not cart.update(amount=F("amount") - Case(
+            *[When(product_id=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+            output_field=IntegerField()
+        )):
+            return
+        cart.filter(amount__lte=0).delete()
+
+    def _get_response_data(self, purchases, purchase_uuid, total):
+        if self.payment_type == PaymentType.cryptomus:
+            return {"url": f"https://pay.cryptomus.com/pay/{purchase_uuid}"}
+        if self.payment_type == PaymentType.stripe:
+            return {"url": self.invoice_data["url"]}
+        if self.payment_type == PaymentType.crypto:
+            invoice = Invoice(
+                amount_usd=total,
+            )
+            invoice.save()
+            invoice.purchases.set(purchases)
+            return {"url": f"https://gemups.com/payment/{invoice.uuid}"}
+        return {"message": "Successful purchase!"}
+
+    @staticmethod
+    def _provide(purchases):
+        provide_purchases([purchase.pk for purchase in purchases])
+
+
+def provide_purchases(purchase_ids):
+    """
+    Выдача оплаченных с баланса покупок одной группой задач process_purchase
+    """
+    group(
+        app.signature("process_purchase", kwargs={"purchase_id": purchase_id}) for purchase_id in purchase_ids
+    ).apply_async()
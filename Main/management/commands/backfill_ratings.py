@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+
+from Main.models import Product, Review
+from Users.models import Seller
+
+
+class Command(BaseCommand):
+    help = "Пересчёт агрегатов рейтинга (reviews_count, rating_sum, rating) товаров и продавцов по отзывам"
+
+    @staticmethod
+    def _backfill(model, group_field):
+        stats = Review.objects.values(group_field).annotate(count=Count("id"), total=Sum("rating"))
+        objects = []
+        for stat in stats:
+            objects.append(model(
+                id=stat[group_field],
+                reviews_count=stat["count"],
+                rating_sum=stat["total"],
+                rating=stat["total"]/stat["count"]
+            ))
+        model.objects.update(reviews_count=0, rating_sum=0, rating=0.0)
+        model.objects.bulk_update(objects, ["reviews_count", "rating_sum", "rating"], batch_size=1000)
+        return len(objects)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            products = self._backfill(Product, "product_id")
+            sellers = self._backfill(Seller, "product__seller_id")
+        self.stdout.write(self.style.SUCCESS(f"Ratings updated: {products} products, {sellers} sellers"))
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Main', '0068_alter_balancetopup_payment_type_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(unique=True)),
+                ('product_type', models.CharField(blank=True, choices=[('proxy', 'Прокси'), ('account', 'Аккаунт'), ('soft', 'Софт')], db_index=True, null=True)),
+                ('category', models.CharField(blank=True, null=True)),
+                ('tags', models.CharField(blank=True, null=True)),
+                ('verified_only', models.BooleanField(default=True)),
+                ('data', models.JSONField(default=dict)),
+                ('is_stale', models.BooleanField(db_index=True, default=False)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'catalog_snapshots',
+            },
+        ),
+    ]
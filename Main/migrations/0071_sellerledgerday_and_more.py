@@ -0,0 +1,41 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:18
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Main', '0070_product_rating_product_rating_sum_and_more'),
+        ('Users', '0039_seller_rating_seller_rating_sum_seller_reviews_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SellerLedgerDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(db_index=True)),
+                ('sales_count', models.IntegerField(default=0)),
+                ('sales_amount', models.FloatField(default=0)),
+                ('withdrawn_amount', models.FloatField(default=0)),
+            ],
+            options={
+                'db_table': 'seller_ledger_days',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='purchase',
+            index=models.Index(fields=['seller', 'created_at'], name='purchases_seller__721fa4_idx'),
+        ),
+        migrations.AddField(
+            model_name='sellerledgerday',
+            name='seller',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Users.seller'),
+        ),
+        migrations.AddConstraint(
+            model_name='sellerledgerday',
+            constraint=models.UniqueConstraint(fields=('seller', 'day'), name='unique_seller_ledger_day'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:21
+
+from datetime import timedelta
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Q, Sum, Count
+from django.utils import timezone
+
+
+def backfill_referral_balances(apps, schema_editor):
+    ReferralTransaction = apps.get_model("Main", "ReferralTransaction")
+    ReferralBalance = apps.get_model("Main", "ReferralBalance")
+    hold_from = timezone.now() - timedelta(days=3)
+    ReferralTransaction.objects.filter(type="accrual", created_at__lte=hold_from).update(is_credited=True)
+    rows = ReferralTransaction.objects.filter(to_user__isnull=False).values("to_user_id").annotate(
+        accrued=Sum("amount", filter=Q(type="accrual")),
+        held=Sum("amount", filter=Q(type="accrual", is_credited=False)),
+        withdrawn=Sum("amount", filter=Q(type="withdraw")),
+        total_users=Count("from_user", filter=Q(type="accrual"), distinct=True),
+    )
+    ReferralBalance.objects.bulk_create([
+        ReferralBalance(
+            user_id=row["to_user_id"],
+            accrued=round(row["accrued"] or 0, 2),
+            held=round(row["held"] or 0, 2),
+            withdrawn=round(row["withdrawn"] or 0, 2),
+            capped=(row["accrued"] or 0) >= 500,
+            total_users=row["total_users"],
+        ) for row in rows
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Main', '0071_sellerledgerday_and_more'),
+        ('Users', '0039_seller_rating_seller_rating_sum_seller_reviews_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='referraltransaction',
+            name='is_credited',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.CreateModel(
+            name='ReferralBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('accrued', models.FloatField(default=0)),
+                ('held', models.FloatField(default=0)),
+                ('withdrawn', models.FloatField(default=0)),
+                ('capped', models.BooleanField(default=False)),
+                ('total_users', models.IntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='Users.user')),
+            ],
+            options={
+                'db_table': 'referral_balances',
+            },
+        ),
+        migrations.RunPython(backfill_referral_balances, migrations.RunPython.noop),
+    ]
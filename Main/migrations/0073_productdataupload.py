@@ -0,0 +1,32 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Main', '0072_referralbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDataUpload',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField()),
+                ('size', models.BigIntegerField(default=0)),
+                ('offset', models.BigIntegerField(default=0)),
+                ('lines_added', models.IntegerField(default=0)),
+                ('status', models.CharField(choices=[('process', 'В обработке'), ('done', 'Загружено'), ('error', 'Ошибка')], db_index=True, default='process')),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='Main.product')),
+            ],
+            options={
+                'db_table': 'product_data_uploads',
+            },
+        ),
+    ]
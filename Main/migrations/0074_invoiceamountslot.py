@@ -0,0 +1,45 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def backfill_invoice_amount_slots(apps, schema_editor):
+    Invoice = apps.get_model("Main", "Invoice")
+    InvoiceAmountSlot = apps.get_model("Main", "InvoiceAmountSlot")
+    invoices = Invoice.objects.filter(
+        network__isnull=False, currency__isnull=False, amount__isnull=False,
+        expiration_dt__gte=timezone.now()
+    )
+    InvoiceAmountSlot.objects.bulk_create([
+        InvoiceAmountSlot(network=invoice.network, currency=invoice.currency, amount=invoice.amount,
+                          invoice_id=invoice.pk, expires_at=invoice.expiration_dt)
+        for invoice in invoices.iterator()
+    ], batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Main', '0073_productdataupload'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InvoiceAmountSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('network', models.CharField()),
+                ('currency', models.CharField()),
+                ('amount', models.DecimalField(decimal_places=3, max_digits=10)),
+                ('expires_at', models.DateTimeField()),
+                ('invoice', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='Main.invoice')),
+            ],
+            options={
+                'db_table': 'invoice_amount_slots',
+                'constraints': [models.UniqueConstraint(fields=('network', 'currency', 'amount'), name='unique_invoice_amount_slot')],
+            },
+        ),
+        migrations.RunPython(backfill_invoice_amount_slots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Main', '0074_invoiceamountslot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(choices=[('cryptomus', 'Cryptomus'), ('crypto', 'Криптоплатежи'), ('stripe', 'Stripe')])),
+                ('key', models.CharField()),
+                ('payload', models.JSONField()),
+                ('remote_addr', models.CharField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('new', 'Новое'), ('done', 'Обработано'), ('ignored', 'Пропущено'), ('error', 'Ошибка')], db_index=True, default='new')),
+                ('attempts', models.IntegerField(default=0)),
+                ('error', models.TextField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'payment_events',
+                'constraints': [models.UniqueConstraint(fields=('provider', 'key'), name='unique_payment_event')],
+            },
+        ),
+    ]
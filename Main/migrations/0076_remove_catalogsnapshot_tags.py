@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:53
+
+from django.db import migrations
+
+
+def delete_catalog_snapshots(apps, schema_editor):
+    # Ключи снапшотов изменились, витрина соберётся заново при первом запросе
+    apps.get_model("Main", "CatalogSnapshot").objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Main', '0075_paymentevent'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_catalog_snapshots, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='catalogsnapshot',
+            name='tags',
+        ),
+    ]
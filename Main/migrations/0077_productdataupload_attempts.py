@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Main', '0076_remove_catalogsnapshot_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productdataupload',
+            name='attempts',
+            field=models.IntegerField(default=0),
+        ),
+    ]
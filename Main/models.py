@@ -1,19 +1,21 @@
 import datetime
+import zlib
 from datetime import timedelta
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 from uuid import uuid4
 
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction, IntegrityError
+from django.db.models import Q, F, Case, When, Value, Sum, Count, Max, Subquery
+from django.db.models.functions import Cast, TruncDate
+from django.utils import timezone
 
 from rest_framework.exceptions import ValidationError
 from django.core.files.base import ContentFile
 
-import requests
-
-from Main.utils import delete_file_from_s3, cryptomus_create_invoice, get_wallets_and_contracts_by_network, \
+from Main.utils import delete_file_from_s3, iter_s3_file, cryptomus_create_invoice, get_wallets_and_contracts_by_network, \
     upload_file_to_s3
 from Main.celery import app
+from Main.rates import get_rate
 from Proxy.models import ProxyPurchase, ProxyTypes
 
 from Users.models import Seller, User
@@ -65,6 +67,9 @@ class Product(models.Model):
     in_stock = models.IntegerField(blank=True, null=True)
     sold = models.IntegerField(default=0, db_index=True)
     is_popular = models.BooleanField(default=False)
+    reviews_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    rating = models.FloatField(default=0.0, db_index=True)
 
     class Meta:
         db_table = 'products'
@@ -74,10 +79,6 @@ class Product(models.Model):
                        "id": self.seller.id,
                        "is_verified": self.seller.is_verified,
                        "photo": self.seller.user.avatar.url if self.seller.user.avatar else None}
-        reviews = [review.rating for review in Review.objects.filter(product_id=self.pk)]
-        rating = 0.0
-        if reviews:
-            rating = sum(reviews)/len(reviews)
         data = dict(
             id=self.pk, title=self.title, description=self.description,
             seller_info=seller_info,
@@ -86,7 +87,7 @@ class Product(models.Model):
             tags=[tag.to_dict() for tag in self.tags.all()],
             category=self.categories.last().name if self.categories.last() else None,
             sold=self.sold,
-            rating=rating,
+            rating=self.rating,
             unit=Units.get_unit(self),
             in_stock=self.in_stock,
             photo=self.photo.url if self.photo else None,
@@ -117,6 +118,30 @@ class Product(models.Model):
     def get_commission(self):
         return PRODUCTS_COMMISSIONS.get(self.type)
 
+    def update_stock(self, in_stock=0, sold=0):
+        """
+        Изменение остатка и продаж F-выражениями, снапшоты витрины помечаются устаревшими
+        """
+        from Main.catalog import mark_catalog_stale
+
+        Product.objects.filter(pk=self.pk).update(in_stock=F("in_stock") + in_stock, sold=F("sold") + sold)
+        if self.in_stock is not None:
+            self.in_stock += in_stock
+        self.sold += sold
+        mark_catalog_stale([self.type])
+
+    @staticmethod
+    def get_commission_case(field="type"):
+        """
+        Комиссия по типу товара в виде SQL-выражения CASE
+        """
+        return Case(
+            *[When(**{field: product_type}, then=Value(commission))
+              for product_type, commission in PRODUCTS_COMMISSIONS.items()],
+            default=Value(0.0),
+            output_field=models.FloatField()
+        )
+
 
 class Tag(models.Model):
     name = models.CharField(max_length=25, unique=True)
@@ -167,6 +192,109 @@ class ProductData(models.Model):
     class Meta:
         db_table = "products_data"
 
+    @staticmethod
+    def allocate(product_id, purchase_id, quantity):
+        """
+        Закрепляет за покупкой до quantity свободных единиц одним UPDATE с FOR UPDATE SKIP LOCKED.
+        Возвращает число закреплённых единиц, вызывать внутри transaction.atomic
+        """
+        free_ids = ProductData.objects.select_for_update(skip_locked=True).filter(
+            product_id=product_id,
+            is_sold=False
+        ).order_by("id").values("id")[:quantity]
+        return ProductData.objects.filter(id__in=Subquery(free_ids)).update(is_sold=True, purchase_id=purchase_id)
+
+    @staticmethod
+    def stream(purchase_id, chunk_size=2000, compress=False):
+        """
+        Данные покупки частями по chunk_size строк через серверный курсор, при compress - поток gzip
+        """
+        compressor = zlib.compressobj(wbits=31) if compress else None
+        lines = []
+        separator = ""
+        rows = ProductData.objects.filter(purchase_id=purchase_id).order_by("id").values_list("data", flat=True)
+        for data in rows.iterator(chunk_size=chunk_size):
+            lines.append(data)
+            if len(lines) >= chunk_size:
+                chunk = separator + "\n".join(lines)
+                separator = "\n"
+                lines = []
+                yield compressor.compress(chunk.encode()) if compressor else chunk.encode()
+        if lines:
+            chunk = separator + "\n".join(lines)
+            yield compressor.compress(chunk.encode()) if compressor else chunk.encode()
+        if compressor:
+            yield compressor.flush()
+
+
+class ProductDataUpload(models.Model):
+    class Statuses(models.TextChoices):
+        process = "process", "В обработке"
+        done = "done", "Загружено"
+        error = "error", "Ошибка"
+
+    product = models.ForeignKey("Product", models.CASCADE)
+    key = models.CharField()
+    size = models.BigIntegerField(default=0)
+    offset = models.BigIntegerField(default=0)
+    lines_added = models.IntegerField(default=0)
+    status = models.CharField(choices=Statuses.choices, default=Statuses.process, db_index=True)
+    error = models.TextField(blank=True, null=True)
+    attempts = models.IntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    BATCH_SIZE = 5000
+    MAX_ATTEMPTS = 5
+    # Загрузка в обработке без новых пачек дольше STALE_MINUTES считается потерянной брокером или воркером
+    STALE_MINUTES = 10
+
+    class Meta:
+        db_table = "product_data_uploads"
+
+    def ingest(self):
+        """
+        Потоковая загрузка строк файла пачками с позиции offset.
+        Строки, остаток и offset фиксируются в одной транзакции, поэтому повторный запуск продолжает с места остановки
+        """
+        lines = []
+        consumed = 0
+        tail = b""
+        for chunk in iter_s3_file(self.key, self.offset):
+            *complete, tail = (tail + chunk).split(b"\n")
+            for line in complete:
+                consumed += len(line) + 1
+                line = line.rstrip(b"\r")
+                if line:
+                    lines.append(line)
+                if len(lines) >= self.BATCH_SIZE:
+                    self._commit_batch(lines, consumed)
+                    lines, consumed = [], 0
+        if tail.rstrip(b"\r"):
+            lines.append(tail.rstrip(b"\r"))
+        consumed += len(tail)
+        if lines:
+            self._commit_batch(lines, consumed)
+        self.status = ProductDataUpload.Statuses.done
+        self.save(update_fields=["status", "updated_at"])
+
+    def _commit_batch(self, lines, consumed):
+        with transaction.atomic():
+            ProductData.objects.bulk_create([
+                ProductData(product_id=self.product_id, data=line.decode("utf-8", errors="replace"))
+                for line in lines
+            ], batch_size=1000)
+            self.product.update_stock(in_stock=len(lines))
+            self.offset += consumed
+            self.lines_added += len(lines)
+            self.save(update_fields=["offset", "lines_added", "updated_at"])
+
+    def to_dict(self):
+        return dict(id=self.pk, product_id=self.product_id, status=self.status,
+                    lines_added=self.lines_added,
+                    progress=round(self.offset/self.size*100, 2) if self.size else 100,
+                    created_at=self.created_at, updated_at=self.updated_at)
+
 
 class File(models.Model):
     class FileType(models.TextChoices):
@@ -185,7 +313,7 @@ class File(models.Model):
 
 
 def get_exp_invoice():
-    return datetime.datetime.now() + timedelta(hours=12)
+    return timezone.now() + timedelta(hours=12)
 
 
 class Invoice(models.Model):
@@ -203,6 +331,7 @@ class Invoice(models.Model):
     balance_top_up = models.ForeignKey("BalanceTopUp", models.SET_NULL, blank=True, null=True)
     type = models.CharField(choices=[("balance", "Пополнение баланса"), ("purchase", "Покупка товара")],
                             default="purchase", db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
 
     def save(
         self,
@@ -212,30 +341,23 @@ class Invoice(models.Model):
         using=None,
         update_fields=None,
     ):
-        if self.currency and self.network:
-            max_invoice = Invoice.objects.filter(
-                ~Q(purchases__status__in=[TransactionStatus.paid, TransactionStatus.paid_over]),
-                ~Q(balance_top_up__status__in=[TransactionStatus.paid, TransactionStatus.paid_over]),
-                amount_usd=self.amount_usd,
-                expiration_dt__gte=datetime.datetime.now(), network=self.network, currency=self.currency
-            ).exclude(id=self.pk).order_by("-amount").first()
-            if self.currency != "USDT":
-                url_binance = f"https://api.binance.com/api/v3/ticker/price?symbol={self.currency}USDT"
-                data = requests.get(url_binance)
-                data = data.json()
-                self.amount_crypto = float(data["price"])
-            else:
-                self.amount_crypto = self.amount_usd
-            self.amount = Decimal(self.amount_crypto)
-            if max_invoice:
-                self.amount = max_invoice.amount + Decimal(0.001)
-            else:
-                self.amount += Decimal(0.001)
-            self.is_active = True
-            self.expiration_dt = get_exp_invoice()
-        return super().save(*args, force_insert=force_insert,
-                            force_update=force_update,
-                            using=using, update_fields=update_fields)
+        # Сумма закрепляется один раз при выборе валюты и сети, последующие сохранения её не меняют
+        if not (self.currency and self.network) or self.amount is not None:
+            return super().save(*args, force_insert=force_insert,
+                                force_update=force_update,
+                                using=using, update_fields=update_fields)
+        # Курс берётся из кэша без обращения к бирже, при его отсутствии или устаревании - RateUnavailable
+        self.amount_crypto = self.amount_usd / get_rate(self.currency)
+        self.is_active = True
+        self.expiration_dt = get_exp_invoice()
+        with transaction.atomic():
+            if self._state.adding:
+                super().save(using=using)
+                force_insert = False
+            self.amount = InvoiceAmountSlot.allocate(self)
+            return super().save(*args, force_insert=force_insert,
+                                force_update=force_update,
+                                using=using, update_fields=update_fields)
 
     def to_dict(self):
         to_address = None
@@ -256,6 +378,63 @@ class Invoice(models.Model):
         db_table = 'invoices'
 
 
+class InvoiceAmountSlot(models.Model):
+    """
+    Занятые суммы криптосчетов: по сети и валюте одна сумма принадлежит одному действующему счёту
+    """
+    network = models.CharField()
+    currency = models.CharField()
+    amount = models.DecimalField(max_digits=10, decimal_places=3)
+    invoice = models.OneToOneField("Invoice", models.SET_NULL, blank=True, null=True)
+    expires_at = models.DateTimeField()
+
+    STEP = Decimal("0.001")
+    MAX_OFFSET = 1000
+    ATTEMPTS = 5
+
+    class Meta:
+        db_table = "invoice_amount_slots"
+        constraints = [
+            models.UniqueConstraint(fields=["network", "currency", "amount"], name="unique_invoice_amount_slot")
+        ]
+
+    @classmethod
+    def allocate(cls, invoice):
+        """
+        Уникальная сумма к оплате: наименьшая сумма выше amount_crypto, не занятая действующим счётом.
+        Истёкший слот переиспользуется, только если это и есть эта сумма. Гонки разрешают условный UPDATE
+        и уникальный индекс, вызывать внутри transaction.atomic
+        """
+        base = Decimal(str(invoice.amount_crypto)).quantize(cls.STEP, ROUND_HALF_UP)
+        limit = base + cls.STEP * cls.MAX_OFFSET
+        slots = cls.objects.filter(network=invoice.network, currency=invoice.currency)
+        cls.release(invoice)
+        for _ in range(cls.ATTEMPTS):
+            now = timezone.now()
+            held = set(slots.filter(amount__gt=base, amount__lte=limit, expires_at__gte=now)
+                       .values_list("amount", flat=True))
+            amount = base + cls.STEP
+            while amount in held:
+                amount += cls.STEP
+            if amount > limit:
+                break
+            if slots.filter(amount=amount, expires_at__lt=now).update(invoice=invoice,
+                                                                      expires_at=invoice.expiration_dt):
+                return amount
+            try:
+                with transaction.atomic():
+                    cls.objects.create(network=invoice.network, currency=invoice.currency, amount=amount,
+                                       invoice=invoice, expires_at=invoice.expiration_dt)
+                return amount
+            except IntegrityError:
+                continue
+        raise ValidationError({"message": "Too many active invoices for this amount, try again later!"})
+
+    @classmethod
+    def release(cls, invoice):
+        cls.objects.filter(invoice=invoice).update(invoice=None, expires_at=timezone.now())
+
+
 class Purchase(models.Model):
     uuid = models.UUIDField(blank=True, null=True)
     status = models.CharField(choices=TransactionStatus.choices,
@@ -276,6 +455,25 @@ class Purchase(models.Model):
 
     class Meta:
         db_table = 'purchases'
+        indexes = [models.Index(fields=["seller", "created_at"])]
+
+    @staticmethod
+    def get_seller_stat_aggregates(hold_from=None):
+        """
+        Агрегаты статистики продавца: продажи за вычетом комиссии и выводы на баланс.
+        Вывод - покупка, где покупатель сам продавец
+        """
+        amount = Cast("amount", models.FloatField())
+        net_amount = amount - amount*Product.get_commission_case("product__type")
+        withdraw = Q(buyer_id=F("seller__user_id"))
+        aggregates = dict(
+            sales_count=Count("id", filter=~withdraw),
+            sales_amount=Sum(net_amount, filter=~withdraw),
+            withdrawn_amount=Sum(amount, filter=withdraw),
+        )
+        if hold_from:
+            aggregates["hold_amount"] = Sum(net_amount, filter=~withdraw & Q(created_at__gte=hold_from))
+        return aggregates
 
     def save(
         self,
@@ -288,53 +486,69 @@ class Purchase(models.Model):
         skip = False
         if args and args[0] == True:
             skip = True
-        if not self.pk and not skip:
-            if self.payment_type == PaymentType.balance:
-                self.uuid = uuid4()
+        if not self.pk and not skip and self.payment_type == PaymentType.balance:
+            self.uuid = uuid4()
+            # Списание условным UPDATE: параллельные покупки не уведут баланс в минус и не потеряют изменения
+            with transaction.atomic():
                 self.save(True)
-                balance = self.buyer.balance
-                if balance < self.amount:
+                if not User.objects.filter(pk=self.buyer_id, balance__gte=self.amount).update(
+                    balance=F("balance") - self.amount
+                ):
                     raise ValidationError({"message": "Insufficient balance!"})
-                self.buyer.balance -= self.amount
-                self.buyer.save()
-                self.seller.user.balance += self.amount
-                self.seller.user.save()
+                User.objects.filter(pk=self.seller.user_id).update(balance=F("balance") + self.amount)
+                self.buyer.balance -= float(self.amount)
+                self.seller.user.balance += float(self.amount)
+                return super().save(*args, force_insert=False,
+                                    force_update=force_update,
+                                    using=using, update_fields=update_fields)
         return super().save(*args, force_insert=force_insert,
                             force_update=force_update,
                             using=using, update_fields=update_fields)
 
+    def refund(self):
+        """
+        Возврат средств за покупку с баланса, которую не удалось выдать. Покупка отменяется,
+        списание с покупателя и зачисление продавцу откатываются F-выражениями
+        """
+        with transaction.atomic():
+            if not Purchase.objects.filter(pk=self.pk, status=TransactionStatus.check).update(
+                status=TransactionStatus.cancel
+            ):
+                return False
+            User.objects.filter(pk=self.buyer_id).update(balance=F("balance") + float(self.amount))
+            User.objects.filter(pk=self.seller.user_id).update(balance=F("balance") - float(self.amount))
+        self.status = TransactionStatus.cancel
+        return True
+
     def process(self):
-        self.status = TransactionStatus.paid
-        self.save()
-        self.product.sold += 1
-        self.product.save()
-        if self.product.type == Product.ProductTypes.proxy:
-            self.provided = True
-            self.save()
-            app.send_task(name="buy_proxy", route_name="buy_proxy", kwargs={"proxy_purchase": self.pk})
-        elif self.product.type in [Product.ProductTypes.account, Product.ProductTypes.soft]:
-            for i in range(self.quantity):
-                product_data = ProductData.objects.filter(product_id=self.product.pk, is_sold=False).first()
-                product_data.is_sold = True
-                product_data.purchase_id = self.pk
-                product_data.save()
-                self.product.in_stock -= 1
-                self.product.save()
-                self.product.seller.balance += self.amount - self.amount*self.product.get_commission()
-                self.product.seller.save()
-                self.save()
-            self.provided = True
-            self.save()
-        else:
-            self.product.in_stock -= 1
-            self.product.save()
-        referral_amount = float(self.amount)-float(self.amount)*self.product.get_commission()
-        ReferralTransaction.referral_calculation(
-            self.buyer.referral_from,
-            self.buyer,
-            referral_amount,
-            self.pk
-        )
+        """
+        Выдача оплаченной покупки в одной транзакции, счётчики и балансы меняются F-выражениями
+        """
+        product = self.product
+        seller_amount = float(self.amount) - float(self.amount)*product.get_commission()
+        with transaction.atomic():
+            self.status = TransactionStatus.paid
+            if product.type == Product.ProductTypes.proxy:
+                self.provided = True
+                product.update_stock(sold=1)
+                transaction.on_commit(lambda: app.send_task(name="buy_proxy", route_name="buy_proxy",
+                                                            kwargs={"proxy_purchase": self.pk}))
+            elif product.type in [Product.ProductTypes.account, Product.ProductTypes.soft]:
+                allocated = ProductData.allocate(product.pk, self.pk, self.quantity)
+                if allocated < self.quantity:
+                    raise ValidationError({"message": "Not enough products in stock!"})
+                product.update_stock(in_stock=-allocated, sold=1)
+                Seller.objects.filter(pk=product.seller_id).update(balance=F("balance") + seller_amount)
+                self.provided = True
+            else:
+                product.update_stock(in_stock=-1, sold=1)
+            self.save(update_fields=["status", "provided"])
+            ReferralTransaction.referral_calculation(
+                self.buyer.referral_from,
+                self.buyer,
+                seller_amount,
+                self.pk
+            )
 
 
 class BalanceTopUp(models.Model):
@@ -372,10 +586,147 @@ class BalanceTopUp(models.Model):
                             force_update=force_update,
                             using=using, update_fields=update_fields)
     def process(self):
-        self.status = TransactionStatus.paid
-        self.save()
-        self.buyer.balance += self.amount
-        self.buyer.save()
+        with transaction.atomic():
+            self.status = TransactionStatus.paid
+            self.save(update_fields=["status"])
+            User.objects.filter(pk=self.buyer_id).update(balance=F("balance") + self.amount)
+
+
+class PaymentEvent(models.Model):
+    """
+    Входящие уведомления платёжных систем, ключ не даёт обработать повтор уведомления дважды
+    """
+    class Providers(models.TextChoices):
+        cryptomus = "cryptomus", "Cryptomus"
+        crypto = "crypto", "Криптоплатежи"
+        stripe = "stripe", "Stripe"
+
+    class Statuses(models.TextChoices):
+        new = "new", "Новое"
+        done = "done", "Обработано"
+        ignored = "ignored", "Пропущено"
+        error = "error", "Ошибка"
+
+    provider = models.CharField(choices=Providers.choices)
+    key = models.CharField()
+    payload = models.JSONField()
+    remote_addr = models.CharField(blank=True, null=True)
+    status = models.CharField(choices=Statuses.choices, default=Statuses.new, db_index=True)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    MAX_ATTEMPTS = 5
+
+    class Meta:
+        db_table = "payment_events"
+        constraints = [
+            models.UniqueConstraint(fields=["provider", "key"], name="unique_payment_event")
+        ]
+
+    @classmethod
+    def register(cls, provider, key, payload, remote_addr=None):
+        """
+        Сохраняет уведомление и ставит его в очередь, повторное с тем же ключом только возвращается
+        """
+        event, created = cls.objects.get_or_create(provider=provider, key=key, defaults={
+            "payload": payload,
+            "remote_addr": remote_addr
+        })
+        if created:
+            transaction.on_commit(lambda: app.send_task(name="process_payment_event",
+                                                        route_name="process_payment_event",
+                                                        kwargs={"event_id": event.pk}))
+        return event
+
+    def process(self):
+        """
+        Обработка уведомления в одной транзакции. Строки счёта и платежей блокируются,
+        поэтому уведомления по одному счёту обрабатываются по очереди
+        """
+        try:
+            with transaction.atomic():
+                event = PaymentEvent.objects.select_for_update().get(pk=self.pk)
+                if event.status in [PaymentEvent.Statuses.done, PaymentEvent.Statuses.ignored]:
+                    return event.status
+                handlers = {
+                    PaymentEvent.Providers.cryptomus: self._process_cryptomus,
+                    PaymentEvent.Providers.crypto: self._process_crypto,
+                    PaymentEvent.Providers.stripe: self._process_stripe
+                }
+                processed = handlers[event.provider](event.payload)
+                # Счёт или покупка могут стать видны позже уведомления, поэтому ненайденное повторяется до MAX_ATTEMPTS
+                self.status = PaymentEvent.Statuses.done if processed else PaymentEvent.Statuses.error
+                self.error = None if processed else "No unpaid transaction found"
+                PaymentEvent.objects.filter(pk=self.pk).update(status=self.status, error=self.error,
+                                                               attempts=F("attempts") + 1,
+                                                               processed_at=timezone.now())
+        except Exception as e:
+            self.status = PaymentEvent.Statuses.error
+            PaymentEvent.objects.filter(pk=self.pk).update(status=self.status, error=str(e),
+                                                           attempts=F("attempts") + 1)
+            raise
+        return self.status
+
+    @staticmethod
+    def _process_cryptomus(payload):
+        transactions = list(Purchase.objects.select_for_update().filter(
+            uuid=payload.get("uuid")
+        ).exclude(status=TransactionStatus.paid))
+        if not transactions:
+            transactions = list(BalanceTopUp.objects.select_for_update().filter(
+                uuid=payload.get("uuid")
+            ).exclude(status=TransactionStatus.paid))
+        for payment in transactions:
+            payment.txid = payload.get("txid")
+            payment.status = payload.get("status")
+            payment.save()
+            if payment.status == TransactionStatus.paid:
+                payment.process()
+            if payment.status == TransactionStatus.paid_over:
+                payment.amount = float(payload.get("payment_amount_usd"))
+                payment.save()
+                payment.process()
+        return bool(transactions)
+
+    @staticmethod
+    def _process_crypto(payload):
+        invoices = Invoice.objects.select_for_update(of=("self",)).filter(
+            amount=Decimal(payload.get("amount")),
+            currency=payload.get("ticker"),
+            network=payload.get("network"),
+            expiration_dt__gte=timezone.now()
+        )
+        # Перевод, сделанный раньше создания счёта, к нему не относится
+        if timestamp := payload.get("timestamp"):
+            invoices = invoices.filter(created_at__lte=datetime.datetime.fromtimestamp(
+                int(timestamp) / 10**3, tz=datetime.timezone.utc
+            ))
+        invoice = (invoices.exclude(purchases__status=TransactionStatus.paid).first()
+                   or invoices.exclude(balance_top_up__status=TransactionStatus.paid).first())
+        if not invoice:
+            return False
+        if invoice.type == "balance":
+            balance_top_up = BalanceTopUp.objects.select_for_update().get(pk=invoice.balance_top_up_id)
+            if balance_top_up.status != TransactionStatus.paid:
+                balance_top_up.process()
+        else:
+            for purchase in invoice.purchases.select_for_update().exclude(status=TransactionStatus.paid):
+                purchase.process()
+        InvoiceAmountSlot.release(invoice)
+        return True
+
+    @staticmethod
+    def _process_stripe(payload):
+        uuid = payload.get("uuid")
+        payment = Purchase.objects.select_for_update().filter(uuid=uuid).first()
+        if not payment:
+            payment = BalanceTopUp.objects.select_for_update().filter(uuid=uuid).first()
+        if not payment or payment.status == TransactionStatus.paid:
+            return False
+        payment.process()
+        return True
 
 
 class UserCart(models.Model):
@@ -448,6 +799,24 @@ class Review(models.Model):
     class Meta:
         db_table = 'reviews'
 
+    def update_ratings(self, count=1):
+        """
+        Обновление агрегатов рейтинга товара и продавца.
+        count=1 - отзыв добавлен, count=-1 - отзыв удалён
+        """
+        delta = self.rating * count
+        values = dict(
+            reviews_count=F("reviews_count") + count,
+            rating_sum=F("rating_sum") + delta,
+            rating=Case(
+                When(reviews_count__gt=-count,
+                     then=Cast(F("rating_sum") + delta, models.FloatField()) / (F("reviews_count") + count)),
+                default=Value(0.0)
+            )
+        )
+        Product.objects.filter(id=self.product_id).update(**values)
+        Seller.objects.filter(product__id=self.product_id).update(**values)
+
     def to_dict(self):
         return dict(text=self.text,
                     rating=self.rating,
@@ -473,20 +842,22 @@ class ReferralTransaction(models.Model):
     transaction = models.ForeignKey("Main.Purchase", models.SET_NULL, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     type = models.CharField(choices=Types.choices, default=Types.accrual, db_index=True)
+    is_credited = models.BooleanField(default=False, db_index=True)
 
     @staticmethod
     def referral_calculation(to_user, buyer, amount, purchase_id):
         i = 1
         for level in REFERRAL_LEVELS:
             if to_user:
-                total_amount = sum([rt.amount for rt in ReferralTransaction.objects.filter(to_user=to_user)])
-                if not total_amount >= 500:
-                    amount = amount/100*level
-                    if total_amount+amount > 500:
-                        amount -= total_amount+amount-500
-                    referral_transaction = ReferralTransaction(from_user=buyer, to_user=to_user,
-                                                               amount=amount, level=i, transaction_id=purchase_id)
-                    referral_transaction.save()
+                with transaction.atomic():
+                    referral_balance = ReferralBalance.get_locked(to_user.pk)
+                    if not referral_balance.capped:
+                        amount = amount/100*level
+                        if referral_balance.accrued+amount > ReferralBalance.CAP:
+                            amount -= referral_balance.accrued+amount-ReferralBalance.CAP
+                        referral_transaction = ReferralTransaction(from_user=buyer, to_user=to_user,
+                                                                   amount=amount, level=i, transaction_id=purchase_id)
+                        referral_transaction.save()
                 from_user = to_user
                 to_user = from_user.referral_from
                 i += 1
@@ -499,13 +870,98 @@ class ReferralTransaction(models.Model):
         update_fields=None,
     ):
         self.amount = round(self.amount, 2)
-        return super().save(
-            *args,
-            force_insert=force_insert,
-            force_update=force_update,
-            using=using,
-            update_fields=update_fields
-        )
+        if self.pk:
+            return super().save(
+                *args,
+                force_insert=force_insert,
+                force_update=force_update,
+                using=using,
+                update_fields=update_fields
+            )
+        with transaction.atomic():
+            result = super().save(
+                *args,
+                force_insert=force_insert,
+                force_update=force_update,
+                using=using,
+                update_fields=update_fields
+            )
+            ReferralBalance.register(self)
+        return result
+
+
+class ReferralBalance(models.Model):
+    user = models.OneToOneField("Users.User", models.CASCADE)
+    accrued = models.FloatField(default=0)
+    held = models.FloatField(default=0)
+    withdrawn = models.FloatField(default=0)
+    capped = models.BooleanField(default=False)
+    total_users = models.IntegerField(default=0)
+
+    CAP = 500
+    HOLD_DAYS = 3
+
+    class Meta:
+        db_table = "referral_balances"
+
+    @property
+    def credited(self):
+        return round(self.accrued - self.held, 2)
+
+    @property
+    def available(self):
+        return round(self.accrued - self.held - self.withdrawn, 2)
+
+    @classmethod
+    def get_locked(cls, user_id):
+        """
+        Сводка пользователя с блокировкой строки, вызывать внутри transaction.atomic
+        """
+        referral_balance, _ = cls.objects.select_for_update().get_or_create(user_id=user_id)
+        return referral_balance
+
+    @classmethod
+    def register(cls, referral_transaction):
+        """
+        Учёт новой реферальной транзакции в сводке получателя
+        """
+        referral_balance = cls.get_locked(referral_transaction.to_user_id)
+        if referral_transaction.type == ReferralTransaction.Types.withdraw:
+            referral_balance.withdrawn = round(referral_balance.withdrawn + referral_transaction.amount, 2)
+        else:
+            if not ReferralTransaction.objects.filter(
+                to_user_id=referral_transaction.to_user_id,
+                from_user_id=referral_transaction.from_user_id,
+                type=ReferralTransaction.Types.accrual
+            ).exclude(id=referral_transaction.pk).exists():
+                referral_balance.total_users += 1
+            referral_balance.accrued = round(referral_balance.accrued + referral_transaction.amount, 2)
+            referral_balance.held = round(referral_balance.held + referral_transaction.amount, 2)
+            referral_balance.capped = referral_balance.accrued >= cls.CAP
+        referral_balance.save()
+
+    @classmethod
+    def rollover(cls, batch_size=1000):
+        """
+        Перевод начислений старше периода холда из held в credited
+        """
+        hold_from = timezone.now() - timedelta(days=cls.HOLD_DAYS)
+        total = 0
+        while True:
+            with transaction.atomic():
+                ids = list(ReferralTransaction.objects.select_for_update(skip_locked=True).filter(
+                    type=ReferralTransaction.Types.accrual,
+                    is_credited=False,
+                    created_at__lte=hold_from
+                ).values_list("id", flat=True)[:batch_size])
+                if not ids:
+                    return total
+                rows = (ReferralTransaction.objects.filter(id__in=ids, to_user__isnull=False)
+                        .values("to_user_id").annotate(amount=Sum("amount")))
+                for row in rows:
+                    cls.objects.filter(user_id=row["to_user_id"]).update(held=F("held") - row["amount"])
+                ReferralTransaction.objects.filter(id__in=ids).update(is_credited=True)
+                total += len(ids)
 
 
 class AdminAction(models.Model):
@@ -517,3 +973,83 @@ class AdminAction(models.Model):
 
     class Meta:
         db_table = "admin_actions"
+
+
+class CatalogSnapshot(models.Model):
+    key = models.CharField(unique=True)
+    product_type = models.CharField(choices=Product.ProductTypes.choices, blank=True, null=True, db_index=True)
+    category = models.CharField(blank=True, null=True)
+    verified_only = models.BooleanField(default=True)
+    data = models.JSONField(default=dict)
+    is_stale = models.BooleanField(default=False, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "catalog_snapshots"
+
+
+class SellerLedgerDay(models.Model):
+    seller = models.ForeignKey(Seller, models.CASCADE)
+    day = models.DateField(db_index=True)
+    sales_count = models.IntegerField(default=0)
+    sales_amount = models.FloatField(default=0)
+    withdrawn_amount = models.FloatField(default=0)
+
+    HOLD_DAYS = 3
+
+    class Meta:
+        db_table = "seller_ledger_days"
+        constraints = [models.UniqueConstraint(fields=["seller", "day"], name="unique_seller_ledger_day")]
+
+    @staticmethod
+    def _day_start(day):
+        return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+    @classmethod
+    def rollup(cls, recheck_days=7):
+        """
+        Свёртка оплаченных продаж в дневные итоги продавцов.
+        Сворачиваются только дни старше периода холда, последние recheck_days уже свёрнутых дней
+        пересчитываются на случай поздней смены статуса покупки
+        """
+        cutoff = timezone.localdate() - timedelta(days=cls.HOLD_DAYS)
+        last_day = cls.objects.aggregate(last_day=Max("day"))["last_day"]
+        purchases = Purchase.objects.filter(status=TransactionStatus.paid, created_at__lt=cls._day_start(cutoff))
+        start = None
+        if last_day:
+            start = last_day - timedelta(days=recheck_days)
+            purchases = purchases.filter(created_at__gte=cls._day_start(start + timedelta(days=1)))
+        rows = (purchases.annotate(day=TruncDate("created_at"))
+                .values("seller_id", "day")
+                .annotate(**Purchase.get_seller_stat_aggregates()))
+        ledger_days = [cls(seller_id=row["seller_id"], day=row["day"],
+                           sales_count=row["sales_count"],
+                           sales_amount=row["sales_amount"] or 0,
+                           withdrawn_amount=row["withdrawn_amount"] or 0) for row in rows]
+        with transaction.atomic():
+            stale = cls.objects.filter(day__lt=cutoff)
+            if start:
+                stale = stale.filter(day__gt=start)
+            stale.delete()
+            cls.objects.bulk_create(ledger_days, batch_size=1000)
+        return len(ledger_days)
+
+    @classmethod
+    def get_seller_stat(cls, seller):
+        """
+        Статистика продавца: свёрнутые дни из леджера + живая агрегация продаж после последнего свёрнутого дня
+        """
+        last_day = cls.objects.aggregate(last_day=Max("day"))["last_day"]
+        ledger = dict(sales_count=0, sales_amount=0, withdrawn_amount=0)
+        purchases = Purchase.objects.filter(status=TransactionStatus.paid, seller=seller)
+        if last_day:
+            ledger = cls.objects.filter(seller=seller, day__lte=last_day).aggregate(
+                sales_count=Sum("sales_count"),
+                sales_amount=Sum("sales_amount"),
+                withdrawn_amount=Sum("withdrawn_amount")
+            )
+            purchases = purchases.filter(created_at__gte=cls._day_start(last_day + timedelta(days=1)))
+        live = purchases.aggregate(**Purchase.get_seller_stat_aggregates(
+            hold_from=timezone.now() - timedelta(days=cls.HOLD_DAYS)
+        ))
+        return {key: (ledger.get(key) or 0) + (live.get(key) or 0) for key in live}
@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from django.core.cache import cache
+
+from Proxy.http_client import get_http_client
+from inshop.settings import logger
+from payment_system.token_registry import registry as token_registry
+
+QUOTE = "USDT"
+RATES_KEY = "exchange_rates"
+# Курсы обновляются периодической задачей раз в минуту, старше MAX_AGE_SECONDS не используются
+MAX_AGE_SECONDS = 300
+LOCAL_SECONDS = 10
+STORE_SECONDS = 60 * 60 * 24
+
+
+class RateUnavailable(Exception):
+    pass
+
+
+class RateSource(ABC):
+    """
+    Источник курсов, fetch возвращает {тикер: цена в QUOTE}
+    """
+    name = None
+
+    @abstractmethod
+    def fetch(self, tickers):
+        pass
+
+
+class BinanceRateSource(RateSource):
+    name = "binance"
+    url = "https://api.binance.com/api/v3/ticker/price"
+    http = get_http_client("binance")
+
+    def fetch(self, tickers):
+        symbols = {f"{ticker}{QUOTE}": ticker for ticker in tickers}
+        response = self.http.get(self.url, params={"symbols": json.dumps(list(symbols), separators=(",", ":"))})
+        response.raise_for_status()
+        return {symbols[item["symbol"]]: float(item["price"]) for item in response.json() if item["symbol"] in symbols}
+
+
+class RateOracle:
+    """
+    Таблица курсов в кэше, обновляется в фоне. В запросах только читается: локальная копия, затем Redis
+    """
+    def __init__(self, source: RateSource):
+        self.source = source
+        self.local = None
+        self.local_at = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def get_tickers():
+        return [ticker for ticker in token_registry.tickers if ticker != QUOTE]
+
+    def refresh(self):
+        tickers = self.get_tickers()
+        if not tickers:
+            return {}
+        prices = {ticker: price for ticker, price in self.source.fetch(tickers).items() if price > 0}
+        missing = set(tickers) - set(prices)
+        if missing:
+            logger.warning(f"No exchange rates from {self.source.name} for {', '.join(sorted(missing))}")
+        rates = {"prices": prices, "updated_at": time.time(), "source": self.source.name}
+        cache.set(RATES_KEY, rates, STORE_SECONDS)
+        self._set_local(rates)
+        return prices
+
+    def get_rates(self):
+        with self.lock:
+            if self.local and time.monotonic() - self.local_at < LOCAL_SECONDS:
+                return self.local
+        try:
+            rates = cache.get(RATES_KEY)
+        except Exception as e:
+            # Без Redis используем локальную копию, возраст курса всё равно проверяется в get_rate
+            logger.error(f"Failed to read exchange rates from cache: {e}")
+            return self.local
+        if rates:
+            self._set_local(rates)
+        return rates
+
+    def get_rate(self, ticker):
+        ticker = ticker.upper()
+        if ticker == QUOTE:
+            return 1.0
+        rates = self.get_rates()
+        if not rates or ticker not in rates["prices"]:
+            raise RateUnavailable(f"No exchange rate for {ticker}")
+        if time.time() - rates["updated_at"] > MAX_AGE_SECONDS:
+            raise RateUnavailable(f"Exchange rate for {ticker} is stale")
+        return rates["prices"][ticker]
+
+    def _set_local(self, rates):
+        with self.lock:
+            self.local = rates
+            self.local_at = time.monotonic()
+
+
+oracle = RateOracle(BinanceRateSource())
+
+
+def get_rate(ticker):
+    return oracle.get_rate(ticker)
+
+
+def refresh_rates():
+    return oracle.refresh()
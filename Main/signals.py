@@ -0,0 +1,45 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from Main.catalog import mark_catalog_stale
+from Main.models import Product, Review, Tag
+from Users.models import Seller
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, **kwargs):
+    mark_catalog_stale([instance.type])
+
+
+@receiver(m2m_changed, sender=Product.tags.through)
+@receiver(m2m_changed, sender=Product.categories.through)
+def product_relations_changed(sender, instance, action, **kwargs):
+    if action not in ["post_add", "post_remove", "post_clear"]:
+        return
+    if isinstance(instance, Product):
+        mark_catalog_stale([instance.type])
+    else:
+        mark_catalog_stale(Product.ProductTypes.values)
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    if created:
+        instance.update_ratings(1)
+    mark_catalog_stale([instance.product.type])
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    instance.update_ratings(-1)
+    mark_catalog_stale([instance.product.type])
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    mark_catalog_stale([instance.type])
+
+
+@receiver([post_save, post_delete], sender=Seller)
+def seller_changed(sender, instance, **kwargs):
+    mark_catalog_stale(list(Product.objects.filter(seller_id=instance.pk).values_list("type", flat=True).distinct()))
@@ -1,17 +1,168 @@
+from datetime import timedelta
+
+import requests
+from django.db import transaction
+from django.db.models import Q, F
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+
+from Main.catalog import rebuild_catalog_snapshot
+from Main.checkout import provide_purchases
 from Main.celery import app
-from Main.models import ProductData, Product
+from Main.models import CatalogSnapshot, SellerLedgerDay, ReferralBalance, ProductDataUpload, PaymentEvent, Purchase, \
+    TransactionStatus, PaymentType
+from Main.rates import refresh_rates
+from Main.utils import delete_s3_object
+from inshop.settings import logger, PAYMENT_EVENTS_TG_BOT_TOKEN, PAYMENT_EVENTS_TG_CHAT_ID
 
 
 @app.task(name='add_product_data', bind=True)
 def add_product_data(*args, **kwargs):
-    product_id = kwargs.get("product_id")
-    for line in kwargs.get("text").splitlines():
-        product_data = ProductData(
-            product_id=product_id,
-            data=line
+    upload = ProductDataUpload.objects.select_related("product").get(id=kwargs.get("upload_id"))
+    if upload.status == ProductDataUpload.Statuses.done:
+        return True
+    try:
+        upload.ingest()
+    except Exception as e:
+        # offset уже зафиксирован по последней пачке, повторный запуск продолжит загрузку
+        ProductDataUpload.objects.filter(pk=upload.pk).update(status=ProductDataUpload.Statuses.error, error=str(e),
+                                                              attempts=F("attempts") + 1)
+        logger.error(f"Failed to ingest product data upload {upload.pk}: {e}")
+        return False
+    delete_s3_object(upload.key)
+    return True
+
+
+@app.task(name='retry_product_data_uploads', bind=True)
+def retry_product_data_uploads(*args, **kwargs):
+    """
+    Повторный запуск ошибочных и зависших загрузок данных товаров, загрузка продолжится с сохранённого offset
+    """
+    uploads = ProductDataUpload.objects.filter(
+        Q(status=ProductDataUpload.Statuses.error, attempts__lt=ProductDataUpload.MAX_ATTEMPTS) |
+        Q(status=ProductDataUpload.Statuses.process,
+          updated_at__lte=timezone.now() - timedelta(minutes=ProductDataUpload.STALE_MINUTES))
+    ).order_by("updated_at")[:100]
+    for upload in uploads:
+        # Условный UPDATE, чтобы параллельный запуск не поставил загрузку в очередь дважды
+        if not ProductDataUpload.objects.filter(pk=upload.pk, status=upload.status, updated_at=upload.updated_at).update(
+            status=ProductDataUpload.Statuses.process, updated_at=timezone.now()
+        ):
+            continue
+        app.send_task(name="add_product_data",
+                      route_name="add_product_data",
+                      kwargs={
+                          "upload_id": upload.pk
+                      })
+    return True
+
+
+@app.task(name='rebuild_catalog_snapshots', bind=True)
+def rebuild_catalog_snapshots(*args, **kwargs):
+    for snapshot in CatalogSnapshot.objects.filter(is_stale=True):
+        # Снимаем флаг до сборки, чтобы изменения во время сборки снова пометили снапшот
+        CatalogSnapshot.objects.filter(pk=snapshot.pk).update(is_stale=False)
+        rebuild_catalog_snapshot(snapshot)
+    return True
+
+
+@app.task(name='rollup_seller_ledger', bind=True)
+def rollup_seller_ledger(*args, **kwargs):
+    return SellerLedgerDay.rollup()
+
+
+@app.task(name='rollover_referral_holds', bind=True)
+def rollover_referral_holds(*args, **kwargs):
+    return ReferralBalance.rollover()
+
+
+@app.task(name='refresh_exchange_rates', bind=True)
+def refresh_exchange_rates(*args, **kwargs):
+    return refresh_rates()
+
+
+@app.task(name='process_payment_event', bind=True)
+def process_payment_event(*args, **kwargs):
+    event = PaymentEvent.objects.get(id=kwargs.get("event_id"))
+    try:
+        status = event.process()
+    except Exception as e:
+        logger.error(f"Failed to process payment event {event.pk}: {e}")
+        return False
+    if event.provider == PaymentEvent.Providers.cryptomus:
+        notify_payment_event(event)
+    return status
+
+
+@app.task(name='retry_payment_events', bind=True)
+def retry_payment_events(*args, **kwargs):
+    """
+    Повторная обработка ошибочных и потерянных брокером уведомлений
+    """
+    events = PaymentEvent.objects.filter(
+        status__in=[PaymentEvent.Statuses.new, PaymentEvent.Statuses.error],
+        attempts__lt=PaymentEvent.MAX_ATTEMPTS,
+        created_at__lte=timezone.now() - timedelta(minutes=1)
+    ).order_by("created_at")[:100]
+    for event in events:
+        try:
+            event.process()
+        except Exception as e:
+            logger.error(f"Failed to process payment event {event.pk}: {e}")
+    return True
+
+
+def notify_payment_event(event):
+    if not (PAYMENT_EVENTS_TG_BOT_TOKEN and PAYMENT_EVENTS_TG_CHAT_ID):
+        return
+    try:
+        requests.post(
+            url=f'https://api.telegram.org/bot{PAYMENT_EVENTS_TG_BOT_TOKEN}/sendMessage',
+            data={'chat_id': PAYMENT_EVENTS_TG_CHAT_ID, 'text': f"{event.remote_addr}, {event.payload}"},
+            timeout=10
         )
-        product_data.save()
-        product = Product.objects.get(id=product_id)
-        product.in_stock += 1
-        product.save()
+    except requests.RequestException as e:
+        logger.error(f"Failed to send payment event {event.pk} to Telegram: {e}")
+
+
+@app.task(name='process_purchase', bind=True, max_retries=3, default_retry_delay=30)
+def process_purchase(self, *args, **kwargs):
+    """
+    Выдача покупки, оплаченной с баланса при оформлении корзины.
+    Если выдать не удалось, средства возвращаются покупателю, временные ошибки сначала повторяются
+    """
+    purchase_id = kwargs.get("purchase_id")
+    try:
+        with transaction.atomic():
+            purchase = Purchase.objects.select_for_update(of=("self",)).select_related("product", "buyer").get(
+                id=purchase_id
+            )
+            if purchase.status != TransactionStatus.check:
+                return True
+            purchase.process()
+        return True
+    except ValidationError as e:
+        # Нехватка товара повтором не исправится
+        logger.error(f"Failed to process purchase {purchase_id}: {e}")
+    except Exception as e:
+        logger.error(f"Failed to process purchase {purchase_id}: {e}")
+        if self.request.retries < self.max_retries:
+            raise self.retry(exc=e)
+    Purchase.objects.select_related("seller").get(id=purchase_id).refund()
+    return False
+
+
+@app.task(name='retry_balance_purchases', bind=True)
+def retry_balance_purchases(*args, **kwargs):
+    """
+    Повторная выдача покупок с баланса, задачи которых потерял брокер или воркер, независимо от их возраста.
+    Что выдать не удастся, process_purchase вернёт покупателю
+    """
+    purchase_ids = list(Purchase.objects.filter(
+        payment_type=PaymentType.balance,
+        status=TransactionStatus.check,
+        created_at__lte=timezone.now() - timedelta(minutes=5)
+    ).order_by("created_at").values_list("id", flat=True)[:100])
+    if purchase_ids:
+        provide_purchases(purchase_ids)
     return True
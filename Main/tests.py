@@ -1,3 +1,409 @@
-from django.test import TestCase
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from uuid import uuid4
 
-# Create your tests here.
+from django.db import connection, transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from Main.catalog import get_catalog_snapshot
+from Main.celery import app
+from Main.checkout import Checkout
+from Main.models import Product, Category, Tag, CatalogSnapshot, ProductData, Purchase, \
+    ProductDataUpload, Invoice, InvoiceAmountSlot, PaymentEvent, TransactionStatus, PaymentType, \
+    UserCart
+from Main.tasks import retry_product_data_uploads, process_purchase, retry_balance_purchases
+from Users.models import User, Seller
+
+
+class ShopFixturesMixin:
+    def create_fixtures(self):
+        self.seller_user = User.objects.create(username="seller", password="password", role="seller")
+        self.seller = Seller.objects.create(user=self.seller_user, is_verified=True)
+        self.buyer = User.objects.create(username="buyer", password="password", balance=100)
+        self.category = Category.objects.create(name="accounts", description="accounts", type=Product.ProductTypes.account)
+
+    def create_product(self, **kwargs):
+        data = dict(
+            title="product", description="product", prices={"1": 2.0, "10": 1.5},
+            seller=self.seller, type=Product.ProductTypes.account, in_stock=0
+        )
+        data.update(kwargs)
+        product = Product.objects.create(**data)
+        product.categories.add(self.category)
+        return product
+
+    def create_product_data(self, product, count):
+        ProductData.objects.bulk_create([ProductData(product=product, data=f"line{i}") for i in range(count)])
+        Product.objects.filter(pk=product.pk).update(in_stock=count)
+        product.refresh_from_db()
+
+    def create_purchase(self, product, **kwargs):
+        data = dict(product=product, seller=product.seller, buyer=self.buyer, amount=2)
+        data.update(kwargs)
+        return Purchase.objects.create(**data)
+
+
+class BaseShopTestCase(ShopFixturesMixin, TestCase):
+    def setUp(self):
+        self.create_fixtures()
+
+
+class CatalogSnapshotTestCase(BaseShopTestCase):
+    def test_tags_are_filtered_without_new_snapshots(self):
+        tag = Tag.objects.create(name="tag", type=Product.ProductTypes.account)
+        tagged = self.create_product(title="tagged")
+        tagged.tags.add(tag)
+        self.create_product(title="untagged")
+
+        data = get_catalog_snapshot(None, "accounts", [str(tag.pk)], True)
+        get_catalog_snapshot(None, "accounts", [str(tag.pk), "999"], True)
+
+        self.assertEqual([product["id"] for product in data], [tagged.pk])
+        self.assertEqual(CatalogSnapshot.objects.count(), 1)
+
+    def test_unknown_category_is_not_snapshotted(self):
+        self.assertEqual(get_catalog_snapshot(None, "unknown", None, True), [])
+        self.assertFalse(CatalogSnapshot.objects.exists())
+
+
+class ProductDataAllocateTestCase(BaseShopTestCase):
+    def test_allocates_only_free_rows(self):
+        product = self.create_product()
+        self.create_product_data(product, 5)
+        first, second = self.create_purchase(product), self.create_purchase(product)
+
+        with transaction.atomic():
+            self.assertEqual(ProductData.allocate(product.pk, first.pk, 3), 3)
+        with transaction.atomic():
+            self.assertEqual(ProductData.allocate(product.pk, second.pk, 3), 2)
+
+        self.assertEqual(ProductData.objects.filter(purchase=first).count(), 3)
+        self.assertEqual(ProductData.objects.filter(purchase=second).count(), 2)
+        self.assertFalse(ProductData.objects.filter(is_sold=False).exists())
+
+
+@skipUnlessDBFeature("has_select_for_update_skip_locked")
+class ProductDataAllocateConcurrencyTestCase(ShopFixturesMixin, TransactionTestCase):
+    def setUp(self):
+        self.create_fixtures()
+
+    def test_locked_rows_are_skipped(self):
+        product = self.create_product()
+        self.create_product_data(product, 4)
+        first, second = self.create_purchase(product), self.create_purchase(product)
+        locked = threading.Event()
+        release = threading.Event()
+
+        def hold_allocation():
+            with transaction.atomic():
+                ProductData.allocate(product.pk, first.pk, 2)
+                locked.set()
+                release.wait(10)
+            connection.close()
+
+        thread = threading.Thread(target=hold_allocation)
+        thread.start()
+        locked.wait(10)
+        try:
+            with transaction.atomic():
+                allocated = ProductData.allocate(product.pk, second.pk, 4)
+        finally:
+            release.set()
+            thread.join()
+
+        self.assertEqual(allocated, 2)
+        self.assertEqual(ProductData.objects.filter(purchase=first).count(), 2)
+        self.assertEqual(ProductData.objects.filter(purchase=second).count(), 2)
+
+
+class ProductDataUploadRetryTestCase(BaseShopTestCase):
+    def test_failed_uploads_are_requeued_until_attempts_run_out(self):
+        product = self.create_product()
+        failed = ProductDataUpload.objects.create(product=product, key="failed", status=ProductDataUpload.Statuses.error,
+                                                  attempts=1)
+        ProductDataUpload.objects.create(product=product, key="exhausted", status=ProductDataUpload.Statuses.error,
+                                         attempts=ProductDataUpload.MAX_ATTEMPTS)
+        ProductDataUpload.objects.create(product=product, key="running")
+
+        with mock.patch.object(app, "send_task") as send_task:
+            retry_product_data_uploads.run()
+
+        send_task.assert_called_once_with(name="add_product_data", route_name="add_product_data",
+                                          kwargs={"upload_id": failed.pk})
+        failed.refresh_from_db()
+        self.assertEqual(failed.status, ProductDataUpload.Statuses.process)
+
+
+@mock.patch("Main.models.get_rate", return_value=1.0)
+class InvoiceAmountSlotTestCase(TestCase):
+    def create_invoice(self, amount_usd=10):
+        invoice = Invoice(amount_usd=amount_usd, currency="USDT", network="TRC20")
+        invoice.save()
+        return invoice
+
+    def test_concurrent_invoices_get_distinct_amounts(self, get_rate):
+        amounts = [self.create_invoice().amount for _ in range(3)]
+
+        self.assertEqual(len(set(amounts)), 3)
+        self.assertTrue(all(Decimal("10") < amount <= Decimal("10.003") for amount in amounts))
+
+    def test_different_amounts_do_not_shift_each_other(self, get_rate):
+        larger = self.create_invoice(amount_usd=10.5)
+        smaller = self.create_invoice(amount_usd=10)
+
+        self.assertEqual(larger.amount, Decimal("10.501"))
+        self.assertEqual(smaller.amount, Decimal("10.001"))
+
+    def test_stale_slot_is_reused_only_at_lowest_amount(self, get_rate):
+        stale = self.create_invoice(amount_usd=10.9)
+        InvoiceAmountSlot.release(stale)
+
+        invoice = self.create_invoice(amount_usd=10)
+
+        self.assertEqual(invoice.amount, Decimal("10.001"))
+        self.assertIsNone(InvoiceAmountSlot.objects.get(amount=stale.amount).invoice_id)
+
+    def test_amount_is_kept_on_later_saves(self, get_rate):
+        invoice = self.create_invoice()
+        amount = invoice.amount
+        get_rate.return_value = 2.0
+
+        invoice.hash = "hash"
+        invoice.save()
+
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.amount, amount)
+        self.assertEqual(InvoiceAmountSlot.objects.get(invoice=invoice).amount, amount)
+
+    def test_released_amount_is_reused(self, get_rate):
+        first = self.create_invoice()
+        self.create_invoice()
+
+        InvoiceAmountSlot.release(first)
+        third = self.create_invoice()
+
+        self.assertEqual(third.amount, first.amount)
+        self.assertEqual(InvoiceAmountSlot.objects.count(), 2)
+        self.assertEqual(InvoiceAmountSlot.objects.get(amount=first.amount).invoice_id, third.pk)
+
+
+class PaymentEventTestCase(BaseShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = self.create_product()
+        self.create_product_data(self.product, 2)
+        self.uuid = uuid4()
+        self.purchase = self.create_purchase(self.product, uuid=self.uuid, quantity=2)
+
+    def register(self, status="paid"):
+        return PaymentEvent.register(PaymentEvent.Providers.cryptomus, f"{self.uuid}:{status}",
+                                     {"uuid": str(self.uuid), "status": status, "txid": "txid"})
+
+    def test_duplicate_notifications_are_registered_once(self):
+        with mock.patch.object(app, "send_task") as send_task, self.captureOnCommitCallbacks(execute=True):
+            first = self.register()
+            second = self.register()
+
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(PaymentEvent.objects.count(), 1)
+        send_task.assert_called_once()
+
+    def test_processed_event_is_not_applied_twice(self):
+        event = self.register()
+
+        self.assertEqual(event.process(), PaymentEvent.Statuses.done)
+        self.assertEqual(PaymentEvent.objects.get(pk=event.pk).process(), PaymentEvent.Statuses.done)
+
+        self.purchase.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual(self.purchase.status, TransactionStatus.paid)
+        self.assertEqual(self.product.sold, 1)
+        self.assertEqual(self.product.in_stock, 0)
+
+    def test_event_without_transaction_is_retried(self):
+        event = PaymentEvent.register(PaymentEvent.Providers.cryptomus, "unknown:paid",
+                                      {"uuid": str(uuid4()), "status": "paid"})
+
+        self.assertEqual(event.process(), PaymentEvent.Statuses.error)
+        event.refresh_from_db()
+        self.assertEqual(event.attempts, 1)
+        self.assertLess(event.attempts, PaymentEvent.MAX_ATTEMPTS)
+
+    @mock.patch("Main.models.get_rate", return_value=1.0)
+    def test_crypto_deposit_older_than_invoice_is_ignored(self, get_rate):
+        invoice = Invoice(amount_usd=10, currency="USDT", network="TRC20")
+        invoice.save()
+        invoice.purchases.set([self.purchase])
+        created_at_ms = int(invoice.created_at.timestamp() * 10**3)
+
+        def register(tx_hash, timestamp):
+            return PaymentEvent.register(PaymentEvent.Providers.crypto, tx_hash, {
+                "tx_hash": tx_hash, "amount": str(invoice.amount), "ticker": "USDT", "network": "TRC20",
+                "decimal": 6, "timestamp": timestamp
+            })
+
+        self.assertEqual(register("old", created_at_ms - 60 * 10**3).process(), PaymentEvent.Statuses.error)
+        self.assertEqual(register("new", created_at_ms + 60 * 10**3).process(), PaymentEvent.Statuses.done)
+        self.purchase.refresh_from_db()
+        self.assertEqual(self.purchase.status, TransactionStatus.paid)
+
+    @mock.patch("Main.views.check_sign", return_value=True)
+    def test_crypto_webhook_requires_tx_hash(self, check_sign):
+        response = APIClient().post("/api/v1/payment/crypto", {"amount": "10.001", "sign": "sign"}, format="json")
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(PaymentEvent.objects.exists())
+
+    @mock.patch("Main.views.check_sign", return_value=True)
+    def test_form_encoded_webhook_payload_keeps_scalar_values(self, check_sign):
+        with mock.patch.object(app, "send_task"):
+            response = APIClient().post("/api/v1/payment/crypto", {"tx_hash": "0xhash", "amount": "10.001",
+                                                                   "sign": "sign"})
+
+        self.assertEqual(response.status_code, 200)
+        payload = PaymentEvent.objects.get(key="0xhash").payload
+        self.assertEqual(payload["tx_hash"], "0xhash")
+        self.assertEqual(payload["amount"], "10.001")
+
+
+class BalancePurchaseTestCase(BaseShopTestCase):
+    def test_balance_purchase_moves_money_with_f_expressions(self):
+        product = self.create_product()
+        purchase = Purchase(product=product, seller=self.seller, buyer=self.buyer, amount=30,
+                            payment_type=PaymentType.balance)
+        # Параллельное изменение баланса, которого нет в объектах в памяти, не должно потеряться
+        User.objects.filter(pk=self.buyer.pk).update(balance=F("balance") + 5)
+
+        purchase.save()
+
+        self.assertEqual(User.objects.get(pk=self.buyer.pk).balance, 75)
+        self.assertEqual(User.objects.get(pk=self.seller_user.pk).balance, 30)
+        self.assertIsNotNone(purchase.uuid)
+
+    def test_insufficient_balance_rolls_back(self):
+        product = self.create_product()
+        purchase = Purchase(product=product, seller=self.seller, buyer=self.buyer, amount=500,
+                            payment_type=PaymentType.balance)
+
+        with self.assertRaises(ValidationError):
+            purchase.save()
+
+        self.assertFalse(Purchase.objects.exists())
+        self.assertEqual(User.objects.get(pk=self.buyer.pk).balance, 100)
+        self.assertEqual(User.objects.get(pk=self.seller_user.pk).balance, 0)
+
+    def test_process_runs_in_constant_queries(self):
+        product = self.create_product()
+        self.create_product_data(product, 60)
+        query_counts = []
+        for quantity in [1, 50]:
+            purchase = Purchase.objects.select_related("product", "buyer").get(
+                pk=self.create_purchase(product, quantity=quantity).pk
+            )
+            with CaptureQueriesContext(connection) as queries:
+                purchase.process()
+            query_counts.append(len(queries))
+
+        self.assertEqual(query_counts[0], query_counts[1])
+        self.assertEqual(ProductData.objects.filter(is_sold=False).count(), 9)
+        self.seller.refresh_from_db()
+        self.assertGreater(self.seller.balance, 0)
+
+    def test_seller_is_credited_once_per_purchase(self):
+        product = self.create_product()
+        self.create_product_data(product, 3)
+        purchase = self.create_purchase(product, quantity=3, amount=6)
+        balance = Seller.objects.get(pk=self.seller.pk).balance
+
+        purchase.process()
+
+        self.seller.refresh_from_db()
+        self.assertAlmostEqual(self.seller.balance - balance, 6 - 6 * product.get_commission())
+        self.assertEqual(ProductData.objects.filter(purchase=purchase).count(), 3)
+
+
+class CheckoutTestCase(BaseShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.buyer.balance = 1000
+        self.buyer.save()
+        self.products = []
+        for i in range(20):
+            product = self.create_product(title=f"product {i}")
+            self.create_product_data(product, 5)
+            UserCart.objects.create(user=self.buyer, product=product, amount=3)
+            self.products.append(product)
+
+    def checkout(self, products, quantity=2):
+        items = [{"id": product.pk, "quantity": quantity, "options": {}} for product in products]
+        with mock.patch("Main.checkout.provide_purchases") as provide_purchases, \
+                self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            data = Checkout(self.buyer, PaymentType.balance, items).run()
+        return data, len(queries), provide_purchases
+
+    def test_query_count_does_not_depend_on_cart_size(self):
+        _, small_cart_queries, _ = self.checkout(self.products[:5])
+        _, large_cart_queries, _ = self.checkout(self.products[5:])
+
+        self.assertEqual(small_cart_queries, large_cart_queries)
+
+    def test_charges_balance_and_updates_cart(self):
+        data, _, provide_purchases = self.checkout(self.products[:5])
+
+        purchases = list(Purchase.objects.order_by("id"))
+        self.assertEqual(data, {"message": "Successful purchase!"})
+        self.assertEqual([purchase.amount for purchase in purchases], [Decimal("4.00")] * 5)
+        self.assertEqual(User.objects.get(pk=self.buyer.pk).balance, 980)
+        self.assertEqual(User.objects.get(pk=self.seller_user.pk).balance, 20)
+        self.assertEqual(set(UserCart.objects.filter(product__in=self.products[:5]).values_list("amount", flat=True)), {1})
+        provide_purchases.assert_called_once_with([purchase.pk for purchase in purchases])
+
+    def test_out_of_stock_cart_is_not_charged(self):
+        with self.assertRaises(ValidationError):
+            self.checkout(self.products[:1], quantity=6)
+
+        self.assertFalse(Purchase.objects.exists())
+        self.assertEqual(User.objects.get(pk=self.buyer.pk).balance, 1000)
+
+    def test_failed_provisioning_is_refunded(self):
+        self.checkout(self.products[:1], quantity=3)
+        purchase = Purchase.objects.get()
+        ProductData.objects.filter(product=self.products[0], is_sold=False).update(is_sold=True)
+
+        self.assertFalse(process_purchase.run(purchase_id=purchase.pk))
+
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.status, TransactionStatus.cancel)
+        self.assertEqual(User.objects.get(pk=self.buyer.pk).balance, 1000)
+        self.assertEqual(User.objects.get(pk=self.seller_user.pk).balance, 0)
+        self.assertTrue(process_purchase.run(purchase_id=purchase.pk))
+
+    def test_lost_purchase_is_refunded_whatever_its_age(self):
+        self.checkout(self.products[:1], quantity=3)
+        purchase = Purchase.objects.get()
+        Purchase.objects.filter(pk=purchase.pk).update(created_at=timezone.now() - timedelta(days=2))
+        ProductData.objects.filter(product=self.products[0], is_sold=False).update(is_sold=True)
+
+        retry_balance_purchases.run()
+
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.status, TransactionStatus.cancel)
+        self.assertEqual(User.objects.get(pk=self.buyer.pk).balance, 1000)
+        self.assertEqual(User.objects.get(pk=self.seller_user.pk).balance, 0)
+
+    def test_provisioning_marks_purchase_paid(self):
+        self.checkout(self.products[:1], quantity=3)
+        purchase = Purchase.objects.get()
+
+        self.assertTrue(process_purchase.run(purchase_id=purchase.pk))
+
+        purchase.refresh_from_db()
+        self.assertEqual(purchase.status, TransactionStatus.paid)
+        self.assertEqual(ProductData.objects.filter(purchase=purchase).count(), 3)
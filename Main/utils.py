@@ -7,6 +7,7 @@ from datetime import datetime
 from uuid import uuid4
 
 from django.db import models
+from django.http import QueryDict
 
 import boto3
 from botocore.config import Config
@@ -19,6 +20,7 @@ from rest_framework.exceptions import ValidationError
 from django.core.exceptions import ValidationError as DjangoValidationError
 
 from Users.models import User
+from payment_system.token_registry import registry as token_registry
 from inshop.settings import FRONTEND_HOST, CRYPTOMUS_API_KEY, \
     CRYPTOMUS_MERCHANT, PAYMENT_LIFE_TIME, S3_API_KEY, S3_SECRET_KEY, S3_ENDPOINT, S3_BUCKET, \
     S3_ACCESS_KEY, GEETEST_VALIDATE_URL, GEETEST_CAPTCHA_KEY, GEETEST_CAPTCHA_ID, CAPTCHA_ENABLED, \
@@ -105,6 +107,14 @@ def get_object_or_404(queryset, *filter_args, **filter_kwargs):
     except (TypeError, ValueError, DjangoValidationError):
         raise NotFound(detail={"message": f"{queryset.model.__name__} not found!"})
 
+def get_request_payload(request):
+    """
+    Тело запроса обычным словарём: у form-encoded QueryDict dict() дал бы списки значений
+    """
+    if isinstance(request.data, QueryDict):
+        return request.data.dict()
+    return dict(request.data)
+
 def check_sign(request_body, key=CRYPTOMUS_API_KEY):
     data = request_body.copy()
     sign = data.get("sign")
@@ -156,15 +166,36 @@ def delete_file_from_s3(url):
     if "Contents" not in files:
         s3.delete_object(Bucket=S3_BUCKET, Key=folder_path)
 
-credentials = json.load(open("static/crypto.json", "r"))
+
+def stage_file_to_s3(file, file_path):
+    """
+    Загрузка файла во временную папку S3 для фоновой обработки, возвращает ключ объекта
+    """
+    key = f"{file_path}/{uuid4()}.txt"
+    s3.upload_fileobj(file, S3_BUCKET, key)
+    return key
+
+
+def iter_s3_file(key, offset=0, chunk_size=1024 * 1024):
+    """
+    Потоковое чтение объекта S3 начиная с байта offset
+    """
+    params = {"Range": f"bytes={offset}-"} if offset else {}
+    response = s3.get_object(Bucket=S3_BUCKET, Key=key, **params)
+    yield from response["Body"].iter_chunks(chunk_size)
+
+
+def delete_s3_object(key):
+    s3.delete_object(Bucket=S3_BUCKET, Key=key)
+
+
+credentials = token_registry.entries
 
 
 def get_wallets_and_contracts_by_network(ticker: str, network):
-    for entry in credentials:
-        if entry["ticker"].lower() == ticker.lower():
-            for address_info in entry["providers"]:
-                if network.lower() == address_info["network"].lower():
-                    return address_info["to_address"][0]
+    token = token_registry.get(ticker, network)
+    return token.to_address if token else None
+
 
 def get_all_crypto_methods():
     data = []
@@ -1,12 +1,10 @@
 import datetime
+import io
 
-from decimal import Decimal
 from math import ceil
-from uuid import uuid4
 
-import requests
-from django.db.models import Q, Count
-from django.http import FileResponse
+from django.db.models import Q, Exists, OuterRef, Prefetch
+from django.http import StreamingHttpResponse
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_protect
 
@@ -20,23 +18,27 @@ from rest_framework.response import Response
 from rest_framework.request import Request
 from rest_framework.viewsets import GenericViewSet
 
+from Main.catalog import get_catalog_snapshot, get_similar_products
+from Main.checkout import Checkout
 from Main.celery import app
+from Main.rates import RateUnavailable
 
-from Main.models import Product, Purchase, Category, TransactionStatus, BalanceTopUp, PaymentType, UserCart, Tag, Units, \
-    Review, File, Invoice, ProductData
+from Main.models import Product, Purchase, Category, TransactionStatus, PaymentType, UserCart, Tag, Units, \
+    Review, File, Invoice, ProductData, ProductDataUpload, PaymentEvent
 from Main.serializers import PurchaseSerializer, GetCardsSerializer, ProductSerializer, PhotoUploadSerializer, \
     CryptomusPaymentSerializer
-from Main.utils import get_object_or_404, cryptomus_create_invoice, check_sign, upload_file_to_s3, \
-    get_all_crypto_methods, get_wallets_and_contracts_by_network, stripe_create_invoice, stripe_get_event, \
-    stripe_get_invoice, ResponseLocale
+from Main.utils import get_object_or_404, check_sign, upload_file_to_s3, \
+    get_all_crypto_methods, get_wallets_and_contracts_by_network, stripe_get_event, \
+    stripe_get_invoice, ResponseLocale, stage_file_to_s3, get_request_payload
 
 from Proxy.models import ProxyPurchase, ProxyTypes
-from Proxy.providers import ProvidersFactory, lola_isp_countries
+from Proxy.providers import lola_isp_countries
+from Proxy.traffic import get_cached_traffic_left
 from Users.models import User, Seller
 from Users.utils import TempUserAuthentication, base_authenticate, SellerAuthentication, get_user, \
     UserNonRequiredAuthentication
 
-from inshop.settings import CRYPTO_SECRET_KEY
+from inshop.settings import CRYPTO_SECRET_KEY, logger
 
 
 @extend_schema(tags=["Товары"])
@@ -45,141 +47,22 @@ class ProductsViewSet(GenericViewSet):
     authentication_classes = [UserNonRequiredAuthentication]
     serializer_class = ProductSerializer
 
-    @staticmethod
-    def _buy_proxy(user, product, purchase, quantity):
-        proxy_type = product.categories.last()
-        extend_of = None
-        if proxy_type.name != ProxyTypes.ISP:
-            old_proxy_purchase = ProxyPurchase.objects.filter(
-                purchase__buyer=user,
-                purchase__seller=product.seller,
-                type__name=proxy_type.name
-            ).exclude(status=ProxyPurchase.ProxyPurchaseStatus.EXPIRED).exclude(service_data={}).last()
-            if old_proxy_purchase:
-                if old_proxy_purchase.expiration_date.timestamp() < datetime.datetime.now().timestamp():
-                    old_proxy_purchase.status = ProxyPurchase.ProxyPurchaseStatus.EXPIRED
-                    old_proxy_purchase.save()
-                else:
-                    extend_of = old_proxy_purchase
-        country = None
-        if proxy_type.name == ProxyTypes.ISP:
-            country = purchase.product_options.get("country")
-        proxy_purchase = ProxyPurchase(
-            purchase=purchase, type=proxy_type,
-            count=quantity,
-            extend_of=extend_of,
-            country=country
-        )
-        proxy_purchase.save()
-        return proxy_purchase
-
     def _buy(self, request, user, response, multiple):
-        product_id = request.data.get("id")
-        quantity = request.data.get('quantity')
-        options = request.data.get("options")
-        payment_type = request.data.get("payment_type")
-        products = request.data.get("products")
-        products_objects = []
-        products_options = []
-        purchase_uuid = None
-        price = 0
-        if payment_type == PaymentType.crypto:
-            if Invoice.objects.filter(
-                ~Q(purchases__status=TransactionStatus.paid),
-                purchases__buyer_id=user.pk,
-                is_active=True,
-                expiration_dt__gte=datetime.datetime.now()
-            ).count() >= 30:
-                return ResponseLocale(user=request.user, status=400, data={"message": "You cannot have more than 30 active unpaid invoices!"})
         if multiple:
-            for product in products:
-                product_obj = get_object_or_404(Product, id=product.get("id"))
-                if product.seller.user.pk == user.pk:
-                    return ResponseLocale(user=request.user, status=400, data={"message": "You can't buy from yourself!"})
-                if not product_obj.seller.is_verified and user.role not in ["admin", "root_admin"]:
-                    raise ValidationError({"message": "Purchase is prohibited!"})
-                if product_obj.in_stock is not None and product.in_stock <= 0:
-                    raise ValidationError({"message": "Out of stock!"})
-                products_objects.append(product_obj)
-                products_options.append(product.get("options"))
-                quantity = int(product.get("quantity"))
-                price += product_obj.get_price(quantity)*quantity
-            purchase_uuid = uuid4()
-            if payment_type == PaymentType.cryptomus:
-                purchase_uuid = cryptomus_create_invoice(user.pk, price).get("uuid")
-            if payment_type == PaymentType.stripe:
-                invoice_data = stripe_create_invoice(user.pk, price)
-                purchase_uuid = invoice_data.get("uuid")
-            elif payment_type == PaymentType.balance:
-                if user.balance < price:
-                    return ResponseLocale(user=request.user, status=400, data={"message": "Insufficient balance!"})
-        else:
-            product_obj = get_object_or_404(Product, id=product_id)
-            products_objects = [product_obj]
-            products_options = [options]
-        i = 0
-        purchases = []
-        for product in products_objects:
-            if not product.seller.is_verified and user.role not in ["admin", "root_admin"]:
-                raise ValidationError({"message": "Purchase is prohibited!"})
-            if product.in_stock is not None and product.in_stock <= 0:
-                raise ValidationError({"message": "Out of stock!"})
-            if not multiple:
-                price = product.get_price(quantity)*quantity
-                purchase_uuid = uuid4()
-                if payment_type == PaymentType.cryptomus:
-                    invoice_data = cryptomus_create_invoice(user.pk, price)
-                    purchase_uuid = invoice_data.get("uuid")
-                if payment_type == PaymentType.stripe:
-                    invoice_data = stripe_create_invoice(user.pk, price)
-                    purchase_uuid = invoice_data.get("uuid")
-            purchase = Purchase(
-                product=product, amount=price,
-                seller=product.seller, buyer=user,
-                payment_type=payment_type, uuid=purchase_uuid,
-                buyer_message=request.data.get("buyer-message"),
-                product_options=products_options[i], quantity=quantity
-            )
-            try:
-                purchase.save()
-                purchases.append(purchase)
-            except ValidationError as e:
-                response.status_code = 400
-                response.data = e.detail
-                return response
-            if product.type == Product.ProductTypes.proxy:
-                self._buy_proxy(user, product, purchase, quantity)
-            if payment_type == PaymentType.balance:
-                purchase.process()
-            i += 1
-        response.status_code = 200
-        if payment_type == PaymentType.cryptomus:
-            response.data = {"url": f"https://pay.cryptomus.com/pay/{purchase_uuid}"}
-        if payment_type == PaymentType.stripe:
-            response.data = {"url": invoice_data["url"]}
-        if payment_type == PaymentType.balance:
-            response.data = {"message": "Successful purchase!"}
-        if payment_type == "crypto":
-            invoice = Invoice(
-                amount_usd=price,
-            )
-            invoice.save()
-            invoice.purchases.set(purchases)
-            invoice.save()
-            response.data = {"url": f"https://gemups.com/payment/{invoice.uuid}"}
-        if products:
-            for product in products:
-                user_cart = UserCart.objects.filter(user=user, product_id=product.get("id")).first()
-                if user_cart:
-                    user_cart.amount -= int(product.get("quantity"))
-                    if user_cart.amount <= 0:
-                        user_cart.delete()
-                    user_cart.save()
+            items = request.data.get("products")
         else:
-            user_cart = UserCart.objects.filter(user=user, product_id=product_id).first()
-            if user_cart:
-                user_cart.amount -= quantity
-                user_cart.save()
+            items = [{
+                "id": request.data.get("id"),
+                "quantity": request.data.get("quantity"),
+                "options": request.data.get("options")
+            }]
+        checkout = Checkout(user, request.data.get("payment_type"), items, request.data.get("buyer-message"))
+        try:
+            response.data = checkout.run()
+            response.status_code = 200
+        except ValidationError as e:
+            response.data = e.detail
+            response.status_code = 400
         cookies = response.cookies
         response = ResponseLocale(data=response.data, user=user, status=response.status_code)
         response.cookies = cookies
@@ -219,115 +102,10 @@ class ProductsViewSet(GenericViewSet):
             request.query_params.get("tags").split(",") if request.query_params.get("tags") else None
         )
 
-        filters = self._build_filters(user, category_name, type)
-        products = self._get_filtered_products(tags, filters)
-        processed_products, data = [], {}
-
-        if category_name:
-            data = self._process_products_by_category(products, processed_products)
-        elif type:
-            data = self._process_products_by_type(products, processed_products)
-        else:
-            data = self._process_products_by_type_and_category(products, processed_products)
+        verified_only = not user or user.role not in [User.RoleChoices.admin, User.RoleChoices.root_admin]
+        data = get_catalog_snapshot(type, category_name, tags, verified_only)
         return ResponseLocale(user=request.user, status=200, data=data)
 
-    def _build_filters(self, user, category_name, type):
-        filters = []
-        if not user or user.role not in [User.RoleChoices.admin, User.RoleChoices.root_admin]:
-            filters.append(Q(seller__is_verified=True))
-        if category_name:
-            filters.append(Q(categories__name=category_name) | Q(categories__parent_category__name=category_name))
-        if type:
-            filters.append(Q(type=type))
-        return filters
-
-    def _get_filtered_products(self, tags, filters):
-        if tags:
-            return Product.objects.filter(tags__id__in=tags, *filters) \
-                .annotate(num_tags=Count('tags')) \
-                .filter(num_tags=len(tags)).order_by("id").order_by("-is_popular")
-        return Product.objects.filter(*filters).order_by("id").order_by("-is_popular")
-
-    def _process_products_by_category(self, products, processed_products):
-        data = []
-        for product in products:
-            if product.pk in processed_products:
-                continue
-            product_data, skip = self._process_product_and_similars(product, products, processed_products)
-            if not skip:
-                product_data.pop("category")
-                data.append(product_data)
-        return data
-
-    def _process_products_by_type(self, products, processed_products):
-        data = {}
-        for product in products:
-            if product.pk in processed_products:
-                continue
-            product_data, skip = self._process_product_and_similars(product, products, processed_products)
-            if not skip:
-                category = product.categories.last()
-                if not category:
-                    continue
-                data.setdefault(category.name, []).append(product_data)
-        if products[0].type == Product.ProductTypes.proxy:
-            sorted_data = dict()
-            for category in ["residential", "datacenter", "isp"]:
-                if category in data:
-                    sorted_data[category] = data[category]
-        else:
-            sorted_data = dict(sorted(data.items(), key=lambda item: len(item[1]), reverse=False))
-        return sorted_data
-
-    def _process_products_by_type_and_category(self, products, processed_products):
-        data = {}
-        for product in products:
-            if product.pk in processed_products:
-                continue
-            product_data, skip = self._process_product_and_similars(product, products, processed_products)
-            if not skip:
-                category = "Undefined Category"
-                product_category = product.categories.last()
-                if product_category:
-                    category = product_category.name
-                type = product.type
-                data.setdefault(type, {}).setdefault(category, []).append(product_data)
-
-        sorted_data = {
-            type_: dict(sorted(categories.items(), key=lambda item: len(item[1]), reverse=False))
-            for type_, categories in data.items()
-        }
-        sorted_data = dict(
-            sorted(sorted_data.items(), key=lambda item: sum(len(cat) for cat in item[1].values()), reverse=False))
-        return sorted_data
-
-    def _process_product_and_similars(self, product, products, processed_products):
-        product_data = product.to_dict()
-        skip = False
-        target_tags = product.tags.all()
-        similar_products = []
-        if target_tags:
-            similar_products = self._get_similar_products(product)
-        for similar_product in similar_products:
-            similar_rating = self._get_average_rating(similar_product)
-            if product_data.get("rating") >= similar_rating and not similar_product.is_popular:
-                processed_products.append(similar_product.pk)
-                product_data.setdefault("other_sellers", 0)
-                product_data.setdefault("other_sellers_avatars", [])
-                product_data["other_sellers"] += 1
-                if similar_product.seller.user.avatar:
-                    if len(product_data["other_sellers_avatars"]) < 3:
-                        product_data["other_sellers_avatars"].append(similar_product.seller.user.avatar.url)
-            else:
-                processed_products.append(product.pk)
-                skip = True
-
-        return product_data, skip
-
-    def _get_average_rating(self, product):
-        reviews = Review.objects.filter(product_id=product.pk)
-        return sum(review.rating for review in reviews) / reviews.count() if reviews else 0.0
-
     @extend_schema(parameters=[inline_serializer("GetCategories", fields={
         "type": serializers.ChoiceField(choices=Product.ProductTypes.choices, required=False),
     })])
@@ -374,95 +152,109 @@ class ProductsViewSet(GenericViewSet):
         seller = Seller.objects.filter(user=request.user).first()
         if seller:
             filters.append(~Q(seller=seller))
+        active_proxy_purchases = ProxyPurchase.objects.filter(~Q(service_data={}), extend_of_id__isnull=True)
+        if statuses == "paid":
+            filters.append(~Q(product__type=Product.ProductTypes.proxy) |
+                           Exists(active_proxy_purchases.filter(purchase_id=OuterRef("pk"))))
         purchases = Purchase.objects.filter(*filters).order_by("-created_at")
+        count = purchases.count()
         start = (page - 1) * limit
-        end = start + limit
+        purchases = list(
+            purchases
+            .select_related("product", "seller__user", "buyer")
+            .prefetch_related(
+                "product__categories",
+                Prefetch("proxypurchase_set", queryset=active_proxy_purchases.select_related("type"),
+                         to_attr="active_proxy_purchases")
+            )[start:start + limit]
+        )
+        # Невыданные покупки с баланса отменяет только Purchase.refund, с возвратом средств покупателю
+        expired_ids = [
+            purchase.pk for purchase in purchases
+            if purchase.status != TransactionStatus.paid and purchase.payment_type != PaymentType.balance and
+            purchase.created_at.timestamp() < (datetime.datetime.now() - datetime.timedelta(hours=12)).timestamp()
+        ]
+        if expired_ids:
+            # Покупка могла быть оплачена вебхуком после выборки, оплаченные не отменяются
+            Purchase.objects.filter(id__in=expired_ids).exclude(status=TransactionStatus.paid).update(
+                status=TransactionStatus.cancel
+            )
+        proxy_purchases = [
+            purchase.active_proxy_purchases[0] for purchase in purchases
+            if purchase.product.type == Product.ProductTypes.proxy and purchase.active_proxy_purchases
+        ]
+        traffic_left = get_cached_traffic_left(
+            [proxy_purchase for proxy_purchase in proxy_purchases if proxy_purchase.type.name != ProxyTypes.ISP]
+        )
         data = []
-        i = 0
         for purchase in purchases:
             try:
                 purchase_data = {}
                 quantity = None
                 expiration_date = None
                 country = None
-                if purchase.product.type == Product.ProductTypes.proxy:
-                    try:
-                        proxy_purchase = ProxyPurchase.objects.get(~Q(service_data={}),
-                                                                   extend_of_id__isnull=True,
-                                                                   purchase=purchase)
+                if purchase.pk in expired_ids:
+                    purchase.status = TransactionStatus.cancel
+                if purchase.product.type == Product.ProductTypes.proxy and purchase.active_proxy_purchases:
+                    proxy_purchase = purchase.active_proxy_purchases[0]
+                    quantity = {
+                        "all": proxy_purchase.count,
+                        "is_static": True
+                    }
+                    expiration_date = proxy_purchase.expiration_date.strftime("%Y-%m-%d %H:%M:%S")
+                    if proxy_purchase.pk in traffic_left:
                         quantity = {
                             "all": proxy_purchase.count,
-                            "is_static": True
-                        }
-                        if proxy_purchase.extend_of:
-                            continue
-                        proxy_data = ProvidersFactory.get_provider(proxy_purchase.purchase.seller.user.username)(
-                            proxy_purchase)
-                        expiration_date = proxy_purchase.expiration_date.strftime("%Y-%m-%d %H:%M:%S")
-                        if proxy_purchase.type.name != ProxyTypes.ISP:
-                            try:
-                                quantity = {
-                                    "all": proxy_purchase.count,
-                                    "left": proxy_data.get_traffic_left(),
-                                    "is_static": False
-                                }
-                            except:
-                                pass
-                        if proxy_purchase.country:
-                            country = proxy_purchase.country
-                    except ProxyPurchase.DoesNotExist:
-                        if statuses == "paid":
-                            continue
-                if start <= i < end:
-                    if not quantity:
-                        quantity = {"all": purchase.quantity, "is_static": True}
-                    product_category = purchase.product.categories.first()
-                    invoice = None
-                    if purchase.payment_type == PaymentType.cryptomus:
-                        invoice = f"https://pay.cryptomus.com/pay/{purchase.uuid}"
-                    if purchase.payment_type == PaymentType.crypto:
-                        invoice = f"https://gemups.com/payment/{purchase.uuid}"
-                    try:
-                        if purchase.payment_type == PaymentType.stripe:
-                            invoice = stripe_get_invoice(purchase.uuid)
-                    except:
-                        pass
-                    if purchase.status != TransactionStatus.paid:
-                        if purchase.created_at.timestamp() < (datetime.datetime.now() - datetime.timedelta(hours=12)).timestamp():
-                            purchase.status = TransactionStatus.cancel
-                            purchase.save()
-                    product_data = {
-                        "purchase": {
-                            "id": purchase.pk,
-                            "datetime": purchase.created_at,
-                            "status": purchase.status,
-                            "quantity": quantity,
-                            "data": purchase.seller_message,
-                            "invoice": invoice
-                        },
-                        "seller": {
-                            "name": purchase.seller.user.username,
-                            "id": purchase.seller.pk
-                        },
-                        "product": {
-                            "id": purchase.product.pk,
-                            "title": purchase.product.title,
-                            "type": purchase.product.type,
-                            "expiration_date": expiration_date
+                            "left": traffic_left[proxy_purchase.pk],
+                            "is_static": False
                         }
+                    if proxy_purchase.country:
+                        country = proxy_purchase.country
+                if not quantity:
+                    quantity = {"all": purchase.quantity, "is_static": True}
+                product_categories = sorted(purchase.product.categories.all(), key=lambda category: category.pk)
+                product_category = product_categories[0] if product_categories else None
+                invoice = None
+                if purchase.payment_type == PaymentType.cryptomus:
+                    invoice = f"https://pay.cryptomus.com/pay/{purchase.uuid}"
+                if purchase.payment_type == PaymentType.crypto:
+                    invoice = f"https://gemups.com/payment/{purchase.uuid}"
+                try:
+                    if purchase.payment_type == PaymentType.stripe:
+                        invoice = stripe_get_invoice(purchase.uuid)
+                except:
+                    pass
+                product_data = {
+                    "purchase": {
+                        "id": purchase.pk,
+                        "datetime": purchase.created_at,
+                        "status": purchase.status,
+                        "quantity": quantity,
+                        "data": purchase.seller_message,
+                        "invoice": invoice
+                    },
+                    "seller": {
+                        "name": purchase.seller.user.username,
+                        "id": purchase.seller.pk
+                    },
+                    "product": {
+                        "id": purchase.product.pk,
+                        "title": purchase.product.title,
+                        "type": purchase.product.type,
+                        "expiration_date": expiration_date
                     }
-                    if product_category:
-                        product_data["product"]["category"] = product_category.name
-                        product_data["product"]["category_id"] = product_category.pk
-                    purchase_data.update(product_data)
-                    if country:
-                        purchase_data["purchase"]["country"] = lola_isp_countries[country]
-                    purchase_data["purchase"]["quantity"]["unit"] = Units.get_unit(purchase.product)
-                    data.append(purchase_data)
-                i += 1
+                }
+                if product_category:
+                    product_data["product"]["category"] = product_category.name
+                    product_data["product"]["category_id"] = product_category.pk
+                purchase_data.update(product_data)
+                if country:
+                    purchase_data["purchase"]["country"] = lola_isp_countries[country]
+                purchase_data["purchase"]["quantity"]["unit"] = Units.get_unit(purchase.product)
+                data.append(purchase_data)
             except:
                 pass
-        total_pages = ceil(i / limit)
+        total_pages = ceil(count / limit)
         return ResponseLocale(user=request.user, status=200, data={"products": data, "total_pages": total_pages})
 
     @extend_schema(parameters=[inline_serializer("GetProductData", fields={
@@ -472,33 +264,14 @@ class ProductsViewSet(GenericViewSet):
             authentication_classes=[TempUserAuthentication])
     def get_product_data(self, request: Request):
         purchase = get_object_or_404(Purchase, id=request.query_params.get("id"), buyer=request.user)
-        product_data = ProductData.objects.filter(purchase=purchase)
-        first_line = True
-        file_data = ""
-        for piece in product_data:
-            if first_line:
-                file_data += piece.data
-            else:
-                file_data += "\n" + piece.data
-            first_line = False
-        response = FileResponse(file_data, filename=f"{uuid4()}.txt", content_type="text/plain", as_attachment=True)
+        compress = "gzip" in request.headers.get("Accept-Encoding", "")
+        response = StreamingHttpResponse(ProductData.stream(purchase.pk, compress=compress), content_type="text/plain")
+        if compress:
+            response["Content-Encoding"] = "gzip"
+        response["Vary"] = "Accept-Encoding"
         response['Content-Disposition'] = f'attachment; filename="purchase_{purchase.pk}.txt"'
         return response
 
-    @staticmethod
-    def _get_similar_products(product):
-        tags = product.tags.all()
-        similar_products = (
-            Product.objects
-            .filter(categories__in=product.categories.all())
-            .filter(tags__in=tags)
-            .exclude(id=product.pk)
-            .annotate(common_tags=Count('tags'))
-            .order_by('-common_tags')
-        )
-        return similar_products
-
-
     @extend_schema(parameters=[inline_serializer("ProductGet", fields={
         "id": serializers.IntegerField()
     })])
@@ -511,7 +284,7 @@ class ProductsViewSet(GenericViewSet):
         data = {"type": product.type}
         other_offers = None
         if target_tags:
-            other_products = self._get_similar_products(product)
+            other_products = get_similar_products(product)
             if not user or user.role not in [User.RoleChoices.admin.value,
                                                              User.RoleChoices.root_admin.value]:
                 other_products = other_products.exclude(seller__is_verified=False)
@@ -601,23 +374,33 @@ class ProductsViewSet(GenericViewSet):
         if file:
             if file.content_type != "text/plain":
                 return ResponseLocale(user=request.user, status=400, data={"message": "Incorrect format, please upload a txt file!"})
-            app.send_task(name="add_product_data",
-                          route_name="add_product_data",
-                          kwargs={
-                              "product_id": request.data.get("id"),
-                              "text": file.read().decode("utf-8")
-                          })
+            size = file.size
         else:
             text = request.data.get("text")
             if not text:
                 return ResponseLocale(user=request.user, status=400, data={"message": "Empty text value!"})
-            app.send_task(name="add_product_data",
-                          route_name="add_product_data",
-                          kwargs={
-                              "product_id": request.data.get("id"),
-                              "text": text
-                          })
-        return ResponseLocale(user=request.user, status=200, data={"message": "The data is being uploaded"})
+            file = io.BytesIO(text.encode("utf-8"))
+            size = file.getbuffer().nbytes
+        # Через брокер передаётся только id загрузки, сам файл читается воркером из S3 потоково
+        upload = ProductDataUpload.objects.create(
+            product=product,
+            key=stage_file_to_s3(file, f"uploads/product-data/{product.pk}"),
+            size=size
+        )
+        app.send_task(name="add_product_data",
+                      route_name="add_product_data",
+                      kwargs={
+                          "upload_id": upload.pk
+                      })
+        return ResponseLocale(user=request.user, status=200, data={"message": "The data is being uploaded",
+                                                                   "upload_id": upload.pk})
+
+    @action(methods=["GET"], detail=False, url_path="get-data-upload",
+            authentication_classes=[SellerAuthentication])
+    def get_data_upload(self, request: Request):
+        upload = get_object_or_404(ProductDataUpload, id=request.query_params.get("id"),
+                                   product__seller__user=request.user)
+        return ResponseLocale(user=request.user, status=200, data=upload.to_dict())
 
     # @action(methods=["DELETE"], detail=False, url_path="delete",
     #         authentication_classes=[SellerAuthentication])
@@ -698,17 +481,13 @@ class ProductsViewSet(GenericViewSet):
             page = int(request.query_params["page"])
         except (KeyError, ValueError):
             return ResponseLocale(user=request.user, status=400, data={"message": "Missed required parameters - limit or page!"})
-        product = get_object_or_404(Product, id=request.query_params.get("product_id"))
-        reviews = Review.objects.filter(product=product)
-        count = reviews.count()
-        seller_reviews = Review.objects.filter(
-            product__seller=product.seller
-        )
+        product = get_object_or_404(Product.objects.select_related("seller"), id=request.query_params.get("product_id"))
+        reviews = Review.objects.filter(product=product).select_related("user__avatar")
+        count = product.reviews_count
         return ResponseLocale(user=request.user, status=200, data=dict(
             reviews=[review.to_dict() for review in reviews[(page-1)*limit:page*limit]],
             reviews_count=count,
-            seller_rating=sum([review.rating for review in seller_reviews])/seller_reviews.count()
-            if seller_reviews.count() else 0.0,
+            seller_rating=product.seller.rating,
             total_pages=ceil(count/limit)
         ))
 
@@ -747,58 +526,32 @@ class PaymentViewSet(GenericViewSet):
     @extend_schema(request=inline_serializer("Test", fields={"test": serializers.CharField()}))
     @action(methods=["POST"], url_path="cryptomus", detail=False)
     def cryptomus_webhook(self, request: Request):
-        requests.post(
-            url='https://api.telegram.org/bot7382407188:AAFPbWGGhfSwadZ5Gi48ftrF-Gz0M0jk5wg/sendMessage',
-            data={'chat_id': 1776920875, 'text': f"{request.META['REMOTE_ADDR']}, {request.data}"}
-        )
-        if not check_sign(request.data):
+        data = get_request_payload(request)
+        if not check_sign(data):
             return ResponseLocale(user=request.user, status=400, data={"message": "Invalid signature!"})
-        transactions = Purchase.objects.filter(uuid=request.data.get("uuid")).exclude(status=TransactionStatus.paid)
-        if not transactions:
-            transactions = BalanceTopUp.objects.filter(uuid=request.data.get("uuid")).exclude(status=TransactionStatus.paid)
-        for transaction in transactions:
-            transaction.txid = request.data.get("txid")
-            transaction.status = request.data.get("status")
-            transaction.save()
-            if transaction.status == TransactionStatus.paid:
-                transaction.process()
-            if transaction.status == TransactionStatus.paid_over:
-                transaction.amount = float(request.data.get("payment_amount_usd"))
-                transaction.save()
-                transaction.process()
+        # Обработка идёт в фоне, ключ uuid:status отсекает повторы одного и того же уведомления
+        PaymentEvent.register(PaymentEvent.Providers.cryptomus, f"{data.get('uuid')}:{data.get('status')}",
+                              data, request.META.get("REMOTE_ADDR"))
         return ResponseLocale(user=request.user, status=200, data={"message": "OK!"})
 
     @action(methods=["POST"], detail=False, url_path="crypto")
     def crypto_webhook(self, request: Request):
-        if not check_sign(request.data, CRYPTO_SECRET_KEY):
+        data = get_request_payload(request)
+        if not check_sign(data, CRYPTO_SECRET_KEY):
             return ResponseLocale(user=request.user, status=403, data={"message": "Invalid signature!"})
-        data = {
-            "amount": Decimal(request.data.get("amount")),
-            "currency": request.data.get("ticker"),
-            "network": request.data.get("network")
-        }
-        try:
-            invoice = get_object_or_404(Invoice, ~Q(purchases__status=TransactionStatus.paid),
-                                    expiration_dt__gte=datetime.datetime.now(), **data)
-        except:
-            invoice = get_object_or_404(Invoice, ~Q(balance_top_up__status=TransactionStatus.paid),
-                                        expiration_dt__gte=datetime.datetime.now(), **data)
-        if invoice.type == "balance":
-            invoice.balance_top_up.process()
-        else:
-            for purchase in invoice.purchases.all():
-                purchase.process()
+        if not data.get("tx_hash"):
+            return ResponseLocale(user=request.user, status=400, data={"message": "Invalid hash!"})
+        PaymentEvent.register(PaymentEvent.Providers.crypto, data.get("tx_hash"), data,
+                              request.META.get("REMOTE_ADDR"))
         return ResponseLocale(user=request.user, status=200, data={"message": "OK!"})
 
     @action(methods=["POST"], detail=False, url_path="stripe")
     def stripe_webhook(self, request: Request):
         event = stripe_get_event(request)
         if event.type == "invoice.paid":
-            uuid = event.data.get("object").get("metadata").get("uuid")
-            transaction = Purchase.objects.filter(uuid=uuid).first()
-            if not transaction:
-                transaction = BalanceTopUp.objects.filter(uuid=uuid).first()
-            transaction.process()
+            PaymentEvent.register(PaymentEvent.Providers.stripe, event.id,
+                                  {"uuid": event.data.get("object").get("metadata").get("uuid")},
+                                  request.META.get("REMOTE_ADDR"))
         return ResponseLocale(user=request.user, status=200)
 
     @action(methods=["GET"], detail=False, url_path="get-crypto-methods",
@@ -831,7 +584,11 @@ class PaymentViewSet(GenericViewSet):
             return ResponseLocale(user=request.user, status=201, data={"message": "Invoice has already been activated!"})
         invoice.currency = currency
         invoice.network = network
-        invoice.save()
+        try:
+            invoice.save()
+        except RateUnavailable as e:
+            logger.error(f"Failed to activate invoice {invoice.uuid}: {e}")
+            return ResponseLocale(user=request.user, status=400, data={"message": "Exchange rate is temporarily unavailable, try again later!"})
         return ResponseLocale(user=request.user, status=200, data={"message": "Invoice is activated!"})
 
     @extend_schema(parameters=[inline_serializer("GetPaymentTypes", fields={
@@ -0,0 +1,90 @@
+import json
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+from Main.celery import app
+from Proxy.http_client import get_http_client
+from inshop.settings import logger
+
+CATALOG_KEY = "proxy_drop:catalog"
+# Каталог считается свежим FRESH_SECONDS, после этого отдаётся как есть и обновляется в фоне
+FRESH_SECONDS = 600
+STORE_SECONDS = 60 * 60 * 24
+REFRESH_LOCK_SECONDS = 120
+# При промахе каталог перезагружается, если он старше MISS_RELOAD_SECONDS
+MISS_RELOAD_SECONDS = 60
+
+http = get_http_client("proxy-drop")
+
+
+def get_goods_key(category_id, product_name):
+    return f"{category_id}:{product_name}"
+
+
+def load_catalog():
+    """
+    Загрузка категорий и товаров ProxyDrop и построение индексов по названию
+    """
+    response = http.post(
+        f"{settings.DROP_PROXY_BASE_URL}/categories",
+        headers=settings.DROP_PROXY_HEADER,
+        params=settings.DROP_PROXY_PARAMS_GET,
+    )
+    response.raise_for_status()
+    categories = json.loads(response.text)
+    response = http.post(
+        f"{settings.DROP_PROXY_BASE_URL}/goods",
+        headers=settings.DROP_PROXY_HEADER,
+        params=settings.DROP_PROXY_PARAMS_GET,
+    )
+    response.raise_for_status()
+    goods = response.json().get("goods", {})
+    catalog = {
+        "categories": {value.get("name"): value.get("id") for value in categories.values()},
+        "goods": {get_goods_key(item.get("id_cat"), item.get("name").replace(" ", "")): item.get("id")
+                  for item in goods.values()},
+        "updated_at": time.time()
+    }
+    cache.set(CATALOG_KEY, catalog, STORE_SECONDS)
+    cache.delete(f"{CATALOG_KEY}:refresh")
+    return catalog
+
+
+def get_catalog(force=False):
+    """
+    Каталог из общего кэша, при отсутствии загружается сразу, устаревший обновляется в фоне
+    """
+    catalog = None if force else cache.get(CATALOG_KEY)
+    if not catalog:
+        return load_catalog()
+    if time.time() - catalog["updated_at"] > FRESH_SECONDS and \
+            cache.add(f"{CATALOG_KEY}:refresh", 1, REFRESH_LOCK_SECONDS):
+        app.send_task(name="refresh_proxy_drop_catalog", route_name="refresh_proxy_drop_catalog")
+    return catalog
+
+
+def find_in_catalog(section, key):
+    """
+    Поиск в индексе каталога, при промахе каталог перезагружается один раз
+    """
+    catalog = get_catalog()
+    value = catalog[section].get(key)
+    if value is None and time.time() - catalog["updated_at"] > MISS_RELOAD_SECONDS:
+        value = get_catalog(force=True)[section].get(key)
+    return value
+
+
+def get_category_id(category_name):
+    category_id = find_in_catalog("categories", category_name)
+    if category_id is None:
+        logger.warning(f"Category '{category_name}' not found.")
+    return category_id
+
+
+def get_product_id(category_id, product_name):
+    product_id = find_in_catalog("goods", get_goods_key(category_id, product_name))
+    if product_id is None:
+        logger.warning(f"Product '{product_name}' not found in category ID {category_id}.")
+    return product_id
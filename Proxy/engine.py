@@ -0,0 +1,77 @@
+import asyncio
+
+import httpx
+
+from Proxy.http_client import CONNECT_TIMEOUT, READ_TIMEOUT
+from Proxy.providers import ProvidersFactory
+from inshop.settings import logger
+
+CONCURRENCY = 10
+
+
+class AsyncProviderEngine:
+    """
+    Параллельные запросы к провайдерам по нескольким планам с ограничением числа одновременных запросов
+    """
+    def __init__(self, concurrency=CONCURRENCY):
+        self.concurrency = concurrency
+
+    async def traffic_left(self, proxy_purchases):
+        """
+        Остаток трафика по планам, {proxy_purchase_id: остаток}.
+        Планы провайдера с общим запросом (shared_traffic_request) обслуживаются одним запросом.
+        """
+        groups = {}
+        for proxy_purchase in proxy_purchases:
+            provider_class = ProvidersFactory.get_provider(proxy_purchase.purchase.seller.user.username)
+            if not provider_class:
+                continue
+            provider = provider_class(proxy_purchase)
+            traffic_request = provider.traffic_left_request()
+            if not traffic_request:
+                continue
+            method, url, kwargs = traffic_request
+            key = (provider_class, method, url) if provider_class.shared_traffic_request else proxy_purchase.pk
+            groups.setdefault(key, (traffic_request, []))[1].append(provider)
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+        limits = httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        timeout = httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT)
+        async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+            results = await asyncio.gather(*[
+                self._fetch_group(client, semaphore, traffic_request, providers)
+                for traffic_request, providers in groups.values()
+            ])
+        values = {}
+        for result in results:
+            values.update(result)
+        return values
+
+    @staticmethod
+    async def _fetch_group(client, semaphore, traffic_request, providers):
+        method, url, kwargs = traffic_request
+        try:
+            async with semaphore:
+                response = await providers[0].traffic_http.arequest(client, method, url, **kwargs)
+            response.raise_for_status()
+            data = type(providers[0]).index_traffic_left(response.json())
+        except Exception as e:
+            logger.error(f"Failed to get traffic left from {providers[0].provider}: {e}")
+            return {}
+        values = {}
+        for provider in providers:
+            try:
+                traffic_left = provider.parse_traffic_left(data)
+            except Exception as e:
+                logger.error(f"Invalid traffic left response for proxy purchase {provider.proxy_purchase.pk}: {e}")
+                continue
+            if traffic_left is not None:
+                values[provider.proxy_purchase.pk] = traffic_left
+        return values
+
+
+def fetch_traffic_left(proxy_purchases, concurrency=CONCURRENCY):
+    """
+    Синхронный фасад движка для существующего синхронного кода
+    """
+    return asyncio.run(AsyncProviderEngine(concurrency).traffic_left(proxy_purchases))
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import threading
+
+from django.http import HttpResponse, HttpResponseNotModified
+
+from Proxy.models import ProxyProviders
+
+CACHE_CONTROL = "public, max-age=86400"
+
+
+class GeoBody:
+    __slots__ = ("body", "etag")
+
+    def __init__(self, data):
+        self.body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest()[:20] + '"'
+
+
+class GeoIndex:
+    """
+    Гео-справочник провайдера: готовые тела ответов по стране и штату, файлы читаются один раз
+    """
+    def __init__(self, suffix, upper_codes=False):
+        self.upper_codes = upper_codes
+        self.countries = GeoBody(self._codes(self._load("countries", suffix)))
+        self.states = {}
+        for country_code, states in self._load("states", suffix).items():
+            if not states:
+                continue
+            if suffix:
+                data = [{"code": state.get("code"), "name": state.get("name")} for state in states]
+            else:
+                data = [{"code": state, "name": state} for state in states]
+            self.states[country_code] = GeoBody(self._codes(data))
+        self.cities = {}
+        for country_code, states in self._load("cities", suffix).items():
+            for state_code, cities in (states or {}).items():
+                if not cities:
+                    continue
+                data = [{"code": city.get("code"), "name": city.get("code")} for city in cities]
+                self.cities[(country_code, state_code)] = GeoBody(self._codes(data))
+        self.empty = GeoBody([])
+
+    @staticmethod
+    def _load(name, suffix):
+        with open(f"static/{name}{suffix}.json", "r") as file:
+            return json.load(file)
+
+    def _codes(self, data):
+        if self.upper_codes:
+            for item in data:
+                item["code"] = item["code"].upper()
+        return data
+
+    def get(self, country_code=None, state_code=None):
+        if country_code and state_code:
+            return self.cities.get((country_code, state_code), self.empty)
+        if country_code:
+            return self.states.get(country_code, self.empty)
+        return self.countries
+
+
+indexes = {}
+indexes_lock = threading.Lock()
+
+
+def get_geo_index(provider):
+    if provider == ProxyProviders.PROXY_SELLER:
+        key = ("PrSel", False)
+    elif provider in [ProxyProviders.BOB, ProxyProviders.PROVIDER711]:
+        key = ("", True)
+    else:
+        key = ("", False)
+    if key not in indexes:
+        with indexes_lock:
+            if key not in indexes:
+                indexes[key] = GeoIndex(*key)
+    return indexes[key]
+
+
+def geo_response(request, geo_body):
+    """
+    Ответ с готовым телом, ETag и Cache-Control, 304 при совпадении If-None-Match
+    """
+    if request.headers.get("If-None-Match") == geo_body.etag:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(geo_body.body, content_type="application/json")
+    response["ETag"] = geo_body.etag
+    response["Cache-Control"] = CACHE_CONTROL
+    return response
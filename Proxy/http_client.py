@@ -0,0 +1,183 @@
+import asyncio
+import threading
+import time
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from inshop.settings import logger
+
+CONNECT_TIMEOUT = 5
+READ_TIMEOUT = 30
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+POOL_MAXSIZE = 20
+
+# Автомат размыкается после FAILURE_THRESHOLD ошибок подряд и пропускает пробный запрос через RESET_TIMEOUT секунд
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 30
+
+RETRY_STATUSES = (502, 503, 504)
+# Повторяются только чтения: PUT/POST/DELETE у провайдеров меняют подписку и трафик, повтор может списать дважды
+RETRY_METHODS = frozenset({"GET", "HEAD"})
+
+
+class CircuitOpenError(requests.RequestException):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow(self):
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Полуоткрытое состояние: пропускаем один запрос, до его результата автомат снова закрыт для остальных
+                self.opened_at = time.monotonic()
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class ProviderHttpClient:
+    """
+    HTTP-клиент провайдера: пул keep-alive соединений, таймауты, повторы запросов на чтение и автомат
+    """
+    def __init__(self, name, timeout=(CONNECT_TIMEOUT, READ_TIMEOUT), retries=RETRIES,
+                 backoff_factor=BACKOFF_FACTOR, pool_maxsize=POOL_MAXSIZE):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=pool_maxsize,
+            max_retries=Retry(
+                total=retries,
+                backoff_factor=backoff_factor,
+                status_forcelist=RETRY_STATUSES,
+                allowed_methods=RETRY_METHODS,
+                raise_on_status=False
+            )
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.breaker = CircuitBreaker()
+        self.stats_lock = threading.Lock()
+        self.requests_count = 0
+        self.errors_count = 0
+        self.rejected_count = 0
+        self.total_latency = 0.0
+
+    def request(self, method, url, **kwargs):
+        if not self.breaker.allow():
+            with self.stats_lock:
+                self.rejected_count += 1
+            raise CircuitOpenError(f"Circuit for provider {self.name} is open")
+        kwargs.setdefault("timeout", self.timeout)
+        started = time.monotonic()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self._record(started, error=True)
+            raise
+        self._record(started, error=response.status_code >= 500)
+        return response
+
+    async def arequest(self, client: httpx.AsyncClient, method, url, **kwargs):
+        """
+        Асинхронный запрос через переданный httpx-клиент с тем же автоматом, повторами и счётчиками
+        """
+        if not self.breaker.allow():
+            with self.stats_lock:
+                self.rejected_count += 1
+            raise CircuitOpenError(f"Circuit for provider {self.name} is open")
+        retries = self.retries if method.upper() in RETRY_METHODS else 0
+        started = time.monotonic()
+        for attempt in range(retries + 1):
+            try:
+                response = await client.request(method, url, **kwargs)
+            except httpx.TransportError:
+                if attempt == retries:
+                    self._record(started, error=True)
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUSES or attempt == retries:
+                    self._record(started, error=response.status_code >= 500)
+                    return response
+            await asyncio.sleep(self.backoff_factor * 2 ** attempt)
+
+    def _record(self, started, error):
+        with self.stats_lock:
+            self.requests_count += 1
+            self.total_latency += time.monotonic() - started
+            if error:
+                self.errors_count += 1
+        if error:
+            self.breaker.record_failure()
+            logger.warning(f"Provider {self.name} request failed")
+        else:
+            self.breaker.record_success()
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request("DELETE", url, **kwargs)
+
+    def get_stats(self):
+        with self.stats_lock:
+            return {
+                "requests": self.requests_count,
+                "errors": self.errors_count,
+                "rejected": self.rejected_count,
+                "avg_latency_ms": round(self.total_latency / self.requests_count * 1000, 2)
+                if self.requests_count else None,
+                "circuit_open": self.breaker.is_open
+            }
+
+
+clients = {}
+
+
+def get_http_client(name):
+    if name not in clients:
+        clients[name] = ProviderHttpClient(name)
+    return clients[name]
+
+
+def get_http_stats():
+    """
+    Счётчики запросов к провайдерам в текущем процессе
+    """
+    return {name: client.get_stats() for name, client in clients.items()}
@@ -19,6 +19,8 @@ from django.conf import settings
 from Main.celery import app
 from Main.models import Category, Purchase, Product, PaymentType, TransactionStatus
 
+from Proxy.drop_catalog import get_category_id, get_product_id
+from Proxy.http_client import get_http_client
 from Proxy.models import ProxyProviders, ProxyTypes, ProxyPurchase, get_expiration_date
 from inshop.settings import logger, GEONODE_API_URL
 
@@ -131,8 +133,37 @@ class Proxies:
     def read_plan(self):
         pass
 
+    # Запрос остатка трафика одинаков для всех планов провайдера и выполняется один раз на группу
+    shared_traffic_request = False
+
+    def traffic_left_request(self):
+        """
+        Описание запроса остатка трафика: (method, url, kwargs) или None, если провайдер не поддерживает
+        """
+        return None
+
+    @classmethod
+    def index_traffic_left(cls, data):
+        """
+        Подготовка ответа провайдера к разбору, выполняется один раз на группу планов
+        """
+        return data
+
+    def parse_traffic_left(self, data):
+        return None
+
+    @property
+    def traffic_http(self):
+        return self.http
+
     def get_traffic_left(self):
-        pass
+        traffic_request = self.traffic_left_request()
+        if not traffic_request:
+            return None
+        method, url, kwargs = traffic_request
+        response = self.traffic_http.request(method, url, **kwargs)
+        response.raise_for_status()
+        return self.parse_traffic_left(self.index_traffic_left(response.json()))
 
     def prolong_plan(self):
         pass
@@ -148,11 +179,13 @@ class Proxies:
 
 
 class LightningProxies(Proxies):
+    http = get_http_client("lola")
+
     def create_plan_request(self, data):
         url = f'{settings.LOLA_HOST}/api/getplan/{self.proxy_type}'
         logger.info(f"Creating plan request with data: {data}")
         print(data)
-        response = requests.post(url, headers=settings.LOLA_HEADERS, data=data)
+        response = self.http.post(url, headers=settings.LOLA_HEADERS, data=data)
         print(response.text)
         return self.handle_response(response).get('PlanID')
 
@@ -164,7 +197,7 @@ class LightningProxies(Proxies):
         plan_id = self.proxy_purchase.service_data.get('plan')
         url = f"{settings.LOLA_HOST}/api/info/{plan_id}"
         logger.info(f"Fetching plan info for plan_id: {plan_id}")
-        response = requests.get(url, headers=settings.LOLA_HEADERS)
+        response = self.http.get(url, headers=settings.LOLA_HEADERS)
         print("info lola ", response.text)
         return self.handle_response(response)
 
@@ -175,12 +208,17 @@ class LightningProxies(Proxies):
         plan_id = self.proxy_purchase.service_data.get('plan')
         url = f"{settings.LOLA_HOST}/api/plan/{self.proxy_type}/read/{plan_id}"
         logger.info(f"read plan info for plan_id: {plan_id}")
-        response = requests.get(url, headers=settings.LOLA_HEADERS)
+        response = self.http.get(url, headers=settings.LOLA_HEADERS)
         print("read lola ", response.text)
         return self.handle_response(response)
 
-    def get_traffic_left(self):
-        return self.read_plan().get("bandwidthLeft")
+    def traffic_left_request(self):
+        plan_id = self.proxy_purchase.service_data.get('plan')
+        return "GET", f"{settings.LOLA_HOST}/api/plan/{self.proxy_type}/read/{plan_id}", \
+            {"headers": settings.LOLA_HEADERS}
+
+    def parse_traffic_left(self, data):
+        return data.get("bandwidthLeft")
 
     def get_and_read_plan(self):
         data = {}
@@ -218,7 +256,7 @@ class LightningProxies(Proxies):
         plan_id = self.proxy_purchase.extend_of.service_data.get("plan")
         url = f"{settings.LOLA_HOST}/api/add/{plan_id}/{self.count}"
         logger.info(f"Adding residential proxies to plan_id: {plan_id} with count: {self.count}")
-        response = requests.post(url, headers=settings.LOLA_HEADERS)
+        response = self.http.post(url, headers=settings.LOLA_HEADERS)
         self.handle_response(response)
         self.proxy_purchase.extend_of.count += self.count
         self.proxy_purchase.extend_of.expiration_date = get_expiration_date()
@@ -258,15 +296,15 @@ class LightningProxies(Proxies):
         country_code = data.get('country_code')
         state = data.get('state')
         if not country_code and not state:
-            response = requests.post(f"{settings.LOLA_HOST}/api/getlist/country_list",
-                                     headers=settings.LOLA_HEADERS)
+            response = LightningProxies.http.post(f"{settings.LOLA_HOST}/api/getlist/country_list",
+                                                  headers=settings.LOLA_HEADERS)
         elif country_code and not state:
-            response = requests.post(
+            response = LightningProxies.http.post(
                 f"{settings.LOLA_HOST}/api/getlist/state_list", headers=settings.LOLA_HEADERS,
                 data={"country_code": (None, country_code)}
             )
         elif country_code and state:
-            response = requests.post(
+            response = LightningProxies.http.post(
                 f"{settings.LOLA_HOST}/api/getlist/city_list", headers=settings.LOLA_HEADERS,
                 data={"country_code": (None, country_code), "state": (None, state)},
             )
@@ -288,6 +326,8 @@ class LightningProxies(Proxies):
 
 
 class Provider711(Proxies):
+    http = get_http_client("provider711")
+
     def __init__(self, proxy_purchase):
         self.headers = {
             "Authorization": f"Bearer {settings.PROVIDER711_API_TOKEN}"
@@ -300,7 +340,7 @@ class Provider711(Proxies):
             "expire": expiration_dt,
             "flow": str(self.count*1000000000),
         }
-        response = requests.post(
+        response = self.http.post(
             f"{settings.PROVIDER711_API_URL}/eapi/order/",
             json=data,
             headers=self.headers
@@ -325,8 +365,8 @@ class Provider711(Proxies):
             "username": proxy_data.get("username"),
             "flow": str(int(self.count*1000000000))
         }
-        response = requests.post(f'{settings.PROVIDER711_API_URL}/eapi/order/allocate',
-                                 json=data, headers=self.headers)
+        response = self.http.post(f'{settings.PROVIDER711_API_URL}/eapi/order/allocate',
+                                  json=data, headers=self.headers)
         logger.error(response.status_code, response.text)
         data = response.json()
         if data.get("error"):
@@ -335,16 +375,16 @@ class Provider711(Proxies):
         self.proxy_purchase.extend_of.expiration_date = get_expiration_date()
         self.proxy_purchase.extend_of.save()
 
-    def get_traffic_left(self):
+    def traffic_left_request(self):
         plan_id = self.proxy_purchase.service_data.get("plan_id")
         if self.proxy_purchase.extend_of:
             plan_id = self.proxy_purchase.extend_of.service_data.get("plan_id")
-        response = requests.get(f"{settings.PROVIDER711_API_URL}/eapi/order/", params={
-            "order_no": plan_id,
-        }, headers=self.headers)
-        data = response.json()
+        return "GET", f"{settings.PROVIDER711_API_URL}/eapi/order/", \
+            {"params": {"order_no": plan_id}, "headers": self.headers}
+
+    def parse_traffic_left(self, data):
         if data.get("error"):
-            logger.error(f"Provider711 Error when receiving traffic - status {response.status_code}: {response.text}")
+            logger.error(f"Provider711 Error when receiving traffic: {data}")
         return int(data.get("un_flow")) / 1000000000
 
     def generate_result(self):
@@ -355,6 +395,7 @@ class Provider711(Proxies):
 
 
 class BobProxies(Proxies):
+    http = get_http_client("geonode")
     GEO_NODE_HEADER = {"r-api-key": settings.GEONODE_API_KEY}
 
     def plan_info(self):
@@ -365,13 +406,21 @@ class BobProxies(Proxies):
         plan = self.proxy_purchase.service_data
         url = f"{GEONODE_API_URL}/api/reseller/user/{plan.get('id')}"
         logger.info(f"Fetching plan info for plan_id: {plan.get('id')}")
-        response = self.handle_response(requests.get(url, headers=self.GEO_NODE_HEADER,
-                                                     auth=HTTPBasicAuth(plan.get('username'), plan.get('password'))))
+        response = self.handle_response(self.http.get(url, headers=self.GEO_NODE_HEADER,
+                                                      auth=HTTPBasicAuth(plan.get('username'), plan.get('password'))))
         print("info bob ", response)
         return response
 
-    def get_traffic_left(self):
-        usage_bandwidth = self.read_plan().get("data").get("usageBandwidth")*math.pow(10, -6)
+    def traffic_left_request(self):
+        if not self.proxy_purchase.extend_of:
+            plan = self.proxy_purchase.service_data
+        else:
+            plan = self.proxy_purchase.extend_of.service_data
+        return "GET", f"{GEONODE_API_URL}/api/reseller/user/traffic/{plan.get('id')}", \
+            {"headers": self.GEO_NODE_HEADER, "auth": (plan.get('username'), plan.get('password'))}
+
+    def parse_traffic_left(self, data):
+        usage_bandwidth = data.get("data").get("usageBandwidth")*math.pow(10, -6)
         count_now = self.proxy_purchase.count
         if self.proxy_purchase.extend_of:
             count_now = self.proxy_purchase.extend_of.count
@@ -387,8 +436,8 @@ class BobProxies(Proxies):
             plan = self.proxy_purchase.extend_of.service_data
         url = f"{GEONODE_API_URL}/api/reseller/user/traffic/{plan.get('id')}"
         logger.info(f"read plan info for plan_id: {plan.get('id')}")
-        response = self.handle_response(requests.get(url, headers=self.GEO_NODE_HEADER,
-                                                     auth=HTTPBasicAuth(plan.get('username'), plan.get('password'))))
+        response = self.handle_response(self.http.get(url, headers=self.GEO_NODE_HEADER,
+                                                      auth=HTTPBasicAuth(plan.get('username'), plan.get('password'))))
         print("read bob ", response)
         return response
 
@@ -438,7 +487,7 @@ class BobProxies(Proxies):
             "password": password,
         }
         logger.info(f"Creating plan request with data: {data}")
-        response = requests.post(url, headers=self.GEO_NODE_HEADER, json=data)
+        response = self.http.post(url, headers=self.GEO_NODE_HEADER, json=data)
         data = self.handle_response(response)
         self.proxy_purchase.service_data=dict(
                 username=random_username,
@@ -460,7 +509,7 @@ class BobProxies(Proxies):
                 '%Y-%m-%dT%H:%M:%S') + 'Z',
         }
         logger.info(f"geo service exists {data} sending this")
-        result_add = requests.put(url_add, headers=self.GEO_NODE_HEADER, json=data)
+        result_add = self.http.put(url_add, headers=self.GEO_NODE_HEADER, json=data)
         self.proxy_purchase.extend_of.count += self.count
         self.proxy_purchase.extend_of.save()
         logger.info(f"response from geo {result_add.json()}")
@@ -472,6 +521,8 @@ class BobProxies(Proxies):
 
 
 class ProxyResellerProvider(Proxies):
+    http = get_http_client("proxy-seller")
+
     def __init__(self, proxy_purchase):
         super().__init__(proxy_purchase)
         self.support_change_credentials = True
@@ -479,7 +530,7 @@ class ProxyResellerProvider(Proxies):
     def get_plan_info(self):
         if not self.proxy_purchase.service_data.get("login") and not self.proxy_purchase.extend_of:
             plan_id = self.proxy_purchase.service_data.get("plan")
-            response = requests.put(
+            response = self.http.put(
                 f"{settings.RESELLER_PROXY_BASE_URL}/residentsubuser/list/tools?package_key={plan_id}"
             ).json()
             user_data = response["data"]
@@ -495,7 +546,7 @@ class ProxyResellerProvider(Proxies):
     def prolong_plan(self):
         try:
             traffic = self.count*1000000000
-            response = requests.get(f"{settings.RESELLER_PROXY_BASE_URL}/residentsubuser/packages")
+            response = self.http.get(f"{settings.RESELLER_PROXY_BASE_URL}/residentsubuser/packages")
             response.raise_for_status()
 
             all_packages = response.json()
@@ -516,7 +567,7 @@ class ProxyResellerProvider(Proxies):
                         "package_key": plan_id,
                     }
 
-                    update_response = requests.post(
+                    update_response = self.http.post(
                         f"{settings.RESELLER_PROXY_BASE_URL}/residentsubuser/update", json=data
                     )
                     update_response.raise_for_status()
@@ -542,7 +593,7 @@ class ProxyResellerProvider(Proxies):
 
     def change_credentials(self):
         self.count = self.get_traffic_left()
-        response = requests.delete(
+        response = self.http.delete(
             f"{settings.RESELLER_PROXY_BASE_URL}/residentsubuser/delete?",
             params={"package_key": self.proxy_purchase.service_data.get('plan')}
         )
@@ -563,7 +614,7 @@ class ProxyResellerProvider(Proxies):
                 "is_link_date": False,
             }
 
-            response = requests.post(f"{settings.RESELLER_PROXY_BASE_URL}/residentsubuser/create", data=data)
+            response = self.http.post(f"{settings.RESELLER_PROXY_BASE_URL}/residentsubuser/create", data=data)
             response.raise_for_status()
 
             request_result = response.json()
@@ -589,56 +640,36 @@ class ProxyResellerProvider(Proxies):
         return super()._generate_result("proxy-seller", plan_info.get("username"),
                                         plan_info.get("password"))
 
-    def get_traffic_left(self):
-        response = requests.get(f"{settings.RESELLER_PROXY_BASE_URL}/residentsubuser/packages")
-        response.raise_for_status()
-        result = response.json()
-        data = result.get("data", {})
-        if not data:
+    shared_traffic_request = True
+
+    def traffic_left_request(self):
+        return "GET", f"{settings.RESELLER_PROXY_BASE_URL}/residentsubuser/packages", {}
+
+    @classmethod
+    def index_traffic_left(cls, data):
+        return {item["package_key"]: item["traffic_left"] / 1000000000 for item in data.get("data") or []}
+
+    def parse_traffic_left(self, packages_traffic):
+        if not packages_traffic:
             return 0
-        for item in data:
-            if item["package_key"] == self.proxy_purchase.service_data.get("plan"):
-                logger.info(f"{item['package_key']} - {item['traffic_left']}")
-                traffic_left = item["traffic_left"] / 1000000000
-                return traffic_left
+        return packages_traffic.get(self.proxy_purchase.service_data.get("plan"))
 
 class ProxyPropProvider(Proxies):
-    def _get_category_id(self, category_name):
-        response = requests.post(
-            f"{settings.DROP_PROXY_BASE_URL}/categories",
-            headers=settings.DROP_PROXY_HEADER,
-            params=settings.DROP_PROXY_PARAMS_GET,
-        )
-        response.raise_for_status()
-        categories = json.loads(response.text)
+    http = get_http_client("proxy-drop")
+    buy_http = get_http_client("proxy-drop-buy")
 
-        for key, value in categories.items():
-            if value.get("name") == category_name:
-                return value.get("id")
-        logger.warning(f"Category '{category_name}' not found.")
-        return None
+    def _get_category_id(self, category_name):
+        return get_category_id(category_name)
 
     def _get_product_id(self, category_id, product_name):
-        response = requests.post(
-            f"{settings.DROP_PROXY_BASE_URL}/goods",
-            headers=settings.DROP_PROXY_HEADER,
-            params=settings.DROP_PROXY_PARAMS_GET,
-        )
-        response.raise_for_status()
-        goods = response.json().get("goods", {})
-
-        for item in goods.values():
-            if item.get("id_cat") == category_id and item.get("name").replace(" ", "") == product_name:
-                return item.get("id")
-        logger.warning(f"Product '{product_name}' not found in category ID {category_id}.")
-        return None
+        return get_product_id(category_id, product_name)
 
     def _create_order(self, product_id):
         data = settings.DROP_PROXY_PARAMS_ORDER.copy()
         data["type"] = int(product_id)
         data["count"] = 1
         data["rules"] = 1
-        response = requests.post(
+        response = self.http.post(
             f"{settings.DROP_PROXY_BASE_URL}/createorder", headers=settings.DROP_PROXY_HEADER, data=data
         )
         response.raise_for_status()
@@ -651,7 +682,7 @@ class ProxyPropProvider(Proxies):
 
     def _pay_order(self, invoice):
         data = settings.DROP_PROXY_DATA_PAY
-        response = requests.post(
+        response = self.http.post(
             f"{settings.DROP_PROXY_BASE_URL}/paybalance/{invoice}",
             headers=settings.DROP_PROXY_HEADER,
             data=data,
@@ -661,7 +692,7 @@ class ProxyPropProvider(Proxies):
         return response.json().get("invoice")
 
     def _download_credentials(self, invoice):
-        response = requests.post(
+        response = self.http.post(
             f"{settings.DROP_PROXY_BASE_URL}/downloadtxt/{invoice}", headers=settings.DROP_PROXY_HEADER
         )
         response.raise_for_status()
@@ -750,7 +781,7 @@ class ProxyPropProvider(Proxies):
                 login, password, coupon = self._download_credentials(paid_invoice)
                 if coupon:
                     logger.info(f"Refill package with coupon {self.get_coupon(package)}")
-                    response = requests.get(
+                    response = self.buy_http.get(
                         f"{settings.DROP_PROXY_BUY_URL}/sub-account/"
                         f"{self.proxy_purchase.extend_of.service_data.get('login')}"
                         f"/refill/{coupon}/v6r890YmOUuzLX8Lw5v6c98enZROmwFomEfDenuckfV87ITgcyT5PCVnLkT8"
@@ -771,14 +802,17 @@ class ProxyPropProvider(Proxies):
         self.proxy_purchase.extend_of.expiration_date = get_expiration_date()
         self.proxy_purchase.extend_of.save()
 
-    def get_traffic_left(self):
+    def traffic_left_request(self):
         data = self.proxy_purchase.service_data
         url = (f"{settings.DROP_PROXY_BUY_URL}/sub-account/{data.get('login')}/"
                f"v6r890YmOUuzLX8Lw5v6c98enZROmwFomEfDenuckfV87ITgcyT5PCVnLkT8")
-        response = requests.get(url)
-        response.raise_for_status()
-        text_response = response.text
-        result = json.loads(text_response)
+        return "GET", url, {}
+
+    @property
+    def traffic_http(self):
+        return self.buy_http
+
+    def parse_traffic_left(self, result):
         bandWidth = result.get("bandWidth")
         bandWidthLimit = result.get("bandWidthLimit")
         if not bandWidthLimit:
@@ -0,0 +1,31 @@
+from django.db.models import Q
+from django.utils import timezone
+
+from Main.celery import app
+from Proxy.drop_catalog import load_catalog
+from Proxy.models import ProxyPurchase, ProxyTypes
+from Proxy.traffic import refresh_traffic_left as refresh_traffic_left_cache
+
+
+def get_traffic_proxy_purchases(*filters):
+    return ProxyPurchase.objects.filter(
+        ~Q(service_data={}), *filters, extend_of_id__isnull=True
+    ).exclude(type__name=ProxyTypes.ISP).select_related("type", "purchase__seller__user", "purchase__buyer")
+
+
+@app.task(name='refresh_traffic_left', bind=True)
+def refresh_traffic_left(*args, **kwargs):
+    proxy_purchases = get_traffic_proxy_purchases(Q(id__in=kwargs.get("proxy_purchase_ids", [])))
+    return len(refresh_traffic_left_cache(list(proxy_purchases)))
+
+
+@app.task(name='refresh_all_traffic_left', bind=True)
+def refresh_all_traffic_left(*args, **kwargs):
+    proxy_purchases = get_traffic_proxy_purchases(Q(expiration_date__gte=timezone.now()))
+    return len(refresh_traffic_left_cache(list(proxy_purchases)))
+
+
+@app.task(name='refresh_proxy_drop_catalog', bind=True)
+def refresh_proxy_drop_catalog(*args, **kwargs):
+    catalog = load_catalog()
+    return len(catalog["goods"])
@@ -1,3 +1,64 @@
+import asyncio
+from datetime import timedelta
+from unittest import mock
+
 from django.test import TestCase
+from django.utils import timezone
+
+from Main.models import Product, Purchase, Category
+from Proxy.engine import AsyncProviderEngine
+from Proxy.http_client import ProviderHttpClient
+from Proxy.models import ProxyPurchase
+from Proxy.providers import ProxyResellerProvider
+from Users.models import User, Seller
+
+
+class ProxyResellerTrafficTestCase(TestCase):
+    def setUp(self):
+        seller_user = User.objects.create(username="proxy-seller", password="password", role="seller")
+        seller = Seller.objects.create(user=seller_user, is_verified=True)
+        buyer = User.objects.create(username="buyer", password="password")
+        category = Category.objects.create(name="residential", description="residential", type=Product.ProductTypes.proxy)
+        product = Product.objects.create(title="proxy", description="proxy", prices={"1": 2.0}, seller=seller,
+                                         type=Product.ProductTypes.proxy)
+        self.proxy_purchases = []
+        for plan in ["first", "second", "missing"]:
+            purchase = Purchase.objects.create(product=product, seller=seller, buyer=buyer, amount=2)
+            self.proxy_purchases.append(ProxyPurchase.objects.create(
+                purchase=purchase, type=category, count=1, service_data={"plan": plan},
+                expiration_date=timezone.now() + timedelta(days=30)
+            ))
+
+    def test_group_is_indexed_once(self):
+        response = mock.Mock()
+        response.json.return_value = {"data": [
+            {"package_key": "first", "traffic_left": 1500000000},
+            {"package_key": "second", "traffic_left": 500000000},
+        ]}
+        providers = [ProxyResellerProvider(proxy_purchase) for proxy_purchase in self.proxy_purchases]
+        index_traffic_left = mock.Mock(wraps=ProxyResellerProvider.index_traffic_left)
+        with mock.patch.object(ProxyResellerProvider, "http") as http, \
+                mock.patch.object(ProxyResellerProvider, "index_traffic_left", index_traffic_left):
+            http.arequest = mock.AsyncMock(return_value=response)
+            values = asyncio.run(AsyncProviderEngine._fetch_group(
+                None, asyncio.Semaphore(1), providers[0].traffic_left_request(), providers
+            ))
+
+        self.assertEqual(index_traffic_left.call_count, 1)
+        self.assertEqual(values, {self.proxy_purchases[0].pk: 1.5, self.proxy_purchases[1].pk: 0.5})
+
+
+class ProviderHttpClientRetryTestCase(TestCase):
+    def test_only_reads_are_retried(self):
+        client = ProviderHttpClient("test", backoff_factor=0)
+        retry = client.session.get_adapter("https://example.com").max_retries
+        self.assertTrue(retry.is_retry("GET", 503))
+        self.assertFalse(retry.is_retry("PUT", 503))
+        self.assertFalse(retry.is_retry("POST", 503))
 
-# Create your tests here.
+        http = mock.Mock()
+        http.request = mock.AsyncMock(return_value=mock.Mock(status_code=503))
+        asyncio.run(client.arequest(http, "PUT", "https://example.com"))
+        self.assertEqual(http.request.await_count, 1)
+        asyncio.run(client.arequest(http, "GET", "https://example.com"))
+        self.assertEqual(http.request.await_count, 1 + 1 + client.retries)
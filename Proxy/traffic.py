@@ -0,0 +1,63 @@
+import time
+
+from django.core.cache import cache
+
+from Main.celery import app
+from Proxy.engine import fetch_traffic_left
+from inshop.settings import logger
+
+# Значение считается свежим FRESH_SECONDS, после этого отдаётся как есть и обновляется в фоне
+FRESH_SECONDS = 300
+STORE_SECONDS = 60 * 60 * 24
+REFRESH_LOCK_SECONDS = 60
+
+
+def get_traffic_key(proxy_purchase_id):
+    return f"traffic_left:{proxy_purchase_id}"
+
+
+def get_cached_traffic_left(proxy_purchases):
+    """
+    Остаток трафика из кэша без обращения к провайдерам.
+    Устаревшие и отсутствующие значения ставятся на обновление в фоне.
+    """
+    keys = {get_traffic_key(proxy_purchase.pk): proxy_purchase.pk for proxy_purchase in proxy_purchases}
+    if not keys:
+        return {}
+    try:
+        cached = cache.get_many(list(keys))
+        now = time.time()
+        result = {}
+        refresh_ids = []
+        for key, proxy_purchase_id in keys.items():
+            entry = cached.get(key)
+            if entry:
+                result[proxy_purchase_id] = entry["left"]
+            if (not entry or now - entry["updated_at"] > FRESH_SECONDS) and \
+                    cache.add(f"{key}:refresh", 1, REFRESH_LOCK_SECONDS):
+                refresh_ids.append(proxy_purchase_id)
+    except Exception as e:
+        logger.error(f"Traffic left cache is unavailable: {e}")
+        return {}
+    if refresh_ids:
+        app.send_task(name="refresh_traffic_left", route_name="refresh_traffic_left",
+                      kwargs={"proxy_purchase_ids": refresh_ids})
+    return result
+
+
+def refresh_traffic_left(proxy_purchases):
+    """
+    Запрос остатка трафика у провайдеров через асинхронный движок
+    """
+    try:
+        values = fetch_traffic_left(proxy_purchases)
+    except Exception as e:
+        logger.error(f"Failed to refresh traffic left: {e}")
+        values = {}
+    now = time.time()
+    cache.set_many({
+        get_traffic_key(proxy_purchase_id): {"left": traffic_left, "updated_at": now}
+        for proxy_purchase_id, traffic_left in values.items()
+    }, timeout=STORE_SECONDS)
+    cache.delete_many([f"{get_traffic_key(proxy_purchase.pk)}:refresh" for proxy_purchase in proxy_purchases])
+    return values
@@ -1,5 +1,4 @@
 import datetime
-import json
 
 from drf_spectacular.utils import extend_schema, inline_serializer
 from rest_framework.decorators import action
@@ -10,6 +9,7 @@ from rest_framework import serializers
 
 from Main.models import Product, Purchase
 from Main.utils import get_object_or_404
+from Proxy.geo import get_geo_index, geo_response
 from Proxy.models import ProxyPurchase, ProxyProviders
 from Proxy.providers import ProvidersFactory
 from Users.utils import TempUserAuthentication
@@ -60,36 +60,6 @@ class ProxyViewSet(GenericViewSet):
     })])
     @action(methods=["GET"], detail=False, url_path="get-geo")
     def get_geo(self, request: Request):
-        country_code = request.query_params.get("country_code")
-        state_code = request.query_params.get("state")
-        cities_name = "cities"
-        states_name = "states"
-        countries_name = "countries"
-        end_name = ".json"
-        if request.query_params.get("provider") == ProxyProviders.PROXY_SELLER:
-            end_name = "PrSel.json"
-        if country_code and state_code:
-            with open("static/"+cities_name+end_name, "r") as file:
-                cities = json.load(file).get(country_code).get(state_code)
-                if not cities:
-                    return Response(status=200, data=[])
-                data = [{"code": city.get("code"), "name": city.get("code")} for city in cities]
-        elif country_code:
-            with open("static/"+states_name+end_name, "r") as file:
-                states = json.load(file).get(country_code)
-                if not states:
-                    return Response(status=200, data=[])
-                if request.query_params.get("provider") == ProxyProviders.PROXY_SELLER:
-                    data = [{"code": state.get("code"), "name": state.get("name")} for state in states]
-                else:
-                    data = [{"code": state, "name": state} for state in states]
-        else:
-            with open("static/"+countries_name+end_name, "r") as file:
-                data = json.load(file)
-        if request.query_params.get("provider") in [ProxyProviders.BOB, ProxyProviders.PROVIDER711]:
-            cap_data = []
-            for i in data:
-                i["code"] = i["code"].upper()
-                cap_data.append(i)
-            return Response(status=200, data=cap_data)
-        return Response(status=200, data=data)
+        geo_index = get_geo_index(request.query_params.get("provider"))
+        geo_body = geo_index.get(request.query_params.get("country_code"), request.query_params.get("state"))
+        return geo_response(request, geo_body)
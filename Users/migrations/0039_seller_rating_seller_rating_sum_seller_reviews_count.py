@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Users', '0038_alter_user_locale'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='seller',
+            name='rating',
+            field=models.FloatField(default=0.0),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='rating_sum',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='seller',
+            name='reviews_count',
+            field=models.IntegerField(default=0),
+        ),
+    ]
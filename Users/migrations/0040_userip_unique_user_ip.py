@@ -0,0 +1,29 @@
+# Generated by Django 5.1.2 on 2026-10-18 10:31
+
+from django.db import migrations, models
+from django.db.models import Min
+
+
+def delete_duplicate_user_ips(apps, schema_editor):
+    UserIP = apps.get_model("Users", "UserIP")
+    keep_ids = UserIP.objects.values("user_id", "address").annotate(keep_id=Min("id")).values_list("keep_id", flat=True)
+    UserIP.objects.exclude(id__in=list(keep_ids)).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Users', '0039_seller_rating_seller_rating_sum_seller_reviews_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicate_user_ips, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='userip',
+            index=models.Index(fields=['address'], name='Users_useri_address_6b6813_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='userip',
+            constraint=models.UniqueConstraint(fields=('user', 'address'), name='unique_user_ip'),
+        ),
+    ]
@@ -102,6 +102,17 @@ class UserIP(models.Model):
     address = models.GenericIPAddressField()
     user = models.ForeignKey("User", models.CASCADE)
 
+    # Redis-множество "user_id|address", которое периодически сбрасывается в таблицу
+    PENDING_KEY = "user_ip:pending"
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["user", "address"], name="unique_user_ip")
+        ]
+        indexes = [
+            models.Index(fields=["address"])
+        ]
+
 
 class TgUser(models.Model):
     user = models.ForeignKey("User", models.CASCADE)
@@ -114,6 +125,9 @@ class Seller(models.Model):
     user = models.OneToOneField("User", on_delete=models.CASCADE)
     is_verified = models.BooleanField(default=False)
     balance = models.FloatField(default=0)
+    reviews_count = models.IntegerField(default=0)
+    rating_sum = models.IntegerField(default=0)
+    rating = models.FloatField(default=0.0)
 
     class Meta:
         db_table = 'sellers'
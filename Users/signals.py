@@ -0,0 +1,23 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from Users.models import User, Token
+from Users.token_cache import invalidate_tokens
+
+
+@receiver(post_init, sender=User)
+def remember_user_role(sender, instance, **kwargs):
+    instance._cached_role = instance.__dict__.get("role")
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, created, **kwargs):
+    if created or instance._cached_role == instance.role:
+        return
+    instance._cached_role = instance.role
+    invalidate_tokens(Token.objects.filter(user_id=instance.pk).values_list("token", flat=True))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    invalidate_tokens([instance.token])
@@ -0,0 +1,32 @@
+from Main.celery import app
+from Users.models import User, UserIP
+from Users.utils import get_redis
+
+FLUSH_BATCH_SIZE = 1000
+
+
+@app.task(name='flush_user_ips', bind=True)
+def flush_user_ips(*args, **kwargs):
+    """
+    Пакетная запись накопленных IP пользователей, существующие пары пропускаются (ON CONFLICT DO NOTHING)
+    """
+    redis_client = get_redis()
+    total = 0
+    while True:
+        sightings = redis_client.spop(UserIP.PENDING_KEY, FLUSH_BATCH_SIZE)
+        if not sightings:
+            return total
+        pairs = []
+        for sighting in sightings:
+            user_id, address = sighting.decode().split("|", 1)
+            pairs.append((int(user_id), address))
+        # Пользователь мог быть удалён после попадания IP в буфер, такие записи отбрасываются
+        user_ids = set(User.objects.filter(pk__in={user_id for user_id, _ in pairs}).values_list("pk", flat=True))
+        user_ips = [UserIP(user_id=user_id, address=address) for user_id, address in pairs if user_id in user_ids]
+        try:
+            UserIP.objects.bulk_create(user_ips, ignore_conflicts=True)
+        except Exception:
+            # Пачка уже извлечена из Redis, возвращаем её, чтобы не потерять при следующем запуске
+            redis_client.sadd(UserIP.PENDING_KEY, *sightings)
+            raise
+        total += len(user_ips)
@@ -1,3 +1,31 @@
+from unittest import mock
+
 from django.test import TestCase
 
-# Create your tests here.
+from Users.models import User, UserIP
+from Users.tasks import flush_user_ips
+
+
+class FlushUserIpsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="user", password="password")
+        self.redis = mock.Mock()
+
+    def flush(self, sightings):
+        self.redis.spop.side_effect = [[sighting.encode() for sighting in sightings], []]
+        with mock.patch("Users.tasks.get_redis", return_value=self.redis):
+            return flush_user_ips.run()
+
+    def test_deleted_users_are_skipped(self):
+        total = self.flush([f"{self.user.pk}|10.0.0.1", f"{self.user.pk}|10.0.0.2", "999999|10.0.0.3"])
+
+        self.assertEqual(total, 2)
+        self.assertEqual(set(UserIP.objects.values_list("address", flat=True)), {"10.0.0.1", "10.0.0.2"})
+
+    def test_failed_batch_is_returned_to_redis(self):
+        sightings = [f"{self.user.pk}|10.0.0.1"]
+        with mock.patch.object(UserIP.objects, "bulk_create", side_effect=RuntimeError("database is down")):
+            with self.assertRaises(RuntimeError):
+                self.flush(sightings)
+
+        self.redis.sadd.assert_called_once_with(UserIP.PENDING_KEY, *[sighting.encode() for sighting in sightings])
@@ -0,0 +1,73 @@
+import datetime
+import threading
+import time
+
+from django.core.cache import cache
+
+from inshop.settings import logger
+
+# Локальный кэш процесса живёт коротко, так как инвалидация доходит только до Redis
+LOCAL_SECONDS = 5
+LOCAL_MAX_SIZE = 10000
+REDIS_SECONDS = 300
+
+local_tokens = {}
+local_lock = threading.Lock()
+
+
+def get_token_key(token):
+    return f"auth_token:{token}"
+
+
+def get_cached_token(token):
+    """
+    Данные токена {user_id, role, expiration_date} из локального кэша или Redis
+    """
+    now = time.monotonic()
+    local_entry = local_tokens.get(token)
+    if local_entry and local_entry[1] > now:
+        entry = local_entry[0]
+    else:
+        try:
+            entry = cache.get(get_token_key(token))
+        except Exception as e:
+            logger.error(f"Token cache is unavailable: {e}")
+            return None
+        if not entry:
+            return None
+        set_local_token(token, entry)
+    if entry["expiration_date"] < datetime.date.today().toordinal():
+        return None
+    return entry
+
+
+def set_local_token(token, entry):
+    with local_lock:
+        if len(local_tokens) >= LOCAL_MAX_SIZE:
+            local_tokens.clear()
+        local_tokens[token] = (entry, time.monotonic() + LOCAL_SECONDS)
+
+
+def set_cached_token(token, user, expiration_date):
+    entry = {"user_id": user.pk, "role": user.role, "expiration_date": expiration_date.toordinal()}
+    seconds_left = (datetime.datetime.combine(expiration_date + datetime.timedelta(days=1), datetime.time()) -
+                    datetime.datetime.now()).total_seconds()
+    try:
+        cache.set(get_token_key(token), entry, max(1, min(REDIS_SECONDS, int(seconds_left))))
+    except Exception as e:
+        logger.error(f"Token cache is unavailable: {e}")
+    set_local_token(token, entry)
+
+
+def invalidate_tokens(tokens):
+    """
+    Удаление токенов из кэша, вызывается при выходе, бане и смене роли
+    """
+    tokens = [str(token) for token in tokens]
+    with local_lock:
+        for token in tokens:
+            local_tokens.pop(token, None)
+    try:
+        cache.delete_many([get_token_key(token) for token in tokens])
+    except Exception as e:
+        logger.error(f"Token cache is unavailable: {e}")
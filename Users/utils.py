@@ -1,10 +1,13 @@
 import datetime
 import os
+import time
 from random import randint
-from uuid import uuid4
+from uuid import uuid4, UUID
 
+import redis
+from django.conf import settings
 from django.contrib.auth.hashers import check_password, make_password
-from django.db.models import Q
+from django.utils.functional import SimpleLazyObject
 
 from django.template.loader import render_to_string
 from django.core.mail import send_mail
@@ -15,16 +18,39 @@ from rest_framework.response import Response
 from rest_framework.authentication import BaseAuthentication
 from rest_framework.exceptions import AuthenticationFailed, PermissionDenied
 
+from Main.models import SellerLedgerDay
 from Users.models import User, ConfirmRequest, Token, UserIP
-from inshop.settings import EMAIL_HOST_USER
+from Users.token_cache import get_cached_token, set_cached_token
+from inshop.settings import EMAIL_HOST_USER, logger
+
+USER_IP_SEEN_SECONDS = 60 * 60 * 24
+USER_IP_SEEN_MAX_SIZE = 10000
+
+seen_user_ips = {}
+redis_client = None
 
 
 def validate_permissions(token, refresh_token, role="admin"):
     """
     Функция проверки прав пользователя по токену
     """
+    return authenticate_token(token, refresh_token, role)[0]
+
+
+def authenticate_token(token, refresh_token, role="admin"):
+    """
+    Проверка токена и роли, возвращает (user, user_id).
+    При попадании в кэш токенов пользователь загружается из БД лениво, при первом обращении.
+    """
     try:
-        token = Token.objects.get(token=token)
+        token_key = str(UUID(str(token)))
+        cached_token = get_cached_token(token_key)
+        if cached_token:
+            user_id = cached_token["user_id"]
+            user = SimpleLazyObject(lambda: User.objects.get(id=user_id))
+            check_role(cached_token["role"], role)
+            return user, user_id
+        token = Token.objects.select_related("user").get(token=token_key)
         if token.expiration_date < datetime.date.today():
             refresh_token = Token.objects.get(token=refresh_token)
             if refresh_token.expiration_date < datetime.date.today():
@@ -34,16 +60,24 @@ def validate_permissions(token, refresh_token, role="admin"):
             token.save()
             refresh_token.save()
         user = token.user
+        set_cached_token(token_key, user, token.expiration_date)
+    except PermissionDenied:
+        raise
     except:
         raise AuthenticationFailed(code=401, detail={"message": "Невалидный токен!"})
-    roles = [role[0] for role in user.RoleChoices.choices]
+    check_role(user.role, role)
+    return user, user.pk
+
+
+def check_role(user_role, role):
+    roles = [role[0] for role in User.RoleChoices.choices]
     access = False
-    for i in range(roles.index(user.role)+1):
+    for i in range(roles.index(user_role)+1):
         if roles[i] == role.lower():
             access = True
     if not access:
         raise PermissionDenied(detail={"message": "There are not enough permissions to perform this action!"})
-    return user
+
 
 def send_code(user, action="Подтвердите почту",
               action2="подтверждния почты",
@@ -73,10 +107,8 @@ def base_authenticate(request, role, raise_exception=True):
     token = request.COOKIES.get("token")
     refresh_token = request.COOKIES.get("refresh_token")
     try:
-        user = validate_permissions(token, refresh_token, role)
-        ip_address = get_client_ip(request)
-        if not UserIP.objects.filter(user=user, address=ip_address).exists():
-            UserIP(user=user, address=ip_address).save()
+        user, user_id = authenticate_token(token, refresh_token, role)
+        record_user_ip(user_id, get_client_ip(request))
     except Exception as e:
         if raise_exception:
             raise e
@@ -160,14 +192,11 @@ def get_user(request):
     return user, response
 
 
-def get_seller_stat(transactions, seller):
-    total_amount = round(sum([float(transaction.amount)-float(transaction.amount)*transaction.product.get_commission()
-                        for transaction in transactions.filter(~Q(buyer=seller.user))]), 2)
-    withdrawn_amount = round(sum([float(transaction.amount) for transaction in
-                            transactions.filter(buyer=seller.user, seller=seller)]), 2)
-    hold_amount = round(sum([float(transaction.amount)-float(transaction.amount)*transaction.product.get_commission()
-                       for transaction in
-                       transactions.filter(created_at=datetime.datetime.now() - datetime.timedelta(days=3))]), 2)
+def get_seller_stat(seller):
+    stat = SellerLedgerDay.get_seller_stat(seller)
+    total_amount = round(stat["sales_amount"], 2)
+    withdrawn_amount = round(stat["withdrawn_amount"], 2)
+    hold_amount = round(stat["hold_amount"], 2)
     credited_amount = round(float(total_amount) - float(hold_amount), 2)
     available_amount = round(float(credited_amount) - float(withdrawn_amount), 2)
     return {
@@ -176,7 +205,7 @@ def get_seller_stat(transactions, seller):
             "withdrawn_amount": withdrawn_amount,
             "hold_amount": hold_amount,
             "total_amount": total_amount,
-            "total_sales": transactions.exclude(buyer=seller.user).count()
+            "total_sales": stat["sales_count"]
         }
 
 
@@ -189,6 +218,30 @@ def get_client_ip(request):
     return ip
 
 
+def get_redis():
+    global redis_client
+    if redis_client is None:
+        redis_client = redis.Redis.from_url(settings.CACHES["default"]["LOCATION"])
+    return redis_client
+
+
+def record_user_ip(user_id, ip_address):
+    """
+    IP пользователя добавляется в буфер Redis, в таблицу он попадает пакетно задачей flush_user_ips.
+    Повторная отправка той же пары из процесса подавляется на сутки.
+    """
+    key = (user_id, ip_address)
+    if seen_user_ips.get(key, 0) > time.monotonic():
+        return
+    if len(seen_user_ips) >= USER_IP_SEEN_MAX_SIZE:
+        seen_user_ips.clear()
+    seen_user_ips[key] = time.monotonic() + USER_IP_SEEN_SECONDS
+    try:
+        get_redis().sadd(UserIP.PENDING_KEY, f"{user_id}|{ip_address}")
+    except Exception as e:
+        logger.error(f"User IP buffer is unavailable: {e}")
+
+
 def on_start():
     set_root_admin()
 
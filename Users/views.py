@@ -13,7 +13,7 @@ from uuid import uuid4
 from django.apps import apps
 
 from django.contrib.auth.hashers import check_password, make_password
-from django.db import IntegrityError, models
+from django.db import IntegrityError, models, transaction
 from django.db.models import Q
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_protect
@@ -29,11 +29,12 @@ from rest_framework.viewsets import GenericViewSet
 
 from drf_spectacular.utils import extend_schema, OpenApiParameter, inline_serializer, OpenApiResponse
 from Main.models import BalanceTopUp, File, Purchase, Tag, PaymentType, TransactionStatus, \
-    Invoice, ReferralTransaction, Product, Review, AdminAction
+    Invoice, ReferralTransaction, ReferralBalance, Product, Review, AdminAction
 from Main.serializers import PhotoUploadSerializer, CategorySerializer
 from Users.utils import send_code, TempUserAuthentication, SellerAuthentication, get_seller_stat, base_authenticate, \
     get_client_ip, UserNonRequiredAuthentication
 
+from Proxy.http_client import get_http_stats
 from Proxy.providers import gift_proxy_plan
 from Main.utils import check_captcha, get_object_or_404, upload_file_to_s3, FieldsTypeSerializer, ResponseLocale, \
     stripe_create_invoice
@@ -65,12 +66,7 @@ class UserViewSet(GenericViewSet):
         user_data = user.get_profile()
         if user.role == User.RoleChoices.seller:
             seller = get_object_or_404(Seller, user=user)
-            seller_reviews = Review.objects.filter(
-                product__seller=seller
-            )
-            user_data["seller_info"].update(dict(seller_rating=sum(
-                [review.rating for review in seller_reviews]
-            )/seller_reviews.count() if seller_reviews.count() else 0.0,
+            user_data["seller_info"].update(dict(seller_rating=seller.rating,
                                                  total_sales=Purchase.objects.filter(
                                                     seller=seller,
                                                     status=TransactionStatus.paid
@@ -134,7 +130,7 @@ class UserViewSet(GenericViewSet):
         """
         check_captcha(request.data.get("captcha"))
         ip_address = get_client_ip(request)
-        if UserIP.objects.filter(address=ip_address).count() >= 3:
+        if UserIP.objects.filter(address=ip_address)[:3].count() >= 3:
             return ResponseLocale(user=request.user, status=400, data={"message": "Too many accounts on the same ip!"})
         referral_link = request.data.get("referral_link")
         if referral_link:
@@ -514,26 +510,13 @@ class UserViewSet(GenericViewSet):
     @action(methods=["GET"], detail=False, url_path="get-referral-balance",
             authentication_classes=[TempUserAuthentication])
     def get_referral_balance(self, request: Request):
-        referral_transactions = ReferralTransaction.objects.filter(
-            to_user=request.user,
-            type=ReferralTransaction.Types.accrual
-        )
-        hold_transactions = referral_transactions.filter(created_at__gte=datetime.datetime.now()-timedelta(days=3))
-        total_amount = round(sum([transaction.amount for transaction in referral_transactions]), 2)
-        hold_amount = round(sum([transaction.amount for transaction in hold_transactions]), 2)
-        credited_amount = round(total_amount-hold_amount, 2)
-        withdraw_transactions = ReferralTransaction.objects.filter(
-            to_user=request.user,
-            type=ReferralTransaction.Types.withdraw
-        )
-        withdraw_amount = round(sum([transaction.amount for transaction in withdraw_transactions]), 2)
-        available_amount = round(credited_amount-withdraw_amount, 2)
+        referral_balance = ReferralBalance.objects.filter(user=request.user).first() or ReferralBalance()
         data = {
-            "total": total_amount,
-            "hold": hold_amount,
-            "credited": credited_amount,
-            "available": available_amount,
-            "total_users": len(set([transaction.from_user for transaction in referral_transactions])),
+            "total": round(referral_balance.accrued, 2),
+            "hold": round(referral_balance.held, 2),
+            "credited": referral_balance.credited,
+            "available": referral_balance.available,
+            "total_users": referral_balance.total_users,
         }
         return ResponseLocale(user=request.user, status=200, data=data)
 
@@ -551,9 +534,9 @@ class UserViewSet(GenericViewSet):
         limit = request.query_params.get("limit")
         filters = Q()
         if status == "accrued":
-            filters &= Q(created_at__lte=datetime.datetime.now()-timedelta(days=3))
+            filters &= Q(is_credited=True)
         if status == "process":
-            filters &= Q(created_at__gte=datetime.datetime.now()-timedelta(days=3))
+            filters &= Q(is_credited=False)
         referral_transactions = ReferralTransaction.objects.filter(
             filters, to_user=request.user, type=ReferralTransaction.Types.accrual
         )
@@ -580,8 +563,7 @@ class UserViewSet(GenericViewSet):
                             name=transaction.seller.user.username),
                 created_dt=referral_transaction.created_at,
                 referral_amount=referral_transaction.amount,
-                status="accrued" if (referral_transaction.created_at+timedelta(days=3)).timestamp() <=
-                                    datetime.datetime.now().timestamp() else "process")
+                status="accrued" if referral_transaction.is_credited else "process")
             data.append(transaction_data)
         return ResponseLocale(user=request.user, status=200, data={
             "transactions": data,
@@ -615,7 +597,7 @@ class UserViewSet(GenericViewSet):
         if request.user.role != User.RoleChoices.seller:
             return ResponseLocale(user=request.user, status=403, data={"message": "No"})
         seller = get_object_or_404(Seller, user_id=request.user.pk)
-        seller_stat = get_seller_stat(Purchase.objects.filter(seller=seller), seller)
+        seller_stat = get_seller_stat(seller)
         if seller_stat.get("available_amount") < amount:
             return ResponseLocale(user=request.user, status=400, data={"message": "Insufficient funds!"})
         transfer = Purchase(seller=seller, buyer=seller.user,
@@ -629,29 +611,19 @@ class UserViewSet(GenericViewSet):
     @staticmethod
     def _transfer_referral_balance(request: Request):
         withdraw_amount = request.data.get("amount")
-        accrual_transactions = ReferralTransaction.objects.filter(
-            to_user=request.user,
-            created_at__lte=datetime.datetime.now()-timedelta(days=3),
-            type=ReferralTransaction.Types.accrual
-        )
-        withdraw_transactions = ReferralTransaction.objects.filter(
-            to_user=request.user,
-            type=ReferralTransaction.Types.withdraw
-        )
-        accrual_amount = round(sum([transaction.amount for transaction in accrual_transactions]), 2)
-        withdrawn_amount = round(sum([transaction.amount for transaction in withdraw_transactions]), 2)
-        referral_balance = round(accrual_amount - withdrawn_amount, 2)
-        if referral_balance < withdraw_amount:
-            return ResponseLocale(user=request.user, status=400, data={"message": "Insufficient funds!"})
-        withdraw_transaction = ReferralTransaction(
-            amount=withdraw_amount,
-            from_user=request.user,
-            to_user=request.user,
-            type=ReferralTransaction.Types.withdraw
-        )
-        withdraw_transaction.save()
-        request.user.balance += withdraw_amount
-        request.user.save()
+        with transaction.atomic():
+            referral_balance = ReferralBalance.get_locked(request.user.pk)
+            if referral_balance.available < withdraw_amount:
+                return ResponseLocale(user=request.user, status=400, data={"message": "Insufficient funds!"})
+            withdraw_transaction = ReferralTransaction(
+                amount=withdraw_amount,
+                from_user=request.user,
+                to_user=request.user,
+                type=ReferralTransaction.Types.withdraw
+            )
+            withdraw_transaction.save()
+            request.user.balance += withdraw_amount
+            request.user.save()
         return ResponseLocale(user=request.user, status=200, data={"message": "Money accrued to balance"})
 
     @action(methods=["POST"], detail=False, url_path="link-tg",
@@ -762,13 +734,11 @@ class SellerViewSet(GenericViewSet):
             seller = get_object_or_404(Seller, user=request.user)
         except:
             return ResponseLocale(user=request.user, status=403, data={"message": "You are not a seller!"})
-        transactions = Purchase.objects.filter(status=TransactionStatus.paid, seller=seller)
-        seller_stat = get_seller_stat(transactions, seller)
+        seller_stat = get_seller_stat(seller)
         return ResponseLocale(user=request.user, status=200, data=seller_stat)
 
     @staticmethod
     def _get_product_data(product, product_type=None):
-        reviews = Review.objects.filter(product=product)
         product_data = dict(
             id=product.id,
             title=product.title,
@@ -781,7 +751,7 @@ class SellerViewSet(GenericViewSet):
             description=product.description,
             short_description=product.short_description,
             tags=[tag.to_dict() for tag in product.tags.all()],
-            rating=sum([review.rating for review in reviews])/reviews.count() if reviews else 0.0,
+            rating=product.rating,
             category=dict(id=product.categories.last().pk,
                           title=product.categories.last().name)
         )
@@ -979,6 +949,10 @@ class AdminViewSet(GenericViewSet):
         }
         return ResponseLocale(user=request.user, status=200, data=apps_models)
 
+    @action(methods=["GET"], detail=False, url_path="get-provider-stats")
+    def get_provider_stats(self, request: Request):
+        return ResponseLocale(user=request.user, status=200, data=get_http_stats())
+
     @extend_schema(parameters=[inline_serializer("GetModelFields", fields={
         "model": serializers.CharField(),
         "category": serializers.CharField()
@@ -160,6 +160,13 @@ CELERY_BEAT_SCHEDULER = 'django_celery_beat.schedulers.DatabaseScheduler'
 CELERY_RESULT_BACKEND = CELERY_BROKER_URL
 CELERY_BROKER_CONNECTION_RETRY_ON_STARTUP = True
 
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": env.str("CACHE_REDIS_URL", CELERY_BROKER_URL),
+    }
+}
+
 
 S3_API_KEY = env.str("S3_API_KEY")
 S3_SECRET_KEY = env.str("S3_SECRET_KEY")
@@ -175,6 +182,9 @@ PRODUCTS_COMMISSIONS = json.load(open("static/commissions.json"))
 TG_BOT_TOKEN = env.str("TG_BOT_TOKEN")
 TG_SECRET_KEY = env.str("LINK_TG_BOT_SECRET_KEY")
 BOT_USERNAME = env.str("BOT_USERNAME")
+# Уведомления о платёжных событиях, без токена и чата не отправляются
+PAYMENT_EVENTS_TG_BOT_TOKEN = env.str("PAYMENT_EVENTS_TG_BOT_TOKEN", "")
+PAYMENT_EVENTS_TG_CHAT_ID = env.str("PAYMENT_EVENTS_TG_CHAT_ID", "")
 
 
 GEETEST_CAPTCHA_KEY = env.str("GEETEST_CAPTCHA_KEY")
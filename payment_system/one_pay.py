@@ -9,7 +9,9 @@ import time
 from config import credentials
 from dotenv import load_dotenv
 from utils import logger
+from utils.db.base import close_pools
 from utils.db.db_logger import TransferLogger
+from utils.db.webhook_outbox import WebhookOutbox
 
 from providers.okx_wallet import OkxWallet
 
@@ -36,11 +38,14 @@ class Web3Scan:
         }
         network_name = tx_data["network"]
 
-        transfer_logger = TransferLogger(self.db_path, network_name)
+        outbox = WebhookOutbox(self.db_path)
+        await outbox.start()
+        transfer_logger = TransferLogger(self.db_path, network_name, outbox)
         await transfer_logger.start()
         logger.info(f"ADDING {tx_data}")
         await transfer_logger.log_transfer(tx_data)
-        await transfer_logger.stop()
+        await outbox.drain()
+        await close_pools()
 
 
 async def main(amount: float):
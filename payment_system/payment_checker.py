@@ -1,16 +1,42 @@
 import logging
 
-import psycopg2
-from django.conf import settings
+from token_registry import registry
 
 logger = logging.getLogger(__name__)
 import os
+import threading
+from contextlib import contextmanager
 from decimal import Decimal, getcontext
 
 from dotenv import load_dotenv
+from psycopg2.pool import ThreadedConnectionPool
 
 load_dotenv()
 
+POOL_MAXSIZE = 10
+
+pool = None
+pool_lock = threading.Lock()
+# Число знаков токена не меняется, читается из таблицы один раз на сеть и токен
+token_decimals = {}
+
+
+@contextmanager
+def get_connection():
+    global pool
+    if pool is None:
+        with pool_lock:
+            if pool is None:
+                pool = ThreadedConnectionPool(1, POOL_MAXSIZE, os.getenv("DB_TRANSFERS_ROUTE"))
+    conn = pool.getconn()
+    try:
+        yield conn
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+
 
 class BaseDB:
     def __init__(self, db_name: str, network: str):
@@ -26,7 +52,7 @@ class BaseDB:
 class Payment(BaseDB):
     def __init__(self, db_name: str, network: str):
         super().__init__(db_name, network)
-        self.credentials = settings.CREDENTIALS
+        self.credentials = registry.entries
 
     def full_decimal(self, amount: float, decimal: int):
         getcontext().prec = 21  # maximum of precision number
@@ -38,13 +64,10 @@ class Payment(BaseDB):
         return int(result)
 
     def get_token_info(self, network: str, ticker: str):
-        for entry in self.credentials:
-            if entry["ticker"].lower() == ticker.lower():
-                for address_info in entry["networks"]:
-                    if network.lower() == address_info["network"].lower():
-                        return "", address_info["token_address"]
-
-        raise Exception("Token not found! Check config.py")
+        token = registry.get(ticker, network)
+        if not token:
+            raise Exception("Token not found! Check static/crypto.json")
+        return "", token.token_address
 
     def get_token_pay_address(self, network: str, ticker: str):
         if not ticker:
@@ -53,11 +76,8 @@ class Payment(BaseDB):
         if not network:
             raise ValueError("Network cannot be None or empty.")
 
-        for entry in self.credentials:
-            if entry["ticker"].lower() == ticker.lower():
-                for address_info in entry["networks"]:
-                    if network.lower() == address_info["network"].lower():
-                        return address_info["to_address"][0]
+        if token := registry.get(ticker, network):
+            return token.to_address
 
         error_message = f"Payment address not found for ticker '{ticker}' on network '{network}'."
         logger.error(error_message)
@@ -68,7 +88,7 @@ class Payment(BaseDB):
         result = []
         for entry in self.credentials:
             currency = {"ticker": entry["ticker"], "networks": []}
-            for address_info in entry["networks"]:
+            for address_info in entry["providers"]:
                 currency["networks"].append(
                     {"address": address_info["to_address"][0], "network": address_info["network"]}
                 )
@@ -76,17 +96,18 @@ class Payment(BaseDB):
 
         return result
 
-    def change_status(self, cursor, row, db):
-        cursor.execute(
-            f"""
-                UPDATE {self.table_name}
-                SET is_used = TRUE
-                WHERE tx_hash = %s
-            """,
-            (row[0],),
-        )
-        logger.info("status changing to used (transfers)")
-        db.commit()
+    def get_token_decimal(self, cursor, token_address: str):
+        key = (self.table_name, token_address)
+        if key not in token_decimals:
+            cursor.execute(
+                f"SELECT decimal FROM {self.table_name} WHERE token_address = %s LIMIT 1",
+                (token_address,),
+            )
+            row = cursor.fetchone()
+            if not row:
+                return None
+            token_decimals[key] = row[0]
+        return token_decimals[key]
 
     def check(self, amount: float, ticker: str, date_created=None, range_allowed=False):
         _, token_address = self.get_token_info(self.table_name, ticker)
@@ -94,32 +115,37 @@ class Payment(BaseDB):
             f"PAYMENT.CHECKER, =========== {amount}, {ticker}"
             f" token_address={token_address} timestamp={date_created}"
         )
-        with psycopg2.connect(os.getenv("DB_TRANSFERS_ROUTE")) as db:
-            # logger.info(f"CURSOR BEFORE EXECUTING range_allowed {range_allowed}")
+        with get_connection() as db:
             cursor = db.cursor()
+            decimal_value = self.get_token_decimal(cursor, token_address)
+            if decimal_value is None:
+                return False
+            if range_allowed:
+                amount_from = self.full_decimal(amount * 0.98, decimal_value)
+                amount_to = self.full_decimal(amount * 1.03, decimal_value)
+            else:
+                amount_from = amount_to = self.full_decimal(amount, decimal_value)
+            # Поиск и пометка перевода одним запросом по индексу (token_address, is_used, amount_units, timestamp)
             cursor.execute(
                 f"""
-                    SELECT tx_hash, decimal, amount
-                    FROM {self.table_name}
-                    WHERE token_address = %s  AND is_used = FALSE AND timestamp >= %s
+                    UPDATE {self.table_name}
+                    SET is_used = TRUE
+                    WHERE tx_hash = (
+                        SELECT tx_hash
+                        FROM {self.table_name}
+                        WHERE token_address = %s AND is_used = FALSE
+                          AND amount_units BETWEEN %s AND %s AND timestamp >= %s
+                        ORDER BY timestamp
+                        LIMIT 1
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING tx_hash, amount_units
                 """,
-                (token_address, date_created),
+                (token_address, amount_from, amount_to, date_created),
             )
-            rows = cursor.fetchall()
-            for row in rows:
-                tx_hash, decimal_value, amount_query = row
-                if range_allowed:
-                    if (
-                        self.full_decimal(amount * 0.98, decimal_value)
-                        <= amount_query
-                        <= self.full_decimal(amount * 1.03, decimal_value)
-                    ):
-                        self.change_status(cursor, row, db)
-                        return True
-                else:
-                    if amount_query == self.full_decimal(amount, decimal_value):
-                        self.change_status(cursor, row, db)
-                        logger.info(f"true, {amount_query} == {self.full_decimal(amount, decimal_value)}")
-                        return True
-
+            row = cursor.fetchone()
+            db.commit()
+        if row:
+            logger.info(f"status changing to used (transfers) {row[0]}, {row[1]}")
+            return True
         return False
@@ -1,48 +1,52 @@
 import asyncio
+import os
 import time
 
-from config import get_wallets_and_contracts_by_network
 from tenacity import retry, stop_after_attempt, wait_fixed
+from token_registry import registry
 from utils import logger
 
 from .models.base_scan import Scan
 
+DEFAULT_ACCOUNT_ID = "D6733685-0666-4F78-B1E3-02DD6A24B5FC"
+PAGE_SIZE = 20
 
-class OkxWallet(Scan):
-    tokens_ids = {
-        "USDT": {
-            "BSC": 5004,
-            "TRX": 813,
-            "OPTIMISM": 10005,
-            "ARBITRUM": 9001,
-            "POLYGON": 6201,
-            "AVAXC": 7003,
-            "ETHEREUM": 818,
-            # "APTOS": 351628,
-            "SOLANA": 2647,
-            "TON": 28003,
-        }
-    }
 
+class OkxWallet(Scan):
     def __init__(self):
         super().__init__()
+        self.account_ids = os.getenv("OKX_ACCOUNT_IDS", DEFAULT_ACCOUNT_ID).split(",")
 
-    async def get_last_txs(self, last_block: int = 0):
-        res_json = await self.get_wallet_history(last_block)
-        print(res_json)
+    async def get_last_txs(self, last_block: int = 0, account_id: str = DEFAULT_ACCOUNT_ID):
+        """
+        Переводы аккаунта начиная с last_block, страницами от новых к старым до полного догона.
+        Страницы листаются курсором lastRowId в окне [last_block, время первого запроса].
+        last_block в ответе - время самой новой операции или None, pages - число прочитанных страниц
+        """
         formatted_txs = []
         network = None
-        if txs := res_json.get("data", {}).get("content", []):
+        newest = None
+        pages = 0
+        end_date = time.time() * 10**3
+        last_row_id = ""
+        while True:
+            pages += 1
+            res_json = await self.get_wallet_history(last_block, end_date=end_date, account_id=account_id,
+                                                     last_row_id=last_row_id)
+            data = res_json.get("data", {}) or {}
+            txs = data.get("content", []) or []
             for tx in txs:
+                tx_time = int(tx["txTime"])
+                newest = tx_time if newest is None else max(newest, tx_time)
                 asset_change = tx["assetChange"][0]
-                if network := get_key_by_value(OkxWallet.tokens_ids, asset_change["coinId"]):
-                    wallet, token_address = get_wallets_and_contracts_by_network("USDT", network)
+                if token := registry.get_by_okx_coin_id(asset_change["coinId"]):
+                    network = token.network
                     if asset_change["direction"] == 1:  # if == 1 then deposit
-                        if tx["address"].lower() == wallet.lower():
+                        if tx["address"].lower() == token.to_address.lower():
                             formatted_txs.append(
                                 {
                                     "tx_hash": tx["txhash"],
-                                    "token_address": token_address,
+                                    "token_address": token.token_address,
                                     "amount": asset_change["coinAmount"],
                                     "to_address": tx["to"],
                                     "from_address": tx["from"],
@@ -52,9 +56,15 @@ class OkxWallet(Scan):
                                     "network": network,
                                 }
                             )
-            if formatted_txs:
-                last_block = formatted_txs[0]["timestamp"]
-        return {"txs": formatted_txs, "network": network, "last_block": last_block}
+            if len(txs) < PAGE_SIZE:
+                break
+            # Курсор, а не время: операций с одинаковым txTime может быть больше страницы
+            next_row_id = data.get("lastRowId")
+            if not next_row_id or next_row_id == last_row_id:
+                logger.error(f"{account_id} | OKX history page without a new lastRowId, paging stopped")
+                break
+            last_row_id = next_row_id
+        return {"txs": formatted_txs, "network": network, "last_block": newest, "pages": pages}
 
     @retry(
         stop=stop_after_attempt(7),
@@ -62,17 +72,18 @@ class OkxWallet(Scan):
         before_sleep=lambda retry_state, **kwargs: logger.info(f"Retrying... {retry_state.outcome.exception()}"),
         reraise=True,
     )
-    async def get_wallet_history(self, last_block: int = 0, limit: int = 5):
+    async def get_wallet_history(self, last_block: int = 0, limit: int = PAGE_SIZE, end_date: float = None,
+                                 account_id: str = DEFAULT_ACCOUNT_ID, last_row_id: str = ""):
         url = "https://wallet.okex.org/priapi/v1/wallet/tx/order/list"  # wallet.okx.com # old
 
         json_data = {
-            "lastRowId": "",
+            "lastRowId": last_row_id,
             "limit": limit,
             "accountIds": [
-                "D6733685-0666-4F78-B1E3-02DD6A24B5FC",
+                account_id,
             ],
             "startDate": last_block,
-            "endDate": time.time() * 10**3,
+            "endDate": end_date or time.time() * 10**3,
             "mainCoinId": "",
             "status": [
                 1,
@@ -86,11 +97,3 @@ class OkxWallet(Scan):
         response = await self._client.post(url, json=json_data)
 
         return response.json()
-
-
-def get_key_by_value(tokens_ids, value):
-    for token, networks in tokens_ids.items():
-        for network, id_ in networks.items():
-            if id_ == value:
-                return network
-    return None
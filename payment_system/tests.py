@@ -0,0 +1,19 @@
+import unittest
+
+from payment_system.token_registry import to_base_units
+
+
+class ToBaseUnitsTestCase(unittest.TestCase):
+    def test_fractional_amount(self):
+        self.assertEqual(to_base_units("10.503", 6), 10503000)
+        self.assertEqual(to_base_units("10.503", 18), 10503 * 10 ** 15)
+
+    def test_invoice_amounts_stay_distinct(self):
+        self.assertNotEqual(to_base_units("10.503", 6), to_base_units("10.504", 6))
+
+    def test_matches_payment_checker_scaling(self):
+        self.assertEqual(to_base_units(0.1, 18), 10 ** 17)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import json
+import os
+from decimal import Decimal
+from types import MappingProxyType
+from typing import NamedTuple, Optional
+
+# Общий справочник токенов для сайта и сканера платежей, источник - static/crypto.json
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "static", "crypto.json")
+
+
+class TokenInfo(NamedTuple):
+    ticker: str
+    network: str
+    token_address: str
+    to_addresses: tuple
+    okx_coin_id: Optional[int]
+
+    @property
+    def to_address(self):
+        return self.to_addresses[0]
+
+
+class TokenRegistry:
+    """
+    Неизменяемые индексы по (тикер, сеть), id монеты OKX и адресу контракта, строятся один раз при импорте
+    """
+    def __init__(self, entries):
+        self.entries = tuple(entries)
+        by_pair = {}
+        by_okx_coin_id = {}
+        by_token_address = {}
+        for entry in self.entries:
+            ticker = entry["ticker"].upper()
+            for provider in entry["providers"]:
+                token = TokenInfo(
+                    ticker=ticker,
+                    network=provider["network"].upper(),
+                    token_address=provider["token_address"],
+                    to_addresses=tuple(provider["to_address"]),
+                    okx_coin_id=provider.get("okx_coin_id")
+                )
+                by_pair[(token.ticker, token.network)] = token
+                by_token_address[token.token_address.lower()] = token
+                if token.okx_coin_id is not None:
+                    by_okx_coin_id[token.okx_coin_id] = token
+        self.by_pair = MappingProxyType(by_pair)
+        self.by_okx_coin_id = MappingProxyType(by_okx_coin_id)
+        self.by_token_address = MappingProxyType(by_token_address)
+        self.tickers = tuple(sorted({ticker for ticker, _ in by_pair}))
+
+    def get(self, ticker: str, network: str):
+        if not ticker or not network:
+            return None
+        return self.by_pair.get((ticker, network)) or self.by_pair.get((ticker.upper(), network.upper()))
+
+    def get_by_okx_coin_id(self, coin_id):
+        return self.by_okx_coin_id.get(coin_id)
+
+    def get_by_token_address(self, token_address: str):
+        return self.by_token_address.get(token_address.lower())
+
+
+def to_base_units(amount, decimal: int):
+    """
+    Сумма в целых базовых единицах токена, как full_decimal в payment_checker.
+    amount - сумма в единицах монеты, у OKX десятичная строка, например "10.503"
+    """
+    return int(Decimal(str(amount)).scaleb(int(decimal)))
+
+
+def load_registry(path=CONFIG_PATH):
+    with open(path, "r") as file:
+        return TokenRegistry(json.load(file))
+
+
+registry = load_registry()
@@ -1,9 +1,71 @@
-class BaseDB:
+import asyncio
+import time
+from abc import ABC, abstractmethod
+
+import asyncpg
+
+POOL_MAX_SIZE = 10
+
+pools = {}
+pools_lock = asyncio.Lock()
+# Таблицы, для которых DDL уже выполнен в этом процессе
+prepared_tables = set()
+
+
+async def get_pool(dsn: str):
+    if dsn not in pools:
+        async with pools_lock:
+            if dsn not in pools:
+                pools[dsn] = await asyncpg.create_pool(dsn, min_size=1, max_size=POOL_MAX_SIZE)
+    return pools[dsn]
+
+
+async def close_pools():
+    for pool in pools.values():
+        await pool.close()
+    pools.clear()
+    prepared_tables.clear()
+
+
+async def apply_migration(conn, name: str, *statements: str):
+    """
+    Однократный шаг миграции данных, применённые шаги записываются в schema_migrations.
+    Параллельный процесс ждёт на уникальном ключе и пропускает уже применённый шаг
+    """
+    await conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            name TEXT PRIMARY KEY,
+            applied_at BIGINT NOT NULL
+        )
+    """)
+    async with conn.transaction():
+        applied = await conn.fetchval(
+            "INSERT INTO schema_migrations (name, applied_at) VALUES ($1, $2) ON CONFLICT (name) DO NOTHING RETURNING name",
+            name, int(time.time()),
+        )
+        if not applied:
+            return False
+        for statement in statements:
+            await conn.execute(statement)
+    return True
+
+
+class BaseDB(ABC):
     def __init__(self, db_name: str, network: str):
         self.db_name = db_name
         self.table_name = network
         self.conn = None
 
+    @abstractmethod
+    async def create_table(self):
+        pass
+
+    async def start(self):
+        key = (self.db_name, self.table_name)
+        if key not in prepared_tables:
+            await self.create_table()
+            prepared_tables.add(key)
+
     async def stop(self):
         if self.conn:
             await self.conn.close()
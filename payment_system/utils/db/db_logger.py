@@ -1,28 +1,23 @@
-import base64
-import hashlib
-import json
-import os
+from decimal import Decimal
 
-import asyncpg
 from django.conf import settings
 from django.utils import timezone
 from utils import logger
-from dotenv import load_dotenv
-import requests
-from utils.db.base import BaseDB
+from utils.db.base import BaseDB, get_pool, apply_migration
+from utils.db.webhook_outbox import WebhookOutbox
+from token_registry import to_base_units
 
 settings.configure()
-load_dotenv("../.env")
-SECRET_KEY = os.environ.get("CRYPTO_SECRET_KEY")
 
 
 class TransferLogger(BaseDB):
-    def __init__(self, db_name: str, network: str):
+    def __init__(self, db_name: str, network: str, outbox: WebhookOutbox):
         super().__init__(db_name, network)
+        self.outbox = outbox
 
     async def create_table(self):
-        conn = await asyncpg.connect(self.db_name)
-        try:
+        pool = await get_pool(self.db_name)
+        async with pool.acquire() as conn:
             await conn.execute(f"""
                 CREATE TABLE IF NOT EXISTS {self.table_name} (
                     tx_hash TEXT PRIMARY KEY,
@@ -34,56 +29,73 @@ class TransferLogger(BaseDB):
                     decimal INTEGER NOT NULL,
                     timestamp BIGINT NOT NULL,
                     is_used BOOLEAN NOT NULL,
-                    time_added BIGINT
+                    time_added BIGINT,
+                    amount_units NUMERIC(78, 0)
                 )
             """)
-        finally:
-            await conn.close()
+            # amount хранится во float и теряет точность, сверка платежей идёт по целым базовым единицам токена.
+            # Строки, записанные до появления amount_units или без перевода в базовые единицы, пересчитываются один раз
+            await conn.execute(f"ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS amount_units NUMERIC(78, 0)")
+            await apply_migration(
+                conn, f"{self.table_name}_amount_units_base_units",
+                f"UPDATE {self.table_name} SET amount_units = ROUND(amount::NUMERIC * 10::NUMERIC ^ decimal)"
+            )
+            await conn.execute(f"""
+                CREATE INDEX IF NOT EXISTS {self.table_name}_unused_amount_idx
+                ON {self.table_name} (token_address, is_used, amount_units, timestamp)
+            """)
 
-    async def log_transfer(self, tx_data: dict):
-        timestamp = int(tx_data["timestamp"])
+    async def log_transfers(self, txs: list):
+        """
+        Запись пачки переводов одним INSERT, уже записанные пропускаются.
+        Уведомления по новым переводам ставятся в очередь в той же транзакции
+        """
+        if not txs:
+            return []
         time_added = int(timezone.now().timestamp())
-        conn = await asyncpg.connect(self.db_name)
+        pool = await get_pool(self.db_name)
         try:
-            await conn.execute(
-                f"""
-                    INSERT INTO {self.table_name} (tx_hash, token_address, amount,
-                    to_address, from_address, ticker, decimal, timestamp, is_used, time_added)
-                    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)""",
-                tx_data["tx_hash"],
-                tx_data["token_address"],
-                float(tx_data["amount"]),
-                tx_data["to_address"],
-                tx_data["from_address"],
-                tx_data["ticker"],
-                tx_data["decimal"],
-                timestamp,
-                False,
-                time_added,
-            )
-            print(tx_data["decimal"])
-            data = {
-                "tx_hash": tx_data["tx_hash"],
-                "amount": tx_data["amount"],
-                "ticker": tx_data["ticker"],
-                "network": tx_data["network"],
-                "decimal": tx_data["decimal"]
-            }
-            print(data)
-            json_data = json.dumps(data, ensure_ascii=False, separators=(',', ':')).replace('/', '\\/')
-            hash_string = base64.b64encode(json_data.encode('utf-8')).decode('utf-8') + SECRET_KEY
-            sign = hashlib.md5(hash_string.encode('utf-8')).hexdigest()
-            data["sign"] = sign
-            response = requests.post("https://gemups.com/api/v1/payment/crypto",
-                                     json=data)
-            print(response.text)
+            async with pool.acquire() as conn, conn.transaction():
+                rows = await conn.fetch(
+                    f"""
+                        INSERT INTO {self.table_name} (tx_hash, token_address, amount,
+                        to_address, from_address, ticker, decimal, timestamp, is_used, time_added, amount_units)
+                        SELECT tx_hash, token_address, amount, to_address, from_address, ticker, decimal,
+                        timestamp, FALSE, $10, amount_units
+                        FROM unnest($1::TEXT[], $2::TEXT[], $3::FLOAT8[], $4::TEXT[], $5::TEXT[], $6::TEXT[],
+                        $7::INTEGER[], $8::BIGINT[], $9::NUMERIC[])
+                        AS t(tx_hash, token_address, amount, to_address, from_address, ticker, decimal, timestamp,
+                        amount_units)
+                        ON CONFLICT (tx_hash) DO NOTHING
+                        RETURNING tx_hash""",
+                    [tx_data["tx_hash"] for tx_data in txs],
+                    [tx_data["token_address"] for tx_data in txs],
+                    [float(tx_data["amount"]) for tx_data in txs],
+                    [tx_data["to_address"] for tx_data in txs],
+                    [tx_data["from_address"] for tx_data in txs],
+                    [tx_data["ticker"] for tx_data in txs],
+                    [int(tx_data["decimal"]) for tx_data in txs],
+                    [int(tx_data["timestamp"]) for tx_data in txs],
+                    [Decimal(to_base_units(tx_data["amount"], tx_data["decimal"])) for tx_data in txs],
+                    time_added,
+                )
+                inserted = {row["tx_hash"] for row in rows}
+                new_txs = []
+                for tx_data in txs:
+                    if tx_data["tx_hash"] in inserted:
+                        inserted.discard(tx_data["tx_hash"])
+                        new_txs.append(tx_data)
+                if new_txs:
+                    await self.outbox.enqueue(conn, new_txs)
         except Exception as e:
             logger.error(f"Exception while adding to db {e}")
-        finally:
-            await conn.close()
+            raise
+        if new_txs:
+            self.outbox.wakeup.set()
+        return new_txs
 
-    async def start(self):
-        await self.create_table()
+    async def log_transfer(self, tx_data: dict):
+        return await self.log_transfers([tx_data])
 
 
 # Example usage
@@ -0,0 +1,42 @@
+import time
+
+from utils.db.base import BaseDB, get_pool
+
+
+class ScanCursors(BaseDB):
+    """
+    Позиции сканеров по аккаунтам, чтобы после перезапуска продолжать с места остановки
+    """
+    def __init__(self, db_name: str, table_name: str = "scan_cursors"):
+        super().__init__(db_name, table_name)
+
+    async def create_table(self):
+        pool = await get_pool(self.db_name)
+        async with pool.acquire() as conn:
+            await conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    name TEXT PRIMARY KEY,
+                    last_block BIGINT NOT NULL,
+                    updated_at BIGINT NOT NULL
+                )
+            """)
+
+    async def get(self, name: str, default: int = 0):
+        pool = await get_pool(self.db_name)
+        async with pool.acquire() as conn:
+            last_block = await conn.fetchval(f"SELECT last_block FROM {self.table_name} WHERE name = $1", name)
+        return default if last_block is None else last_block
+
+    async def set(self, name: str, last_block: int):
+        pool = await get_pool(self.db_name)
+        async with pool.acquire() as conn:
+            await conn.execute(
+                f"""
+                    INSERT INTO {self.table_name} (name, last_block, updated_at)
+                    VALUES ($1, $2, $3)
+                    ON CONFLICT (name) DO UPDATE
+                    SET last_block = GREATEST({self.table_name}.last_block, EXCLUDED.last_block),
+                    updated_at = EXCLUDED.updated_at
+                """,
+                name, last_block, int(time.time()),
+            )
@@ -0,0 +1,181 @@
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import time
+
+import httpx
+from dotenv import load_dotenv
+from utils import logger
+from utils.db.base import BaseDB, get_pool
+
+load_dotenv("../.env")
+SECRET_KEY = os.environ.get("CRYPTO_SECRET_KEY")
+
+WEBHOOK_URL = "https://gemups.com/api/v1/payment/crypto"
+CONCURRENCY = 5
+BATCH_SIZE = 100
+MAX_ATTEMPTS = 10
+BACKOFF_BASE = 2
+BACKOFF_MAX = 300
+# Выбранное уведомление откладывается на LEASE_SECONDS, чтобы его не взял другой процесс до завершения отправки
+LEASE_SECONDS = 60
+POLL_INTERVAL = 5
+
+
+def sign_payload(data: dict):
+    json_data = json.dumps(data, ensure_ascii=False, separators=(',', ':')).replace('/', '\\/')
+    hash_string = base64.b64encode(json_data.encode('utf-8')).decode('utf-8') + SECRET_KEY
+    return {**data, "sign": hashlib.md5(hash_string.encode('utf-8')).hexdigest()}
+
+
+class WebhookOutbox(BaseDB):
+    """
+    Очередь уведомлений о переводах в БД, отправляется в фоне и не блокирует сканирование
+    """
+    def __init__(self, db_name: str, table_name: str = "transfer_notifications"):
+        super().__init__(db_name, table_name)
+        self.wakeup = asyncio.Event()
+        self.semaphore = asyncio.Semaphore(CONCURRENCY)
+
+    async def create_table(self):
+        pool = await get_pool(self.db_name)
+        async with pool.acquire() as conn:
+            await conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    tx_hash TEXT PRIMARY KEY,
+                    payload JSONB NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at BIGINT NOT NULL,
+                    last_error TEXT,
+                    created_at BIGINT NOT NULL
+                )
+            """)
+            await conn.execute(f"""
+                CREATE INDEX IF NOT EXISTS {self.table_name}_pending_idx
+                ON {self.table_name} (status, next_attempt_at)
+            """)
+
+    async def enqueue(self, conn, txs: list):
+        """
+        Постановка уведомлений в очередь на соединении вызывающего, в его транзакции
+        """
+        now = int(time.time())
+        await conn.executemany(
+            f"""
+                INSERT INTO {self.table_name} (tx_hash, payload, next_attempt_at, created_at)
+                VALUES ($1, $2::JSONB, $3, $3)
+                ON CONFLICT (tx_hash) DO NOTHING
+            """,
+            [
+                (
+                    tx_data["tx_hash"],
+                    json.dumps({
+                        "tx_hash": tx_data["tx_hash"],
+                        "amount": tx_data["amount"],
+                        "ticker": tx_data["ticker"],
+                        "network": tx_data["network"],
+                        "decimal": tx_data["decimal"],
+                        "timestamp": int(tx_data["timestamp"])
+                    }),
+                    now,
+                )
+                for tx_data in txs
+            ],
+        )
+
+    async def run(self):
+        await self.start()
+        async with self.get_client() as client:
+            while True:
+                try:
+                    dispatched = await self.dispatch(client)
+                except Exception as e:
+                    logger.error(f"Webhook outbox dispatch failed {e}")
+                    dispatched = 0
+                if dispatched >= BATCH_SIZE:
+                    continue
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                self.wakeup.clear()
+
+    async def drain(self):
+        """
+        Отправка всех готовых уведомлений и выход, для разовых скриптов
+        """
+        await self.start()
+        async with self.get_client() as client:
+            while await self.dispatch(client):
+                pass
+
+    @staticmethod
+    def get_client():
+        return httpx.AsyncClient(
+            timeout=httpx.Timeout(30, connect=5),
+            limits=httpx.Limits(max_connections=CONCURRENCY, max_keepalive_connections=CONCURRENCY)
+        )
+
+    async def dispatch(self, client: httpx.AsyncClient):
+        now = int(time.time())
+        pool = await get_pool(self.db_name)
+        async with pool.acquire() as conn:
+            rows = await conn.fetch(
+                f"""
+                    UPDATE {self.table_name}
+                    SET next_attempt_at = $2
+                    WHERE tx_hash IN (
+                        SELECT tx_hash FROM {self.table_name}
+                        WHERE status = 'pending' AND next_attempt_at <= $1
+                        ORDER BY next_attempt_at
+                        LIMIT $3
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING tx_hash, payload, attempts
+                """,
+                now, now + LEASE_SECONDS, BATCH_SIZE,
+            )
+        await asyncio.gather(*[self.send(client, row) for row in rows])
+        return len(rows)
+
+    async def send(self, client: httpx.AsyncClient, row):
+        payload = json.loads(row["payload"])
+        try:
+            async with self.semaphore:
+                response = await client.post(WEBHOOK_URL, json=sign_payload(payload))
+            # Ответ 4xx означает, что сайт обработал и отклонил уведомление, повтор не поможет
+            if response.status_code < 500:
+                if response.is_success:
+                    await self.mark(row["tx_hash"], "sent")
+                else:
+                    await self.mark(row["tx_hash"], "rejected", f"HTTP {response.status_code} {response.text[:500]}")
+                    logger.warning(f"Webhook rejected transfer {row['tx_hash']}: {response.status_code}")
+                return
+            error = f"HTTP {response.status_code}"
+        except httpx.HTTPError as e:
+            error = f"{type(e).__name__} {e}"
+        attempts = row["attempts"] + 1
+        if attempts >= MAX_ATTEMPTS:
+            logger.error(f"Webhook for transfer {row['tx_hash']} failed after {attempts} attempts: {error}")
+            await self.mark(row["tx_hash"], "failed", error, attempts)
+            return
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempts)
+        await self.mark(row["tx_hash"], "pending", error, attempts,
+                        int(time.time() + random.uniform(delay / 2, delay)))
+
+    async def mark(self, tx_hash: str, status: str, error: str = None, attempts: int = None, next_attempt_at: int = None):
+        pool = await get_pool(self.db_name)
+        async with pool.acquire() as conn:
+            await conn.execute(
+                f"""
+                    UPDATE {self.table_name}
+                    SET status = $2, last_error = $3, attempts = COALESCE($4, attempts),
+                    next_attempt_at = COALESCE($5, next_attempt_at)
+                    WHERE tx_hash = $1
+                """,
+                tx_hash, status, error, attempts, next_attempt_at,
+            )
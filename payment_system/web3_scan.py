@@ -1,15 +1,26 @@
+import asyncio
 import os
+import time
 
 from config import credentials
 from dotenv import load_dotenv
 from utils import logger
 from utils.db.db_logger import TransferLogger
+from utils.db.scan_cursors import ScanCursors
+from utils.db.webhook_outbox import WebhookOutbox
 
 from providers.okx_wallet import OkxWallet
 
 load_dotenv("../.env")
 
 
+MIN_POLL_INTERVAL = 2
+MAX_POLL_INTERVAL = 15
+POLL_BACKOFF = 1.5
+# Без сохранённой позиции сканирование начинается со времени жизни счёта, более старые депозиты не читаются
+INVOICE_LIFETIME_SECONDS = 12 * 60 * 60
+
+
 class Web3Scan:
     def __init__(self):
         self.db_path = os.getenv("DB_TRANSFERS_ROUTE")
@@ -17,42 +28,75 @@ class Web3Scan:
         self.credentials = credentials
 
         self.network_provider = OkxWallet()
-
-    async def logging_db(self, last_block: int = 0):
-        network_name = ""
+        self.outbox = WebhookOutbox(self.db_path)
+        self.outbox_task = None
+        self.cursors = ScanCursors(self.db_path)
+        self.transfer_loggers = {}
+
+    async def get_transfer_logger(self, network_name: str):
+        if network_name not in self.transfer_loggers:
+            transfer_logger = TransferLogger(self.db_path, network_name, self.outbox)
+            await transfer_logger.start()
+            self.transfer_loggers[network_name] = transfer_logger
+        return self.transfer_loggers[network_name]
+
+    async def log_txs(self, txs: list):
+        networks = {}
+        for tx_data in txs:
+            networks.setdefault(tx_data["network"], []).append(tx_data)
+        transfer_loggers = [await self.get_transfer_logger(network_name) for network_name in networks]
+        await asyncio.gather(*[
+            transfer_logger.log_transfers(networks[transfer_logger.table_name])
+            for transfer_logger in transfer_loggers
+        ])
+
+    async def logging_db(self, account_id: str):
+        """
+        Опрос аккаунта с сохранением позиции в БД.
+        Пока приходят новые операции, опрос идёт с минимальным интервалом, в тишине интервал растёт
+        """
+        cursor_name = f"okx:{account_id}"
+        last_block = await self.cursors.get(cursor_name, None)
+        if last_block is None:
+            last_block = int((time.time() - INVOICE_LIFETIME_SECONDS) * 10**3)
+            await self.cursors.set(cursor_name, last_block)
+        interval = MIN_POLL_INTERVAL
         while True:
             try:
-                txs_resp = await self.network_provider.get_last_txs(last_block)
-                logger.info(txs_resp)
-
-                if txs := txs_resp["txs"]:
-                    last_block = int(txs_resp["last_block"]) + 1
-
-                for tx_data in txs:
-                    network_name = tx_data["network"]
-                    transfer_logger = TransferLogger(self.db_path, network_name)
-
-                    await transfer_logger.start()
-                    await transfer_logger.log_transfer(tx_data)
-                    await transfer_logger.stop()
+                txs_resp = await self.network_provider.get_last_txs(last_block, account_id)
+                txs = txs_resp["txs"]
+                if txs:
+                    logger.info(f"{account_id} | {len(txs)} new transfers, {txs_resp['pages']} pages")
+                    await self.log_txs(txs)
+                # Позиция сдвигается только после записи переводов, при ошибке пачка будет прочитана снова
+                if txs_resp["last_block"] is not None:
+                    last_block = max(last_block, int(txs_resp["last_block"]) + 1)
+                    await self.cursors.set(cursor_name, last_block)
+                if txs or txs_resp["pages"] > 1:
+                    interval = MIN_POLL_INTERVAL
+                else:
+                    interval = min(MAX_POLL_INTERVAL, interval * POLL_BACKOFF)
             except Exception as e:
                 import traceback
 
-                logger.error(f"{network_name} | {e} | {traceback.format_exc()}")
+                logger.error(f"{account_id} | {e} | {traceback.format_exc()}")
+                interval = MAX_POLL_INTERVAL
 
-            await asyncio.sleep(10)
+            await asyncio.sleep(interval)
 
-    # async def start_logging(self):
-    #     tasks = []
-    #     for name, network in self.providers.items():
-    #         tasks.append(asyncio.create_task(self.logging_db(network)))
-    #
-    #     await asyncio.gather(*tasks)
+    async def start_logging(self):
+        await self.cursors.start()
+        await self.outbox.start()
+        # Уведомления сайта отправляются отдельной задачей, медленный ответ не задерживает сканирование
+        self.outbox_task = asyncio.create_task(self.outbox.run())
+        await asyncio.gather(*[
+            self.logging_db(account_id) for account_id in self.network_provider.account_ids
+        ])
 
 
 async def main():
     web3_scan = Web3Scan()
-    await web3_scan.logging_db()
+    await web3_scan.start_logging()
 
 
 if __name__ == "__main__":